@@ -0,0 +1,87 @@
+#!/usr/local/bin/python3
+
+"""Keep qBittorrent's listening port on the port gluetun forwards.
+
+Runs beside qBittorrent and gluetun in the same pod. gluetun writes the port
+its VPN provider forwards to `GLUETUN_PORT_FILE`; the file is watched (see
+servarr_watch) and every new port is pushed through the WebUI preferences API,
+which qBittorrent applies without a restart. A missing or empty file (VPN
+down, port not assigned yet) leaves the current port in place.
+"""
+
+import logging
+import os
+import sys
+
+from servarr_http import HTTPClient, RequestException
+from servarr_qbittorrent import QBittorrentClient
+from servarr_watch import FileWatcher
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+console_handler = logging.StreamHandler()
+log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(log_format)
+logger.addHandler(console_handler)
+
+GLUETUN_PORT_FILE = os.getenv("GLUETUN_PORT_FILE", "/tmp/gluetun/forwarded_port")
+QBITTORRENT_HOST = os.getenv("QBITTORRENT_HOST", "localhost:10095")
+# Optional: qBittorrent does not ask localhost for credentials (WebUI\LocalHostAuth=false)
+TORRENT_USERNAME = os.getenv("TORRENT_USERNAME", "")
+TORRENT_PASSWORD = os.getenv("TORRENT_PASSWORD", "")
+POLL_INTERVAL = float(os.getenv("PORT_SYNC_POLL_INTERVAL", "15"))
+
+
+def parse_port(content):
+    """Port in the file content, or None when there is none yet; ValueError when it is not a port."""
+    text = (content or b"").decode("utf-8", errors="replace").strip()
+    if not text:
+        return None
+    # gluetun writes one port; with several forwarded ports the first one is for the listener
+    first = text.split()[0].split(",")[0]
+    port = int(first) if first.isdigit() else 0
+    if not 0 < port < 65536:
+        raise ValueError("{0!r} is not a port".format(text))
+    return port
+
+
+if POLL_INTERVAL <= 0:
+    logger.error("PORT_SYNC_POLL_INTERVAL must be positive, not %g", POLL_INTERVAL)
+    sys.exit(1)
+
+qbittorrent = QBittorrentClient(HTTPClient(logger=logging.getLogger("servarr_http")), f"http://{QBITTORRENT_HOST}", logger=logger)
+watcher = FileWatcher(GLUETUN_PORT_FILE, POLL_INTERVAL, logger=logger)
+logged_in = not TORRENT_USERNAME
+# Differs from any content, so the first read is always reported
+content = object()
+applied = None
+
+while True:
+    previous, content = content, watcher.read()
+    try:
+        port = parse_port(content)
+    except ValueError as exc:
+        port = None
+        if content != previous:
+            logger.warning("Ignoring %s: %s", GLUETUN_PORT_FILE, exc)
+    else:
+        if port is None and content != previous:
+            logger.info("No forwarded port in %s; keeping the current listening port", GLUETUN_PORT_FILE)
+
+    if port is not None and port != applied:
+        try:
+            if not logged_in:
+                qbittorrent.login(TORRENT_USERNAME, TORRENT_PASSWORD)
+                logged_in = True
+            current = qbittorrent.preferences().get("listen_port")
+            if current != port:
+                qbittorrent.set_preferences({"listen_port": port, "random_port": False})
+                logger.info("qBittorrent listening port changed from %s to the forwarded port %d", current, port)
+            else:
+                logger.info("qBittorrent already listens on the forwarded port %d", port)
+            applied = port
+        except (RequestException, ValueError) as exc:
+            # qBittorrent not up yet or restarting: retried after the next wait
+            logger.warning("Unable to set the qBittorrent listening port to %d: %s", port, exc)
+    watcher.wait()
@@ -10,8 +10,11 @@ import os
 import sys
 import xml.etree.ElementTree as ET
 
-import requests
-import yaml
+from servarr_http import HTTPClient, HTTPError, RequestException
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_api_key, wait_for_http, wait_until
+from servarr_state import AppliedState, file_bytes, fingerprint, state_path
+from servarr_yaml import parse_yaml_mappings
 
 
 logger = logging.getLogger(__name__)
@@ -20,14 +23,17 @@ console_handler = logging.StreamHandler()
 log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(log_format)
 logger.addHandler(console_handler)
+start_run("bazarr", logger=logger)
 
 BAZARR_HOST = os.getenv("BAZARR_HOST")
+RADARR_HOST = os.getenv("RADARR_HOST")
+SONARR_HOST = os.getenv("SONARR_HOST")
 BAZARR_CONFIG_PATH = os.getenv("BAZARR_CONFIG_PATH")
 RADARR_CONFIG_PATH = os.getenv("RADARR_CONFIG_PATH")
 SONARR_CONFIG_PATH = os.getenv("SONARR_CONFIG_PATH")
 RADARR_SERVICE = os.getenv("RADARR_SERVICE")
 SONARR_SERVICE = os.getenv("SONARR_SERVICE")
-BAZARR_SETTINGS_PATH = "/mnt/bazarr-settings.json"
+BAZARR_SETTINGS_PATH = os.getenv("BAZARR_SETTINGS_PATH", "/mnt/bazarr-settings.json")
 
 
 def load_json_file(path: str) -> list:
@@ -43,10 +49,21 @@ def load_json_file(path: str) -> list:
         return []
 
 
+def read_bazarr_api_key(path: str):
+    """auth.apikey of the Bazarr config, or None until Bazarr has written it."""
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            config = parse_yaml_mappings(handle.read()) or {}
+    except (OSError, ValueError):
+        return None
+    api_key = str((config.get("auth") or {}).get("apikey") or "").strip()
+    return api_key or None
+
+
 def load_bazarr_api_key(path: str) -> str:
     try:
         with open(path, "r", encoding="utf-8") as handle:
-            config = yaml.safe_load(handle) or {}
+            config = parse_yaml_mappings(handle.read()) or {}
         auth = config.get("auth") or {}
         api_key = auth.get("apikey")
         if not api_key:
@@ -54,10 +71,8 @@ def load_bazarr_api_key(path: str) -> str:
         return str(api_key).strip()
     except FileNotFoundError:
         logger.error("Bazarr config file %s not found", path)
-    except yaml.YAMLError as exc:
-        logger.error("Unable to parse Bazarr configuration (%s): %s", path, exc)
     except ValueError as exc:
-        logger.error("%s", exc)
+        logger.error("Unable to read Bazarr configuration (%s): %s", path, exc)
     sys.exit(1)
 
 
@@ -77,6 +92,11 @@ def load_arr_api_key(path: str, label: str) -> str:
     sys.exit(1)
 
 
+# The apps write their API keys on first start, wait for them rather than failing the Job
+wait_until(f"Bazarr apikey in {BAZARR_CONFIG_PATH}", lambda: read_bazarr_api_key(BAZARR_CONFIG_PATH), logger=logger)
+wait_for_api_key(RADARR_CONFIG_PATH, "Radarr", logger=logger)
+wait_for_api_key(SONARR_CONFIG_PATH, "Sonarr", logger=logger)
+
 # Load API Keys
 logger.info("Loading Bazarr API Key from %s", BAZARR_CONFIG_PATH)
 API_KEY = load_bazarr_api_key(BAZARR_CONFIG_PATH)
@@ -90,6 +110,23 @@ logger.info("Loading Sonarr API Key from %s", SONARR_CONFIG_PATH)
 SONARR_API_KEY = load_arr_api_key(SONARR_CONFIG_PATH, "Sonarr")
 logger.debug("Loaded Sonarr API Key: %s", SONARR_API_KEY)
 
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    os.getenv("BAZARR_STATE_PATH", state_path(BAZARR_CONFIG_PATH, "bazarr-applied.json")),
+    fingerprint(
+        file_bytes(__file__),
+        file_bytes(BAZARR_SETTINGS_PATH),
+        [API_KEY, RADARR_API_KEY, SONARR_API_KEY, RADARR_SERVICE, SONARR_SERVICE],
+    ),
+    logger=logger,
+)
+applied_state.skip_if_unchanged()
+
+# Bazarr syncs with Radarr and Sonarr as soon as they are enabled
+wait_for_http("Bazarr API", f"http://{BAZARR_HOST}/api/system/status", headers={"x-api-key": API_KEY}, logger=logger)
+wait_for_http("Radarr API", f"http://{RADARR_HOST}/api/v3/system/status", headers={"x-api-key": RADARR_API_KEY}, logger=logger)
+wait_for_http("Sonarr API", f"http://{SONARR_HOST}/api/v3/system/status", headers={"x-api-key": SONARR_API_KEY}, logger=logger)
+
 # Load settings from mounted JSON file (list of [key, value] pairs)
 logger.info("Loading Bazarr settings from %s", BAZARR_SETTINGS_PATH)
 settings = load_json_file(BAZARR_SETTINGS_PATH)
@@ -105,19 +142,20 @@ form_entries.extend([
     ("settings-sonarr-apikey", SONARR_API_KEY),
 ])
 
+begin_phase("settings")
 logger.info("Configuring Bazarr with %d settings", len(form_entries))
 headers = {"x-api-key": API_KEY}
 SETTINGS_ENDPOINT = f"http://{BAZARR_HOST}/api/system/settings"
 
 try:
-    response = requests.post(SETTINGS_ENDPOINT, headers=headers, data=form_entries)
-    logger.debug("Status Code: %s Response body: %s", response.status_code, response.text)
+    response = HTTPClient(logger=logger).post(SETTINGS_ENDPOINT, headers=headers, data=form_entries)
     response.raise_for_status()
-except requests.HTTPError as exc:
+except HTTPError as exc:
     logger.error("There was an error while configuring Bazarr: %s", exc)
     sys.exit(1)
-except requests.RequestException as exc:
+except RequestException as exc:
     logger.error("Unable to reach Bazarr settings endpoint: %s", exc)
     sys.exit(1)
 
 logger.info("Bazarr settings updated successfully")
+applied_state.record()
@@ -3,20 +3,26 @@
 import json
 import logging
 import os
-import requests
 import sys
 
+from servarr_http import HTTPClient, decode
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_http
+from servarr_state import STATE_DIR_NAME, AppliedState, file_bytes, fingerprint
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 handler = logging.StreamHandler()
 handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
 logger.addHandler(handler)
+start_run("homarr", logger=logger)
 
 HOMARR_HOST = os.getenv("HOMARR_HOST", "localhost:7575")
 USERNAME = os.getenv("HOMARR_USERNAME", "admin")
 PASSWORD = os.getenv("HOMARR_PASSWORD", "admin123")
 HOMARR_CONFIG_PATH = os.getenv("HOMARR_CONFIG_PATH", "/mnt/homarr-config.json")
+STATE_PATH = os.getenv("HOMARR_STATE_PATH", os.path.join("/homarr-data", STATE_DIR_NAME, "homarr-applied.json"))
 
 
 class APIError(Exception):
@@ -25,30 +31,27 @@ class APIError(Exception):
         self.status_code = status_code
         self.body = body
 
-SESSION = requests.Session()
+SESSION = HTTPClient(logger=logger)
 def post(url: str, headers: dict, body: dict, use_json: bool = True) -> dict:
-    logger.debug(" ".join([
-        "POST",
-        url,
-        ", ".join(f'{key}: {value}' for key,value in headers.items()),
-        str(body)
-    ]))
     kwargs = {"json": body} if use_json else {"data": body}
-    response = SESSION.post(url=url, headers=headers, **kwargs)
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text
-    ]))
-    try:
-        payload = response.json()
-    except json.JSONDecodeError:
-        payload = response.text
+    response = SESSION.post(url, headers=headers, **kwargs)
+    payload = decode(response)
     if response.status_code >= 300:
         raise APIError(response.status_code, payload)
     return payload
 
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    STATE_PATH,
+    fingerprint(file_bytes(__file__), file_bytes(HOMARR_CONFIG_PATH), [USERNAME, PASSWORD]),
+    logger=logger,
+)
+applied_state.skip_if_unchanged()
+
+# The auth endpoints used below are the last ones to come up while Homarr starts
+wait_for_http("Homarr", f"http://{HOMARR_HOST}/api/auth/csrf", logger=logger)
+
+begin_phase("owner-account")
 logger.info("Creating Homarr owner account")
 try:
     post(
@@ -74,6 +77,7 @@ except APIError as e:
 else:
     logger.info("Homarr owner account created successfully.")
 
+begin_phase("dashboard")
 # Determine dashboard payload
 if os.path.exists(HOMARR_CONFIG_PATH):
     logger.info("Loading Homarr dashboard payload from %s", HOMARR_CONFIG_PATH)
@@ -93,19 +97,10 @@ else:
 try:
     logger.info("Requesting Homarr CSRF token")
     csrf_response = SESSION.get(
-        url=f"http://{HOMARR_HOST}/api/auth/csrf",
+        f"http://{HOMARR_HOST}/api/auth/csrf",
         headers={"Content-Type": "application/json"}
     )
-    logger.debug(" ".join([
-        "Status Code:",
-        str(csrf_response.status_code),
-        "Response body:",
-        csrf_response.text
-    ]))
-    try:
-        csrf_payload = csrf_response.json()
-    except json.JSONDecodeError:
-        csrf_payload = csrf_response.text
+    csrf_payload = decode(csrf_response)
     if csrf_response.status_code >= 300:
         raise APIError(csrf_response.status_code, csrf_payload)
     csrf_token = csrf_payload.get("csrfToken") if isinstance(csrf_payload, dict) else None
@@ -141,3 +136,5 @@ try:
 except APIError as e:
     logger.error(f"Failed to save Homarr dashboard: {e.status_code} {e.body}")
     sys.exit(1)
+
+applied_state.record()
@@ -5,7 +5,11 @@ import logging
 import os
 import sqlite3
 import sys
-import requests
+
+from servarr_http import HTTPClient, decode
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_http
+from servarr_state import STATE_DIR_NAME, AppliedState, file_bytes, fingerprint
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -13,6 +17,7 @@ console_handler = logging.StreamHandler()
 log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(log_format)
 logger.addHandler(console_handler)
+start_run("jellyfin", logger=logger)
 
 JELLYFIN_HOST = os.getenv("JELLYFIN_HOST", "localhost:8096")
 JELLYFIN_USERNAME = os.getenv("JELLYFIN_USERNAME", "admin")
@@ -21,24 +26,12 @@ COUNTRY_CODE = os.getenv("COUNTRY_CODE", "US")
 PREFERRED_LANGUAGE = os.getenv("PREFERRED_LANGUAGE", "en-US")
 TRANSCODER_ENABLED = os.getenv("JELLYFIN_TRANSCODER_ENABLED", "false").lower() in ("1", "true", "yes", "on")
 TRANSCODER_BODY_FILE = os.getenv("JELLYFIN_TRANSCODER_BODY_FILE", "/config/jellyfin-transcoder-body.json")
+STATE_PATH = os.getenv("JELLYFIN_STATE_PATH", os.path.join("/config", STATE_DIR_NAME, "jellyfin-applied.json"))
+
+client = HTTPClient(logger=logger)
 
 def get(url: str, headers: dict):
-    logger.debug(" ".join([
-        "GET",
-        url,
-        ", ".join(f'{key}: {value}' for key,value in headers.items())
-    ]))
-    response = requests.get(
-        url=url,
-        headers=headers
-    )
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text
-    ]))
-    return response
+    return client.get(url, headers=headers)
 
 class APIError(Exception):
     def __init__(self, status_code: int, body: dict | str):
@@ -47,29 +40,30 @@ class APIError(Exception):
         self.body = body
 
 def post(description: str, url: str, headers: dict, body: dict) -> dict:
-    logger.debug(" ".join([
-        "POST",
-        url,
-        ", ".join(f'{key}: {value}' for key,value in headers.items()),
-        str(body)
-    ]))
-    response = requests.post(url=url, json=body, headers=headers)
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text
-    ]))
-    try:
-        payload = response.json()
-    except json.JSONDecodeError:
-        payload = response.text
+    response = client.post(url, json=body, headers=headers)
+    payload = decode(response)
     if response.status_code >= 300:
         raise APIError(response.status_code, payload)
     return payload
 
 JSON_HEADERS = {"Content-Type": "application/json" }
 
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    STATE_PATH,
+    fingerprint(
+        file_bytes(__file__),
+        file_bytes(TRANSCODER_BODY_FILE) if TRANSCODER_ENABLED else b"",
+        [JELLYFIN_USERNAME, JELLYFIN_PASSWORD, COUNTRY_CODE, PREFERRED_LANGUAGE, TRANSCODER_ENABLED],
+    ),
+    logger=logger,
+)
+applied_state.skip_if_unchanged()
+
+# Public system info is served once Jellyfin finished starting, before the startup wizard ran
+wait_for_http("Jellyfin", f"http://{JELLYFIN_HOST}/System/Info/Public", logger=logger)
+
+begin_phase("startup-wizard")
 logger.info("Jellyfin initial setup")
 try:
     post(
@@ -240,6 +234,7 @@ except APIError as exc:
         logger.error("Received unexpected status code %s while setting the location: %s", exc.status_code, exc.body)
         sys.exit(1)
 
+begin_phase("transcoding")
 if TRANSCODER_ENABLED:
     logger.info("Setting hardware accelerated transcoding via Jellyfin API")
     auth = post(
@@ -275,3 +270,5 @@ if TRANSCODER_ENABLED:
     )
 else:
     logger.info("Skipping hardware accelerated transcoding configuration because it is disabled")
+
+applied_state.record()
@@ -1,12 +1,16 @@
 #!/usr/local/bin/python3
 
-from json import JSONDecodeError, load, dumps
+from json import JSONDecodeError, load
 import logging
 import os
-import requests
 import sys
 import xml.etree.ElementTree as ET
 
+from servarr_http import HTTPClient, HTTPError, decode
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_api_key, wait_for_http, wait_until
+from servarr_state import AppliedState, file_bytes, fingerprint, state_path
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -14,6 +18,7 @@ console_handler = logging.StreamHandler()
 log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(log_format)
 logger.addHandler(console_handler)
+start_run("jellyseerr", logger=logger)
 
 JELLYSEERR_SETTINGS_PATH = os.getenv("JELLYSEERR_SETTINGS_PATH", "/app/config/settings.json")
 JELLYSEERR_HOST = os.getenv("JELLYSEERR_HOST")
@@ -40,7 +45,7 @@ logger.debug("RADARR_HOST: %s, RADARR_PORT: %s", RADARR_HOST, RADARR_PORT)
 SONARR_HOST, SONARR_PORT = SONARR_HOST.split(":", 1)
 logger.debug("SONARR_HOST: %s, SONARR_PORT: %s", SONARR_HOST, SONARR_PORT)
 
-session = requests.Session()
+client = HTTPClient(logger=logger)
 
 def load_api_key(path: str, label: str) -> str:
     try:
@@ -57,6 +62,10 @@ def load_api_key(path: str, label: str) -> str:
         logger.error("%s", exc)
     sys.exit(1)
 
+# The apps write their API keys on first start, wait for them rather than failing the Job
+wait_for_api_key(SONARR_CONFIG_PATH, "Sonarr", logger=logger)
+wait_for_api_key(RADARR_CONFIG_PATH, "Radarr", logger=logger)
+
 logger.info("Loading Sonarr API Key from %s", SONARR_CONFIG_PATH)
 SONARR_API_KEY = load_api_key(SONARR_CONFIG_PATH, "Sonarr")
 logger.debug("Loaded Sonarr API Key: %s", SONARR_API_KEY)
@@ -65,6 +74,17 @@ logger.info("Loading Radarr API Key from %s", RADARR_CONFIG_PATH)
 RADARR_API_KEY = load_api_key(RADARR_CONFIG_PATH, "Radarr")
 logger.debug("Loaded Radarr API Key: %s", RADARR_API_KEY)
 
+def read_jellyseerr_api_key(path: str):
+    """main.apiKey of the Jellyseerr settings, or None until Jellyseerr has written it."""
+    try:
+        with open(path, encoding="utf-8") as settings_file:
+            settings = load(settings_file)
+    except (OSError, JSONDecodeError):
+        return None
+    main_settings = settings.get("main") if isinstance(settings, dict) else None
+    api_key = main_settings.get("apiKey") if isinstance(main_settings, dict) else None
+    return api_key.strip() if isinstance(api_key, str) and api_key.strip() else None
+
 def load_jellyseerr_api_key(path: str) -> str:
     try:
         with open(path, encoding="utf-8") as settings_file:
@@ -87,97 +107,67 @@ def load_jellyseerr_api_key(path: str) -> str:
         sys.exit(1)
     return api_key
 
+wait_until(
+    f"Jellyseerr apiKey in {JELLYSEERR_SETTINGS_PATH}",
+    lambda: read_jellyseerr_api_key(JELLYSEERR_SETTINGS_PATH),
+    logger=logger,
+)
+
 # Load Jellyseerr API Key for auth in all requests
 logger.info("Loading Jellyseerr API Key from %s", JELLYSEERR_SETTINGS_PATH)
 JELLYSEERR_API_KEY = load_jellyseerr_api_key(JELLYSEERR_SETTINGS_PATH)
 logger.debug("Loaded Jellyseerr API Key: %s", JELLYSEERR_API_KEY)
-session.headers.update({"X-Api-Key": JELLYSEERR_API_KEY})
+client.headers.update({"X-Api-Key": JELLYSEERR_API_KEY})
 
 jellyseer_url = "http://{0}:{1}".format(JELLYSEERR_HOST, JELLYSEERR_PORT)
+
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    os.getenv("JELLYSEERR_STATE_PATH", state_path(JELLYSEERR_SETTINGS_PATH, "jellyseerr-applied.json")),
+    fingerprint(
+        file_bytes(__file__),
+        [JELLYSEERR_API_KEY, RADARR_API_KEY, SONARR_API_KEY, JELLYFIN_USERNAME, JELLYFIN_PASSWORD, JELLYFIN_EMAIL],
+        [JELLYFIN_HOST, JELLYFIN_PORT, RADARR_HOST, RADARR_PORT, SONARR_HOST, SONARR_PORT],
+        [os.getenv(name) for name in ("TELEGRAM_NOTIFICATION_ENABLED", "TELEGRAM_CHAT_ID", "TELEGRAM_BOT_APITOKEN")],
+    ),
+    logger=logger,
+)
+applied_state.skip_if_unchanged()
+
+# Jellyseerr signs in to Jellyfin and tests the Radarr/Sonarr connections while being configured
+wait_for_http("Jellyseerr", f"{jellyseer_url}/api/v1/status", logger=logger)
+wait_for_http("Jellyfin", f"http://{JELLYFIN_HOST}:{JELLYFIN_PORT}/System/Info/Public", logger=logger)
+wait_for_http(
+    "Radarr API",
+    f"http://{RADARR_HOST}:{RADARR_PORT}/api/v3/system/status",
+    headers={"x-api-key": RADARR_API_KEY},
+    logger=logger,
+)
+wait_for_http(
+    "Sonarr API",
+    f"http://{SONARR_HOST}:{SONARR_PORT}/api/v3/system/status",
+    headers={"x-api-key": SONARR_API_KEY},
+    logger=logger,
+)
+
 def make_get(endpoint=""):
-    url = "{0}{1}".format(jellyseer_url, endpoint)
-    logger.debug(" ".join([
-        url,
-        "GET",
-        ", ".join([f'{key}: {value}' for key,value in session.headers.items()]),
-        ", ".join([f'{key}: {value}' for key,value in session.cookies.items()])
-    ]))
-    response = session.get(
-        url=url,
-        verify=False,
-    )
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text
-    ]))
+    response = client.get("{0}{1}".format(jellyseer_url, endpoint))
     response.raise_for_status()
-    try:
-        return response.json()
-    except JSONDecodeError:
-        return response.text
+    return decode(response)
 def make_post(endpoint="", body=None, acceptable_response=None):
     url = "{0}{1}".format(jellyseer_url, endpoint)
-    logger.debug(" ".join([
-        url,
-        "POST",
-        "Body:",
-        str(body),
-        ", ".join([f'{key}: {value}' for key,value in session.headers.items()]),
-        ", ".join([f'{key}: {value}' for key,value in session.cookies.items()])
-    ]))
-    response = session.post(
-        url=url,
-        json=body,
-        verify=False,
-    )
-    response_text = response.text
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response_text
-    ]))
     try:
-        response_json = response.json()
-    except JSONDecodeError:
-        response_json = None
-    
-    if response.status_code < 300:
-        return response_json if response_json is not None else response_text
-
-    # process acceptable responses - for idempotent runs
-    def normalize(value):
-        if value is None:
-            return None
-        if isinstance(value, dict):
-            value = dumps(value, sort_keys=True)
-        return "".join(str(value).split()).lower()
-
-    normalized_response_body = normalize(response_json if isinstance(response_json, dict) else response_text)
-    matched_expected = False
-    if acceptable_response:
-        expected_status, expected_body = acceptable_response
-        if response.status_code == expected_status:
-            normalized_expected = normalize(expected_body if expected_body is not None else None)
-            if normalized_expected is None or normalized_expected == normalized_response_body:
-                matched_expected = True
-                logger.debug(
-                    "Received expected %s response from %s; continuing initialization.",
-                    response.status_code,
-                    url,
-                )
-    if not matched_expected:
-        logger.error("Unexpected response from %s: %s %s", url, response.status_code, response_text)
-        response.raise_for_status()
-    return response_json if response_json is not None else response_text
+        return client.call("post", url, body=body, acceptable_response=acceptable_response)
+    except HTTPError as exc:
+        logger.error("Unexpected response from %s: %s %s", url, exc.response.status_code, exc.response.text)
+        raise
 
 
 logger.info("Initizalizing JellySeer")
 
 # ########## JELLYFIN INTEGRATION
 
+begin_phase("jellyfin")
 logger.info("Integrating Jellyfin")
 jellyfin_endpoint = "/api/v1/auth/jellyfin"
 make_post(
@@ -197,6 +187,7 @@ make_post(
 
 ############ RADARR
 
+begin_phase("radarr")
 logger.info("Integrating Radarr")
 radarr_endpoint = "/api/v1/settings/radarr"
 existing_radarr = make_get(radarr_endpoint)
@@ -228,6 +219,7 @@ else:
 
 ############ SONARR
 
+begin_phase("sonarr")
 logger.info("Integrating Sonarr")
 sonarr_endpoint = "/api/v1/settings/sonarr"
 existing_sonarr = make_get(sonarr_endpoint)
@@ -266,6 +258,7 @@ else:
 
 ############ FINALIZE
 
+begin_phase("finalize")
 logger.info("Finalization phase")
 response = make_post("/api/v1/settings/initialize", body={})
 response = make_post("/api/v1/settings/main", body={"locale":"en"})
@@ -289,3 +282,5 @@ if enable_telegram:
             "sendSilently": False,
         }
         telegram_response = make_post(telegram_endpoint, body=telegram_body)
+
+applied_state.record()
@@ -0,0 +1,151 @@
+#!/usr/local/bin/python3
+
+"""Run the per-app init scripts as a dependency graph inside a single Job.
+
+The plan (`INIT_PLAN_PATH`, rendered by Helm) lists the steps, the script each
+one runs, the steps it needs and the environment it adds on top of the Job's.
+Every step starts as soon as the steps it needs have succeeded, so independent
+apps are configured concurrently and the run takes about as long as the
+longest chain. A failed step skips its dependents, the others keep going.
+"""
+
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from queue import Queue
+
+from servarr_metrics import add_phase, start_run
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+console_handler = logging.StreamHandler()
+log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(log_format)
+logger.addHandler(console_handler)
+start_run("orchestrator", logger=logger)
+
+PLAN_PATH = os.getenv("INIT_PLAN_PATH", "/mnt/init-plan.json")
+SCRIPTS_DIR = os.getenv("INIT_SCRIPTS_DIR", os.path.dirname(os.path.abspath(__file__)))
+MAX_PARALLEL = int(os.getenv("INIT_MAX_PARALLEL", "0"))
+
+
+def load_plan(path: str) -> dict:
+    """Read the plan and check that it describes a valid graph."""
+    try:
+        with open(path, encoding="utf-8") as plan_file:
+            plan = json.load(plan_file)
+    except FileNotFoundError:
+        logger.error("Init plan %s not found", path)
+        sys.exit(1)
+    except json.JSONDecodeError as exc:
+        logger.error("Unable to parse init plan %s: %s", path, exc)
+        sys.exit(1)
+
+    steps = {}
+    for step in plan.get("steps", []):
+        if step["name"] in steps:
+            logger.error("Step %s is defined twice in %s", step["name"], path)
+            sys.exit(1)
+        steps[step["name"]] = {"needs": [], "env": {}, **step}
+
+    for name, step in steps.items():
+        unknown = [need for need in step["needs"] if need not in steps]
+        if unknown:
+            logger.error("Step %s needs unknown steps: %s", name, ", ".join(unknown))
+            sys.exit(1)
+
+    # Kahn's algorithm: whatever cannot be ordered is part of a cycle.
+    pending = {name: set(step["needs"]) for name, step in steps.items()}
+    while True:
+        ready = [name for name, needs in pending.items() if not needs]
+        if not ready:
+            break
+        for name in ready:
+            del pending[name]
+        for needs in pending.values():
+            needs.difference_update(ready)
+    if pending:
+        logger.error("Init plan has a dependency cycle between: %s", ", ".join(sorted(pending)))
+        sys.exit(1)
+    return steps
+
+
+def stream_output(name: str, process: subprocess.Popen):
+    """Forward a step's output line by line, prefixed so interleaved steps stay readable."""
+    for line in process.stdout:
+        sys.stdout.write(f"[{name}] {line}")
+        sys.stdout.flush()
+
+
+def run_step(name: str, step: dict, finished: Queue):
+    started = time.monotonic()
+    env = {**os.environ, **{key: str(value) for key, value in step["env"].items()}}
+    try:
+        process = subprocess.Popen(
+            [sys.executable, "-u", os.path.join(SCRIPTS_DIR, step["script"])],
+            cwd=SCRIPTS_DIR,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+        )
+    except OSError as exc:
+        logger.error("Unable to start step %s: %s", name, exc)
+        finished.put((name, -1, time.monotonic() - started))
+        return
+    stream_output(name, process)
+    finished.put((name, process.wait(), time.monotonic() - started))
+
+
+steps = load_plan(PLAN_PATH)
+logger.info("Running %d init steps: %s", len(steps), ", ".join(steps))
+
+started = time.monotonic()
+finished = Queue()
+results = {}
+running = set()
+waiting = dict(steps)
+
+while waiting or running:
+    for name, step in list(waiting.items()):
+        if MAX_PARALLEL and len(running) >= MAX_PARALLEL:
+            break
+        statuses = [results.get(need) for need in step["needs"]]
+        if any(status in ("failed", "skipped") for status in statuses):
+            failed_needs = [need for need in step["needs"] if results.get(need) != "succeeded"]
+            logger.error("Skipping %s because %s did not succeed", name, ", ".join(failed_needs))
+            results[name] = "skipped"
+            del waiting[name]
+            continue
+        if all(status == "succeeded" for status in statuses):
+            logger.info("Starting %s", name)
+            del waiting[name]
+            running.add(name)
+            threading.Thread(target=run_step, args=(name, step, finished), daemon=True).start()
+
+    if not running:
+        # Everything left waits on a skipped step; the next pass marks it skipped.
+        continue
+
+    name, returncode, duration = finished.get()
+    running.discard(name)
+    add_phase(name, duration)
+    if returncode == 0:
+        results[name] = "succeeded"
+        logger.info("Step %s succeeded in %.1fs", name, duration)
+    else:
+        results[name] = "failed"
+        logger.error("Step %s failed with exit code %s after %.1fs", name, returncode, duration)
+
+logger.info("Init finished in %.1fs", time.monotonic() - started)
+for name in steps:
+    logger.info("  %-12s %s", name, results[name])
+
+if any(status != "succeeded" for status in results.values()):
+    sys.exit(1)
@@ -0,0 +1,88 @@
+#!/usr/local/bin/python3
+
+"""Sync the custom Prowlarr indexer definitions before the Prowlarr init step.
+
+Only definitions that are new or changed upstream are written, and only the
+ones this sync added are removed (see servarr_definitions). Without network
+access the definitions of the last sync stay in place, and a vendored bundle
+(`DEFINITIONS_BUNDLE`) can replace the upstream repository entirely.
+"""
+
+import logging
+import os
+import sys
+
+from servarr_definitions import BundleSource, DefinitionSync, GitHubSource
+from servarr_http import HTTPClient, RequestException
+from servarr_metrics import begin_phase, start_run
+from servarr_state import STATE_DIR_NAME
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+console_handler = logging.StreamHandler()
+log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(log_format)
+logger.addHandler(console_handler)
+start_run("prowlarr-definitions", logger=logger)
+
+PROWLARR_DATA_PATH = os.getenv("PROWLARR_DATA_PATH", "/config")
+DEFINITIONS_TARGET = os.getenv("DEFINITIONS_TARGET", os.path.join(PROWLARR_DATA_PATH, "Definitions", "Custom"))
+DEFINITIONS_REPOSITORY = os.getenv("DEFINITIONS_REPOSITORY", "dreulavelle/Prowlarr-Indexers")
+DEFINITIONS_REF = os.getenv("DEFINITIONS_REF", "main")
+DEFINITIONS_DIRECTORY = os.getenv("DEFINITIONS_DIRECTORY", "Custom")
+DEFINITIONS_API_URL = os.getenv("DEFINITIONS_API_URL", "https://api.github.com")
+DEFINITIONS_BUNDLE = os.getenv("DEFINITIONS_BUNDLE", "")
+DEFINITIONS_OWNER = os.getenv("DEFINITIONS_OWNER", "568:568")
+STATE_PATH = os.getenv(
+    "DEFINITIONS_STATE_PATH",
+    os.path.join(PROWLARR_DATA_PATH, STATE_DIR_NAME, "prowlarr-definitions.json"),
+)
+
+owner = None
+if DEFINITIONS_OWNER:
+    uid, _, gid = DEFINITIONS_OWNER.partition(":")
+    owner = (int(uid), int(gid or uid))
+
+if DEFINITIONS_BUNDLE:
+    if not os.path.exists(DEFINITIONS_BUNDLE):
+        logger.error("Definitions bundle %s not found", DEFINITIONS_BUNDLE)
+        sys.exit(1)
+    source = BundleSource(DEFINITIONS_BUNDLE)
+else:
+    source = GitHubSource(
+        HTTPClient(logger=logger),
+        DEFINITIONS_REPOSITORY,
+        DEFINITIONS_REF,
+        DEFINITIONS_DIRECTORY,
+        api_url=DEFINITIONS_API_URL,
+    )
+
+sync = DefinitionSync(DEFINITIONS_TARGET, STATE_PATH, owner=owner, logger=logger)
+
+begin_phase("sync")
+logger.info("Syncing custom indexer definitions from %s into %s", source.describe(), DEFINITIONS_TARGET)
+try:
+    changes = sync.sync(source)
+except RequestException as exc:
+    # Prowlarr keeps working with the definitions it already has; the next upgrade catches up.
+    logger.warning(
+        "Unable to reach %s (%s); keeping the %d definitions of the last sync",
+        source.describe(),
+        exc,
+        sync.keep(),
+    )
+    sys.exit(0)
+except (OSError, ValueError, KeyError) as exc:
+    logger.error("Unable to sync the custom indexer definitions: %s", exc)
+    sys.exit(1)
+
+for outcome in ("written", "removed"):
+    if changes[outcome]:
+        logger.info("Definitions %s: %s", outcome, ", ".join(changes[outcome]))
+logger.info(
+    "Definitions synced: %d written, %d removed, %d unchanged",
+    len(changes["written"]),
+    len(changes["removed"]),
+    len(changes["unchanged"]),
+)
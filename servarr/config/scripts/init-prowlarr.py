@@ -3,9 +3,19 @@
 import json
 import logging
 import os
-import requests
 import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from servarr_http import HTTPClient, RequestException, decode
+from servarr_indexers import IndexerSchema, expand, is_compact, read_declarations, resolve_tags, validate
+from servarr_limiter import AdaptiveLimiter
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_api_key, wait_for_http
+from servarr_resources import Application, DownloadClient, Indexer, IndexerProxy
+from servarr_state import AppliedState, Checkpoint, file_bytes, files_digest, fingerprint, state_path, write_atomic
 
 
 logger = logging.getLogger(__name__)
@@ -14,6 +24,7 @@ console_handler = logging.StreamHandler()
 log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(log_format)
 logger.addHandler(console_handler)
+start_run("prowlarr", logger=logger)
 
 PROWLARR_HOST = os.getenv("PROWLARR_HOST")
 PROWLARR_CONFIG_PATH = os.getenv("PROWLARR_CONFIG_PATH")
@@ -26,6 +37,20 @@ PROWLARR_SERVICE = os.getenv("PROWLARR_SERVICE")
 RADARR_SERVICE = os.getenv("RADARR_SERVICE")
 FLARESOLVERR_SERVICE = os.getenv("FLARESOLVERR_SERVICE")
 SONARR_SERVICE = os.getenv("SONARR_SERVICE")
+INDEXER_MAX_CONCURRENCY = max(1, int(os.getenv("INDEXER_MAX_CONCURRENCY", "4")))
+INDEXER_LATENCY_TARGET = float(os.getenv("INDEXER_LATENCY_TARGET", "10"))
+INDEXER_MAX_ATTEMPTS = 3
+BULK_SYNC = os.getenv("INDEXER_BULK_SYNC", "true").lower() in ("1", "true", "yes", "on")
+# "abort" stops at the first indexer that cannot be added, "continue" adds the rest and reports failures.
+INDEXER_FAILURE_POLICY = os.getenv("INDEXER_FAILURE_POLICY", "abort").lower()
+APPLICATION_SYNC_TIMEOUT = float(os.getenv("APPLICATION_SYNC_TIMEOUT", "600"))
+# In bulk mode applications are registered with sync held off, then released once all indexers are in.
+APPLICATION_SYNC_LEVEL = "disabled" if BULK_SYNC else "fullSync"
+MANAGED_APPLICATIONS = ("Radarr", "Sonarr")
+# Statuses that mean Prowlarr is overloaded rather than the indexer being invalid (0: connection error).
+RETRYABLE_STATUSES = (0, 429, 502, 503, 504)
+# Of those, the ones that leave it unknown whether Prowlarr processed the request before the answer was lost
+AMBIGUOUS_STATUSES = (0, 502, 504)
 
 def load_api_key(path: str, label: str) -> str:
     """Read the ApiKey from the specified config file."""
@@ -45,57 +70,273 @@ def load_api_key(path: str, label: str) -> str:
 
     sys.exit(1)
 
-def _request(method: str, url: str, headers: dict, **kwargs):
-    logger.debug(" ".join([
-        method.upper(),
-        url,
-        ", ".join(f"{key}: {value}" for key, value in headers.items()),
-        str(kwargs.get("json") or ""),
-    ]))
-    response = requests.request(method=method, url=url, headers=headers, **kwargs)
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text,
-    ]))
-    try:
-        payload = response.json()
-    except json.JSONDecodeError:
-        payload = response.text
-    return response.status_code, payload, response
+client = HTTPClient(logger=logger)
 
 def post(url: str, headers: dict, body: dict):
-    status, payload, _ = _request("post", url, headers, json=body)
-    return {"code": status, "response": payload}
+    response = client.post(url, json=body, headers=headers)
+    return {"code": response.status_code, "response": decode(response)}
 
 def get(url: str, headers: dict):
-    status, payload, response = _request("get", url, headers)
-    if status >= 400:
-        response.raise_for_status()
-    return payload
+    response = send_with_retries("GET {}".format(url), lambda: client.get(url, headers=headers))
+    response.raise_for_status()
+    return decode(response)
+
+class ResourceSnapshot:
+    """In-memory copy of a Prowlarr collection as typed resources, keyed by lowercased name.
+
+    The collection is downloaded on first use only; resources created by this
+    script are added locally so later existence checks never hit the API again.
+    """
+
+    def __init__(self, resource_class):
+        self.resource_class = resource_class
+        self.endpoint = "http://{}/api/v1/{}".format(PROWLARR_HOST, resource_class.collection)
+        self._items = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict:
+        with self._lock:
+            if self._items is None:
+                resources = (self.resource_class.from_api(item) for item in get(self.endpoint, headers=headers))
+                self._items = {resource.key(): resource for resource in resources}
+            return self._items
+
+    def exists(self, name: str) -> bool:
+        return name.lower() in self._load()
+
+    def get(self, name: str):
+        return self._load().get(name.lower())
+
+    def add(self, item: dict):
+        if isinstance(item, dict):
+            items = self._load()
+            resource = self.resource_class.from_api(item)
+            with self._lock:
+                items[resource.key()] = resource
+
+existing_indexers = ResourceSnapshot(Indexer)
+indexers_endpoint = existing_indexers.endpoint
+
+existing_indexer_proxies = ResourceSnapshot(IndexerProxy)
+indexer_proxy_endpoint = existing_indexer_proxies.endpoint
+
+existing_applications = ResourceSnapshot(Application)
+applications_endpoint = existing_applications.endpoint
+
+existing_download_clients = ResourceSnapshot(DownloadClient)
+download_clients_endpoint = existing_download_clients.endpoint
+
+commands_endpoint = "http://{}/api/v1/command".format(PROWLARR_HOST)
+tags_endpoint = "http://{}/api/v1/tag".format(PROWLARR_HOST)
+
+def find_created(endpoint: str, name: str, field: str = "name"):
+    """The item of the collection at `endpoint` whose `field` is `name` (case-insensitive), or None.
+
+    Asked before sending a POST again after an ambiguous status: the lost
+    request may have created the resource, and a second POST would then be
+    rejected as a duplicate.
+    """
+    try:
+        items = get(endpoint, headers=headers)
+    except RequestException as exc:
+        logger.warning("Unable to check whether %s was created: %s", name, exc)
+        return None
+    return next((item for item in items if str(item.get(field, "")).lower() == name.lower()), None)
+
+
+def provision_indexer(index: dict, limiter: AdaptiveLimiter, abort: threading.Event) -> tuple:
+    """POST a single indexer, retrying while Prowlarr reports it is overloaded."""
+    index_name = index.get("name", "")
+    status = None
+    for attempt in range(1, INDEXER_MAX_ATTEMPTS + 1):
+        if abort.is_set():
+            return index_name, "skipped", None
+        created = find_created(indexers_endpoint, index_name) if status in AMBIGUOUS_STATUSES else None
+        if created is not None:
+            existing_indexers.add(created)
+            checkpoint.mark("indexer:" + index_name.lower())
+            checkpoint.mark("sync:pending")
+            logger.info("{} indexer was created by the previous attempt".format(index_name))
+            return index_name, "created", None
+        limiter.acquire()
+        started = time.monotonic()
+        status = 0
+        try:
+            logger.debug("Setup {} index".format(index_name))
+            res = post(
+                url=indexers_endpoint,
+                body=index["body"],
+                headers={ **headers, "X-Prowlarr-Client": "true" }
+            )
+            status = res["code"]
+        except RequestException as exc:
+            res = {"code": status, "response": str(exc)}
+        finally:
+            limiter.release(status, time.monotonic() - started)
+        if status == 201:
+            existing_indexers.add(res["response"])
+            checkpoint.mark("indexer:" + index_name.lower())
+            checkpoint.mark("sync:pending")
+            logger.info("{} indexer setup successfully".format(index_name))
+            return index_name, "created", None
+        if status not in RETRYABLE_STATUSES or attempt == INDEXER_MAX_ATTEMPTS:
+            return index_name, "failed", res["response"]
+        logger.warning("Prowlarr answered %s for indexer %s; retrying (attempt %d/%d)", status, index_name, attempt, INDEXER_MAX_ATTEMPTS)
+        time.sleep(2 ** attempt)
+
+
+def indexer_body(index: dict) -> dict:
+    """Request body of a declared indexer; raises ValueError when it cannot be built.
+
+    Compact declarations are expanded from the indexer schema of the running Prowlarr.
+    """
+    return expand(index, schema) if is_compact(index) else index.get("body") or {}
+
+
+def pending_indexers():
+    """Yield the declared indexers still to add, with their request body, one at a time."""
+    queued = set()
+    for index in read_declarations(indexersFile):
+        index_name = index.get("name", "").lower()
+        if index_name in pending and index_name not in queued:
+            queued.add(index_name)
+            yield {**index, "body": resolve_tags(indexer_body(index), tags)}
+
+
+def post_with_retries(description: str, url: str, headers: dict, body: dict, find) -> dict:
+    """post() of a resource, sent again with the indexer backoff while Prowlarr is overloaded.
+
+    After an ambiguous status `find()` looks the resource up first; one the
+    lost request created is returned as if this POST had created it.
+    """
+    status = None
+    for attempt in range(1, INDEXER_MAX_ATTEMPTS + 1):
+        created = find() if status in AMBIGUOUS_STATUSES else None
+        if created is not None:
+            logger.info("Found %s, created by the previous attempt", description)
+            return {"code": 201, "response": created}
+        try:
+            res = post(url=url, headers=headers, body=body)
+        except RequestException as exc:
+            res = {"code": 0, "response": str(exc)}
+        status = res["code"]
+        if status not in RETRYABLE_STATUSES or attempt == INDEXER_MAX_ATTEMPTS:
+            return res
+        logger.warning("Prowlarr answered %s to %s; retrying (attempt %d/%d)", status, description, attempt, INDEXER_MAX_ATTEMPTS)
+        time.sleep(2 ** attempt)
+
 
-indexers_endpoint = "http://{}/api/v1/indexer".format(PROWLARR_HOST)
-def indexer_exists(name: str) -> bool:
-    indexers = get(indexers_endpoint, headers=headers)
-    return any(indexer.get("name", "").lower() == name.lower() for indexer in indexers)
+def send_with_retries(description: str, send):
+    """Response of `send()`, sent again with the indexer backoff while Prowlarr is overloaded."""
+    for attempt in range(1, INDEXER_MAX_ATTEMPTS + 1):
+        try:
+            response = send()
+            status = response.status_code
+        except RequestException:
+            if attempt == INDEXER_MAX_ATTEMPTS:
+                raise
+            status = 0
+        else:
+            if status not in RETRYABLE_STATUSES or attempt == INDEXER_MAX_ATTEMPTS:
+                return response
+        logger.warning("Prowlarr answered %s to %s; retrying (attempt %d/%d)", status, description, attempt, INDEXER_MAX_ATTEMPTS)
+        time.sleep(2 ** attempt)
+
+
+def read_held_sync_levels(path: str) -> dict:
+    """Sync levels of the applications held off by a run that did not give them back."""
+    try:
+        with open(path, encoding="utf-8") as handle:
+            held = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable held sync levels %s: %s", path, exc)
+        return {}
+    return held if isinstance(held, dict) else {}
 
-indexer_proxy_endpoint = "http://{}/api/v1/indexerProxy".format(PROWLARR_HOST)
-def indexer_proxy_exists(name: str) -> bool:
-    indexer_proxies = get(indexer_proxy_endpoint, headers=headers)
-    return any(indexer_proxy.get("name", "").lower() == name.lower() for indexer_proxy in indexer_proxies)
 
-applications_endpoint = "http://{}/api/v1/applications".format(PROWLARR_HOST)
-def application_exists(name: str) -> bool:
-    applications = get(applications_endpoint, headers=headers)
-    return any(app.get("name", "").lower() == name.lower() for app in applications)
+def hold_application_sync(name: str, level: str):
+    """Save `name`'s own sync level before holding it off, so that even a killed run's successor restores it."""
+    if name in held_sync_levels:
+        # Held by an interrupted run: what it saved is the level to give back
+        return
+    held_sync_levels[name] = level
+    try:
+        write_atomic(held_sync_path, json.dumps(held_sync_levels, sort_keys=True).encode("utf-8"))
+    except OSError as exc:
+        logger.warning("Unable to save held sync levels %s: %s", held_sync_path, exc)
+
 
-download_clients_endpoint = "http://{}/api/v1/downloadclient".format(PROWLARR_HOST)
-def download_client_exists(name: str) -> bool:
-    clients = get(download_clients_endpoint, headers=headers)
-    return any(client.get("name", "").lower() == name.lower() for client in clients)
+def set_application_sync_level(name: str, level: str) -> bool:
+    """Switch a registered application to `level`; return whether anything changed."""
+    application = existing_applications.get(name)
+    if application is None or application.get("syncLevel") == level:
+        return False
+    logger.info("Setting %s sync level to %s", name, level)
+    response = send_with_retries(
+        "the {} sync level".format(name),
+        lambda: client.put(
+            "{}/{}".format(applications_endpoint, application.id),
+            json=Application.from_body({ "syncLevel": level }).to_api(application),
+            headers={ **headers, "X-Prowlarr-Client": "true" },
+        ),
+    )
+    response.raise_for_status()
+    existing_applications.add(decode(response))
+    return True
 
 
+def run_command(name: str, timeout: float):
+    """Queue a Prowlarr command and poll it until it finishes."""
+    response = send_with_retries(
+        "the {} command".format(name), lambda: client.post(commands_endpoint, json={ "name": name }, headers=headers)
+    )
+    if response.status_code != 201:
+        raise RuntimeError("Prowlarr refused the {} command: {}".format(name, decode(response)))
+    command_id = decode(response)["id"]
+    deadline = time.monotonic() + timeout
+    delay = 0.5
+    while True:
+        response = send_with_retries(
+            "the {} command status".format(name),
+            lambda: client.get("{}/{}".format(commands_endpoint, command_id), headers=headers),
+        )
+        response.raise_for_status()
+        command = decode(response)
+        status = command.get("status")
+        if status == "completed":
+            return
+        if status in ("failed", "aborted", "cancelled", "orphaned"):
+            raise RuntimeError("{} command ended with status {}: {}".format(name, status, command.get("message")))
+        if time.monotonic() > deadline:
+            raise RuntimeError("{} command still {} after {:.0f}s".format(name, status, timeout))
+        time.sleep(delay)
+        delay = min(delay * 2, 5)
+
+
+def release_application_sync(indexers_added: bool):
+    """Give the held applications their own sync level back and push all indexers in one batch."""
+    released = [name for name, level in sorted(held_sync_levels.items()) if set_application_sync_level(name, level)]
+    if released or indexers_added:
+        logger.info("Running a single application indexer sync")
+        started = time.monotonic()
+        run_command("ApplicationIndexerSync", APPLICATION_SYNC_TIMEOUT)
+        logger.info("Application indexer sync completed in %.1fs", time.monotonic() - started)
+    held_sync_levels.clear()
+    try:
+        os.remove(held_sync_path)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logger.warning("Unable to remove held sync levels %s: %s", held_sync_path, exc)
+
+
+# The apps write their ApiKey on first start, wait for them rather than failing the Job
+wait_for_api_key(PROWLARR_CONFIG_PATH, "Prowlarr", logger=logger)
+wait_for_api_key(RADARR_CONFIG_PATH, "Radarr", logger=logger)
+wait_for_api_key(SONARR_CONFIG_PATH, "Sonarr", logger=logger)
+
 # Load API Keys
 logger.info("Loading Prowlarr API Key from %s", PROWLARR_CONFIG_PATH)
 API_KEY = load_api_key(PROWLARR_CONFIG_PATH, "Prowlarr")
@@ -109,6 +350,30 @@ logger.info("Loading Sonarr API Key from %s", SONARR_CONFIG_PATH)
 SONARR_API_KEY = load_api_key(SONARR_CONFIG_PATH, "Sonarr")
 logger.debug("Loaded Sonarr API Key: %s", SONARR_API_KEY)
 
+# A file, or a directory of files, with the indexer declarations (see servarr_indexers.read_declarations)
+indexersFile = os.getenv("PROWLARR_INDEXERS_PATH", "/mnt/indexers")
+desired_state = fingerprint(
+    file_bytes(__file__),
+    files_digest(indexersFile),
+    [API_KEY, RADARR_API_KEY, SONARR_API_KEY, TORRENT_SERVICE, TORRENT_USERNAME, TORRENT_PASSWORD],
+    [PROWLARR_SERVICE, RADARR_SERVICE, SONARR_SERVICE, FLARESOLVERR_SERVICE, BULK_SYNC],
+)
+
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    os.getenv("PROWLARR_STATE_PATH", state_path(PROWLARR_CONFIG_PATH, "prowlarr-applied.json")),
+    desired_state,
+    logger=logger,
+)
+# Applications a killed run left with sync held off get their level back even when nothing else changed.
+# Kept apart from the checkpoint, which is dropped when the inputs change.
+held_sync_path = os.getenv("PROWLARR_HELD_SYNC_PATH", state_path(PROWLARR_CONFIG_PATH, "prowlarr-held-sync.json"))
+held_sync_levels = read_held_sync_levels(held_sync_path)
+if held_sync_levels:
+    logger.info("Sync of %s is still held off by an interrupted run; restoring it", ", ".join(sorted(held_sync_levels)))
+else:
+    applied_state.skip_if_unchanged()
+
 # common headers for all requests
 headers = {
     "content-type": "application/json",
@@ -116,25 +381,98 @@ headers = {
     "x-requested-with": "XMLHttpRequest"
 }
 
-logger.info("Registering Flaresolverr tags in Prowlarr")
-res = post(
-    url="http://{}/api/v1/tag".format(PROWLARR_HOST),
-    headers=headers,
-    body={ "label":"flare" }
+# Prowlarr tests the Radarr and Sonarr connections when the applications are added
+wait_for_http("Prowlarr API", f"http://{PROWLARR_HOST}/api/v1/system/status", headers={"x-api-key": API_KEY}, logger=logger)
+wait_for_http("Radarr API", f"http://{RADARR_SERVICE}/api/v3/system/status", headers={"x-api-key": RADARR_API_KEY}, logger=logger)
+wait_for_http("Sonarr API", f"http://{SONARR_SERVICE}/api/v3/system/status", headers={"x-api-key": SONARR_API_KEY}, logger=logger)
+
+checkpoint = Checkpoint(
+    os.getenv("PROWLARR_CHECKPOINT_PATH", state_path(PROWLARR_CONFIG_PATH, "prowlarr-checkpoint.json")),
+    desired_state,
+    logger=logger,
 )
-if res["code"] != 201:
-    logger.error("There was an error while setting the Flaresolverr tags!")
+summary_path = os.getenv("PROWLARR_SUMMARY_PATH", state_path(PROWLARR_CONFIG_PATH, "prowlarr-summary.json"))
+
+begin_phase("tags")
+if not checkpoint.done("tag:flare"):
+    logger.info("Registering Flaresolverr tags in Prowlarr")
+    res = post_with_retries(
+        "the Flaresolverr tag",
+        url=tags_endpoint,
+        headers=headers,
+        body={ "label":"flare" },
+        find=lambda: find_created(tags_endpoint, "flare", "label"),
+    )
+    if res["code"] != 201:
+        logger.error("There was an error while setting the Flaresolverr tags!")
+        sys.exit(1)
+    checkpoint.mark("tag:flare")
+
+# Every indexer body is checked against the schema of the running Prowlarr before
+# anything slow happens: adding applications, clients and indexers makes Prowlarr
+# test connections, and one bad entry would otherwise abort the run halfway.
+begin_phase("validate-indexers")
+# Lowercased names of the declared indexers still to add; the declarations
+# themselves are read again one at a time when they are added.
+pending = set()
+problems = []
+schema = IndexerSchema(
+    client,
+    "http://{}/api/v1".format(PROWLARR_HOST),
+    headers,
+    os.getenv("PROWLARR_SCHEMA_CACHE_PATH", state_path(PROWLARR_CONFIG_PATH, "prowlarr-indexer-schema.json")),
+    logger=logger,
+    retry=send_with_retries,
+)
+tags = {}
+app_profiles = None
+try:
+    for index in read_declarations(indexersFile):
+        index_name = index.get("name", "")
+        if (
+            checkpoint.done("indexer:" + index_name.lower())
+            or index_name.lower() in pending
+            or existing_indexers.exists(index_name)
+        ):
+            logger.info("%s indexer already configured; skipping", index_name)
+            continue
+        pending.add(index_name.lower())
+        if app_profiles is None:
+            for tag in get(tags_endpoint, headers=headers):
+                tags[tag["id"]] = tags[str(tag.get("label", "")).lower()] = tag["id"]
+            app_profiles = {profile["id"] for profile in get("http://{}/api/v1/appprofile".format(PROWLARR_HOST), headers=headers)}
+        try:
+            body = indexer_body(index)
+        except ValueError as exc:
+            problems.append("{}: {}".format(index_name, exc))
+            continue
+        problems.extend("{}: {}".format(index_name, problem) for problem in validate(body, schema, tags, app_profiles))
+except ValueError as exc:
+    logger.error("Unable to read the indexer declarations: %s", exc)
     sys.exit(1)
+except RequestException as exc:
+    logger.error("Unable to read the Prowlarr indexer schema, tags or app profiles: %s", exc)
+    sys.exit(1)
+schema.save()
+if problems:
+    logger.error("%d problems found in the indexer declarations:\n  %s", len(problems), "\n  ".join(problems))
+    sys.exit(1)
+if pending:
+    logger.info("Validated %d indexers", len(pending))
 
-if application_exists("Radarr"):
+begin_phase("applications")
+if checkpoint.done("application:radarr") or existing_applications.exists("Radarr"):
     logger.info("Radarr already registered in Prowlarr; skipping")
 else:
     logger.info("Registering Radarr in Prowlarr")
-    res = post(
+    if BULK_SYNC:
+        hold_application_sync("Radarr", "fullSync")
+    res = post_with_retries(
+        "the Radarr application",
         url=applications_endpoint,
         headers={ **headers, "X-Prowlarr-Client": "true" },
         body={
-            "syncLevel": "fullSync",
+            "syncLevel": APPLICATION_SYNC_LEVEL,
             "fields": [
                 {
                     "name": "prowlarrUrl",
@@ -175,21 +513,27 @@ else:
             "infoLink": "https://wiki.servarr.com/prowlarr/supported#radarr",
             "tags": [],
             "name": "Radarr"
-        }
+        },
+        find=lambda: find_created(applications_endpoint, "Radarr"),
     )
     if res["code"] != 201:
         logger.error("There was an error while setting Radarr in Prowlarr!")
         sys.exit(1)
+    existing_applications.add(res["response"])
+checkpoint.mark("application:radarr")
 
-if application_exists("Sonarr"):
+if checkpoint.done("application:sonarr") or existing_applications.exists("Sonarr"):
     logger.info("Sonarr already registered in Prowlarr; skipping")
 else:
     logger.info("Registering Sonarr in Prowlarr")
-    res = post(
+    if BULK_SYNC:
+        hold_application_sync("Sonarr", "fullSync")
+    res = post_with_retries(
+        "the Sonarr application",
         url=applications_endpoint,
         headers={ **headers, "X-Prowlarr-Client": "true" },
         body={
-            "syncLevel": "fullSync",
+            "syncLevel": APPLICATION_SYNC_LEVEL,
             "fields": [
                 {
                     "name": "prowlarrUrl",
@@ -231,17 +575,22 @@ else:
             "infoLink": "https://wiki.servarr.com/prowlarr/supported#sonarr",
             "tags": [],
             "name": "Sonarr"
-        }
+        },
+        find=lambda: find_created(applications_endpoint, "Sonarr"),
     )
     if res["code"] != 201:
         logger.error("There was an error while setting Sonarr in Prowlarr!")
         sys.exit(1)
+    existing_applications.add(res["response"])
+checkpoint.mark("application:sonarr")
 
-if download_client_exists("qBittorrent"):
+begin_phase("download-client")
+if checkpoint.done("downloadclient:qbittorrent") or existing_download_clients.exists("qBittorrent"):
     logger.info("qBittorrent download client already configured; skipping")
 else:
     logger.info("Registering qBittorrent download client")
-    res = post(
+    res = post_with_retries(
+        "the qBittorrent download client",
         url=download_clients_endpoint,
         headers=headers,
         body={
@@ -305,17 +654,22 @@ else:
             "configContract": "QBittorrentSettings",
             "infoLink": "https://wiki.servarr.com/prowlarr/supported#qbittorrent",
             "tags": []
-        }
+        },
+        find=lambda: find_created(download_clients_endpoint, "qBittorrent"),
     )
     if res["code"] != 201:
         logger.error("There was an error while setting qBittorrent in Prowlarr!")
         sys.exit(1)
+    existing_download_clients.add(res["response"])
+checkpoint.mark("downloadclient:qbittorrent")
 
-if indexer_proxy_exists("FlareSolverr"):
+begin_phase("indexer-proxy")
+if checkpoint.done("indexerproxy:flaresolverr") or existing_indexer_proxies.exists("FlareSolverr"):
     logger.info("FlareSolverr indexer proxy already configured; skipping")
 else:
     logger.info("Registering Flaresolverr indexer proxy")
-    res = post(
+    res = post_with_retries(
+        "the FlareSolverr indexer proxy",
         url=indexer_proxy_endpoint,
         headers=headers,
         body={
@@ -338,30 +692,86 @@ else:
             "configContract": "FlareSolverrSettings",
             "infoLink": "https://wiki.servarr.com/prowlarr/supported#flaresolverr",
             "tags": [ 1 ]
-        }
+        },
+        find=lambda: find_created(indexer_proxy_endpoint, "FlareSolverr"),
     )
     if res["code"] != 201:
         logger.error("There was an error while setting Flaresolverr indexer proxy!")
         sys.exit(1)
+    existing_indexer_proxies.add(res["response"])
+checkpoint.mark("indexerproxy:flaresolverr")
 
-indexersFile = "/mnt/indexers.json"
-if os.path.isfile(indexersFile):
-    logger.info("Setting Prowlarr indexers")
-    with open(indexersFile) as file:
-        indexers = json.load(file)
-    for index in indexers:
-        index_name = index.get("name", "")
-        if indexer_exists(index_name):
-            logger.info("%s indexer already configured; skipping", index_name)
-            continue
-        logger.debug("Setup {} index".format(index_name))
-        res = post(
-            url="http://{}/api/v1/indexer".format(PROWLARR_HOST),
-            body=index["body"],
-            headers={ **headers, "X-Prowlarr-Client": "true" }
-        )
-        if res["code"] != 201:
-            logger.error("There was an error while setting the indexer {}!".format(index_name))
+begin_phase("indexers")
+failures = {}
+try:
+    if pending:
+        if BULK_SYNC:
+            for name in MANAGED_APPLICATIONS:
+                application = existing_applications.get(name)
+                # An application the user disabled is neither held nor released
+                if application is not None and application.get("syncLevel") != "disabled":
+                    hold_application_sync(name, application.get("syncLevel"))
+                    set_application_sync_level(name, "disabled")
+
+        logger.info("Adding %d indexers with up to %d concurrent requests", len(pending), INDEXER_MAX_CONCURRENCY)
+        limiter = AdaptiveLimiter(INDEXER_MAX_CONCURRENCY, INDEXER_LATENCY_TARGET, logger=logger)
+        abort = threading.Event()
+        results = {}
+
+        def collect(futures):
+            for future in futures:
+                index_name, outcome, detail = future.result()
+                results[index_name] = outcome
+                if outcome == "failed":
+                    logger.error("There was an error while setting the indexer {}! {}".format(index_name, detail))
+                    failures[index_name] = detail
+                    if INDEXER_FAILURE_POLICY != "continue":
+                        abort.set()
+
+        # Declarations are submitted as workers free up, so only a couple of bodies per worker are held at a time
+        with ThreadPoolExecutor(max_workers=INDEXER_MAX_CONCURRENCY) as executor:
+            running = set()
+            for index in pending_indexers():
+                if abort.is_set():
+                    results[index.get("name", "")] = "skipped"
+                    continue
+                running.add(executor.submit(provision_indexer, index, limiter, abort))
+                if len(running) >= 2 * INDEXER_MAX_CONCURRENCY:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(running).done)
+
+        for outcome in ("created", "failed", "skipped"):
+            names = [name for name, result in results.items() if result == outcome]
+            if names:
+                logger.info("Indexers %s: %s", outcome, ", ".join(names))
+        if results:
+            try:
+                write_atomic(summary_path, json.dumps({
+                    "results": results,
+                    "failures": failures,
+                }, indent=2, default=str).encode("utf-8"))
+            except OSError as exc:
+                logger.warning("Unable to write indexer summary %s: %s", summary_path, exc)
+        if abort.is_set():
             sys.exit(1)
-        else:
-            logger.info("{} indexer setup successfully".format(index_name))
+        if failures:
+            logger.warning(
+                "%d indexers could not be added and will be retried on the next upgrade: %s",
+                len(failures),
+                ", ".join(failures),
+            )
+finally:
+    if BULK_SYNC or held_sync_levels:
+        begin_phase("application-sync")
+        try:
+            release_application_sync(checkpoint.done("sync:pending"))
+        except (RuntimeError, RequestException) as exc:
+            logger.error("There was an error while syncing indexers to the applications! %s", exc)
+            sys.exit(1)
+        checkpoint.discard("sync:pending")
+
+checkpoint.clear()
+# Indexers that failed are retried on the next upgrade, so only a complete run counts as applied
+if not failures:
+    applied_state.record()
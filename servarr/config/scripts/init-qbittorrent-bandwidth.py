@@ -0,0 +1,59 @@
+#!/usr/local/bin/python3
+
+"""Push the alternative speed limits and their schedule to the running qBittorrent.
+
+The settings go through the WebUI API (see servarr_qbittorrent), so a
+`helm upgrade` that changes `qbittorrent.bandwidth` applies them live, without
+restarting qBittorrent. Every run compares them with what qBittorrent reports
+and only sends the ones that differ, so limits changed by hand in the WebUI
+are put back to the chart's values.
+"""
+
+import json
+import logging
+import os
+import sys
+
+from servarr_http import HTTPClient, RequestException
+from servarr_metrics import begin_phase, start_run
+from servarr_qbittorrent import QBittorrentClient, bandwidth_preferences
+from servarr_readiness import wait_for_http
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+console_handler = logging.StreamHandler()
+log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(log_format)
+logger.addHandler(console_handler)
+start_run("qbittorrent-bandwidth", logger=logger)
+
+QBITTORRENT_HOST = os.getenv("QBITTORRENT_HOST", "localhost:10095")
+TORRENT_USERNAME = os.getenv("TORRENT_ADMIN", "admin")
+TORRENT_PASSWORD = os.getenv("TORRENT_PASSWORD", "")
+QBITTORRENT_BANDWIDTH = os.getenv("QBITTORRENT_BANDWIDTH", "{}")
+
+begin_phase("settings")
+try:
+    desired = bandwidth_preferences(json.loads(QBITTORRENT_BANDWIDTH))
+except (ValueError, AttributeError) as exc:
+    logger.error("Invalid qbittorrent.bandwidth settings: %s", exc)
+    sys.exit(1)
+
+url = f"http://{QBITTORRENT_HOST}"
+# The WebUI serves its login page before the API accepts sessions
+wait_for_http("qBittorrent WebUI", f"{url}/", logger=logger)
+
+begin_phase("preferences")
+qbittorrent = QBittorrentClient(HTTPClient(logger=logger), url, logger=logger)
+try:
+    qbittorrent.login(TORRENT_USERNAME, TORRENT_PASSWORD)
+    changed = qbittorrent.apply_preferences(desired)
+except RequestException as exc:
+    logger.error("Unable to apply the qBittorrent bandwidth settings: %s", exc)
+    sys.exit(1)
+
+if changed:
+    logger.info("qBittorrent preferences updated: %s", ", ".join(changed))
+else:
+    logger.info("qBittorrent bandwidth settings already up to date; skipping")
@@ -5,9 +5,36 @@ import sys
 import logging
 import base64
 import hashlib
-import jinja2
+import hmac
+import json
+import re
+import stat
+import string
+import time
 
 MIN_PASS_LEN = 8
+QBITTORRENT_UID = int(os.getenv("QBITTORRENT_UID", "568"))
+QBITTORRENT_GID = int(os.getenv("QBITTORRENT_GID", "568"))
+# What the last run wrote to qBittorrent.conf; nothing derived from the password is kept there
+APPLIED_STATE = os.path.join(".servarr-init", "qbittorrent-applied.json")
+CGROUP_ROOT = os.getenv("CGROUP_ROOT", "/sys/fs/cgroup")
+QBITTORRENT_TUNING_ENABLED = os.getenv("QBITTORRENT_TUNING_ENABLED", "false").lower() in ("1", "true", "yes", "on")
+QBITTORRENT_TUNING_OVERRIDES = os.getenv("QBITTORRENT_TUNING_OVERRIDES", "{}")
+MIB = 1024 * 1024
+# Mount path of the optional scratch volume, the same in this job and in qBittorrent; empty when disabled
+QBITTORRENT_SCRATCH_PATH = os.getenv("QBITTORRENT_SCRATCH_PATH", "")
+# The gluetun port sync sidecar owns the listening port when enabled
+QBITTORRENT_PORT_SYNC = os.getenv("QBITTORRENT_PORT_SYNC", "false").lower() in ("1", "true", "yes", "on")
+# Tunable settings: values name -> [BitTorrent] key
+TUNING_KEYS = {
+    "asyncIOThreads": "Session\\AsyncIOThreadsCount",
+    "diskCacheMiB": "Session\\DiskCacheSize",
+    "diskQueueBytes": "Session\\DiskQueueSize",
+    "maxConnections": "Session\\MaxConnections",
+    "maxUploads": "Session\\MaxUploads",
+    "maxActiveDownloads": "Session\\MaxActiveDownloads",
+    "maxActiveTorrents": "Session\\MaxActiveTorrents",
+}
 QBITTORRENT_CONF_FILENAME = "qBittorrent.conf"
 QBITTORRENT_CONF_FILEPATH = "/config/qBittorrent"
 QBITTORRENT_CONF_TEMPLATE = r"""
@@ -25,7 +52,7 @@ Session\DefaultSavePath=/downloads
 Session\ExcludedFileNames=
 Session\Port=50413
 Session\QueueingSystemEnabled=true
-Session\TempPath=/downloads/incomplete/
+Session\TempPath=${tempPath}
 Session\TempPathEnabled=true
 Session\GlobalMaxRatio=0
 Session\GlobalMaxRatioEnabled=true
@@ -58,31 +85,242 @@ WebUI\LocalHostAuth=false
 {{- if not (default .Values.qbittorrent.csrf_protection false) }}
 WebUI\CSRFProtection=false
 WebUI\ClickjackingProtection=false
+{{- else }}
+WebUI\CSRFProtection=true
+WebUI\ClickjackingProtection=true
 {{- end }}
-WebUI\Password_PBKDF2="{{`{{ torrentPassword }}`}}"
+WebUI\Password_PBKDF2="${torrentPassword}"
 WebUI\UseUPnP=false
-WebUI\Username={{`{{ torrentUsername }}`}}
+WebUI\Username=${torrentUsername}
 
 [RSS]
 AutoDownloader\DownloadRepacks=true
 """
 
 
+SECTION_PATTERN = re.compile(r"^\[(.+)\]\s*$")
+
+# Hash stored by qBittorrent: WebUI\Password_PBKDF2="@ByteArray(<base64 salt>:<base64 hash>)"
+STORED_PASSWORD_PATTERN = re.compile(r'^WebUI\\Password_PBKDF2="?(@ByteArray\(([^:)]+):[^)]+\))"?\s*$', re.MULTILINE)
+
+
+def read_file(file_path: str):
+    """Content of the existing configuration, or None on the first install."""
+    try:
+        with open(file_path) as fd:
+            return fd.read()
+    except FileNotFoundError:
+        return None
+
+
+def parse_conf(content: str) -> dict:
+    """`{section: {key: value}}` of a QSettings INI file, in file order."""
+    sections = {}
+    section = None
+    for line in content.splitlines():
+        header = SECTION_PATTERN.match(line)
+        if header:
+            section = sections.setdefault(header.group(1), {})
+        elif section is not None and "=" in line and not line.startswith((";", "#")):
+            key, _, value = line.partition("=")
+            section[key] = value
+    return sections
+
+
+def merge_conf(current: str, managed: dict) -> str:
+    """`current` with the `managed` keys set, every other line kept as it is.
+
+    Keys qBittorrent or its users changed (speed limits, queueing, ...) survive
+    upgrades; managed keys missing from a section are appended to it and
+    missing sections are appended to the file.
+    """
+    pending = {name: dict(keys) for name, keys in managed.items()}
+    output = []
+    section = None
+
+    def close_section():
+        missing = pending.pop(section, None)
+        if not missing:
+            return
+        # Before the blank lines separating the section from the next one
+        position = len(output)
+        while position and not output[position - 1].strip():
+            position -= 1
+        output[position:position] = ["{0}={1}".format(key, value) for key, value in missing.items()]
+
+    for line in current.splitlines():
+        header = SECTION_PATTERN.match(line)
+        if header:
+            close_section()
+            section = header.group(1)
+        else:
+            key, separator, _ = line.partition("=")
+            if separator and key in pending.get(section, {}):
+                line = "{0}={1}".format(key, pending[section].pop(key))
+        output.append(line)
+    close_section()
+
+    for name, keys in pending.items():
+        if not keys:
+            continue
+        if output and output[-1].strip():
+            output.append("")
+        output.append("[{0}]".format(name))
+        output.extend("{0}={1}".format(key, value) for key, value in keys.items())
+    return "\n".join(output) + "\n"
+
+
+def read_state(path: str) -> dict:
+    """What the last run recorded in `path`; empty when it is missing or unreadable."""
+    try:
+        with open(path) as handle:
+            state = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    return state if isinstance(state, dict) else {}
+
+
+def write_state(path: str, state: dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as handle:
+        json.dump(state, handle, sort_keys=True)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
 def create_file(file_content: str):
+    """Replace the configuration through a synced temporary file, so it is never left half written."""
     file_absolute_path = QBITTORRENT_CONF_FILEPATH + os.sep + QBITTORRENT_CONF_FILENAME
-    os.umask(0o077)
-    with open(file_absolute_path, "w+") as fd:
-        fd.write(file_content)
+    tmp_path = file_absolute_path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    with os.fdopen(fd, "w") as handle:
+        os.fchmod(handle.fileno(), 0o644)
+        handle.write(file_content)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, file_absolute_path)
+    dir_fd = os.open(QBITTORRENT_CONF_FILEPATH, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
     return file_absolute_path
 
 
-def qbittorrent_passwd(plain_passwd: str):
+def fix_ownership(root: str, uid: int, gid: int) -> dict:
+    """Give every entry below `root` to uid:gid with owner access, touching only the ones that differ.
+
+    Directories are walked with os.scandir, so an entry that is already right
+    costs one lstat and no write. qBittorrent keeps running while the upgrade
+    hook walks its volume: entries that disappear meanwhile (fastresume files
+    replaced by rename, rotated logs, completed .!qB parts) are skipped, as
+    `chown -R` did.
+    Returns the number of entries checked, changed and gone before they were fixed.
+    """
+    counts = {"checked": 0, "changed": 0, "vanished": 0}
+
+    def fix(path: str, st: os.stat_result, is_dir: bool):
+        counts["checked"] += 1
+        changed = False
+        try:
+            if (st.st_uid, st.st_gid) != (uid, gid):
+                os.chown(path, uid, gid, follow_symlinks=False)
+                changed = True
+            if not stat.S_ISLNK(st.st_mode):
+                mode = stat.S_IMODE(st.st_mode) | (0o700 if is_dir else 0o600)
+                if mode != stat.S_IMODE(st.st_mode):
+                    os.chmod(path, mode)
+                    changed = True
+        except FileNotFoundError:
+            counts["vanished"] += 1
+        counts["changed"] += changed
+
+    fix(root, os.lstat(root), True)
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        st = entry.stat(follow_symlinks=False)
+                    except FileNotFoundError:
+                        counts["vanished"] += 1
+                        continue
+                    fix(entry.path, st, is_dir)
+                    if is_dir:
+                        pending.append(entry.path)
+        except FileNotFoundError:
+            counts["vanished"] += 1
+    return counts
+
+
+def cgroup_limits(root: str) -> tuple:
+    """(CPUs, memory bytes) allowed by the cgroup v2 limits, None where unlimited or unreadable."""
+    cpus = memory = None
+    try:
+        with open(os.path.join(root, "cpu.max")) as fd:
+            # "<quota> <period>" in microseconds, or "max <period>"
+            fields = fd.read().split()
+        if fields[0] != "max":
+            cpus = int(fields[0]) / int(fields[1] if len(fields) > 1 else 100000)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "memory.max")) as fd:
+            value = fd.read().strip()
+        if value != "max":
+            memory = int(value)
+    except (OSError, ValueError):
+        pass
+    return cpus, memory
+
+
+def host_memory() -> int:
+    """Total memory of the node from /proc/meminfo, in bytes."""
+    with open("/proc/meminfo") as fd:
+        for line in fd:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    raise ValueError("MemTotal missing from /proc/meminfo")
+
+
+def clamp(value, low: int, high: int) -> int:
+    return int(max(low, min(high, value)))
+
+
+def tuned_settings(cpus: float, memory: int) -> dict:
+    """Connection, disk and queue settings sized for `cpus` and `memory` bytes, by values name.
+
+    Peers and the disk cache/queue are what grow qBittorrent's memory, so they
+    scale with the memory limit and stay well below it; I/O threads and active
+    torrents scale with the CPUs.
+    """
+    memory_mib = memory // MIB
+    max_connections = clamp(min(memory_mib // 4, cpus * 400), 100, 2000)
+    max_active_downloads = clamp(round(cpus * 2), 2, 20)
+    return {
+        "asyncIOThreads": clamp(cpus * 2, 2, 16),
+        "diskCacheMiB": clamp(memory_mib // 8, 16, 1024),
+        "diskQueueBytes": clamp(memory_mib // 64, 1, 64) * MIB,
+        "maxConnections": max_connections,
+        "maxUploads": clamp(max_connections // 25, 4, 100),
+        "maxActiveDownloads": max_active_downloads,
+        "maxActiveTorrents": clamp(max_active_downloads * 3, 5, 100),
+    }
+
+
+def qbittorrent_passwd(plain_passwd: str, salt: bytes = None):
     # As per https://github.com/qbittorrent/qBittorrent/blob/ce9bdaef5cdb8ab77d71481f20b25c9e6da1b9eb/src/base/utils/password.cpp#L48
     ITERATIONS = 100_000
     # 4x32 bits words = 16 bytes: https://github.com/qbittorrent/qBittorrent/blob/ce9bdaef5cdb8ab77d71481f20b25c9e6da1b9eb/src/base/utils/password.cpp#L75
     SALT_SIZE = 16
-    # Generate a cryptographically secure pseudorandom salt
-    salt = os.urandom(SALT_SIZE)
+    # Generate a cryptographically secure pseudorandom salt, unless verifying against a stored one
+    if salt is None:
+        salt = os.urandom(SALT_SIZE)
     # PBKDF2 w/ SHA512 hmac
     h = hashlib.pbkdf2_hmac("sha512", plain_passwd.encode(), salt, ITERATIONS)
     # Base64 encode and join salt and hash
@@ -91,6 +329,25 @@ def qbittorrent_passwd(plain_passwd: str):
     )
 
 
+def stored_password_matches(plain_passwd: str, conf_content: str) -> str:
+    """The hash stored in `conf_content` when it was derived from `plain_passwd`, else an empty string.
+
+    Verifying costs the same single derivation as hashing anew, but keeps the
+    stored salt so an unchanged password renders an unchanged file. A cheaper
+    check would need a password fingerprint on the volume, next to the hash it
+    would weaken.
+    """
+    match = STORED_PASSWORD_PATTERN.search(conf_content or "")
+    if not match:
+        return ""
+    stored, encoded_salt = match.groups()
+    try:
+        salt = base64.b64decode(encoded_salt, validate=True)
+    except ValueError:
+        return ""
+    return stored if hmac.compare_digest(qbittorrent_passwd(plain_passwd, salt), stored) else ""
+
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 console_handler = logging.StreamHandler()
@@ -101,77 +358,178 @@ logger.addHandler(console_handler)
 TORRENT_USERNAME = os.getenv("TORRENT_USERNAME")
 TORRENT_PASSWORD = os.getenv("TORRENT_PASSWORD")
 
-logger.info("qBitTorrent Init Job started")
-logger.info("The Job will configure qBitTorrent credentials")
-
-logger.info("Checking credentials")
-if TORRENT_USERNAME in [None, ""]:
-    logger.error("Empty username passed")
-    sys.exit(1)
-if TORRENT_PASSWORD in [None, ""]:
-    logger.error("Empty password passed")
-    sys.exit(1)
-if len(TORRENT_PASSWORD) < MIN_PASS_LEN:
-    logger.error("Password too short, it should be at least of 8 characters")
-    sys.exit(1)
-
-logger.info("Username to be set: {0}".format(TORRENT_USERNAME))
-hidden_password = (
-    TORRENT_PASSWORD[0] + "*" * (len(TORRENT_PASSWORD) - 2) + TORRENT_PASSWORD[-1]
-)
-logger.info("Password (hidden) to be set: {0}".format(hidden_password))
-
-logger.info("Generating qBitTorrent compliant hashed password")
-try:
-    hashed_password = qbittorrent_passwd(TORRENT_PASSWORD)
-except Exception:
-    logger.exception("There was an error while generating the hashed password")
-    sys.exit(1)
-logger.info("Hashed password: {0}".format(hashed_password))
-
-logger.info("Parsing the configuration template")
-conf_template = jinja2.Template(QBITTORRENT_CONF_TEMPLATE)
-
-rendering_dict = {
-    "torrentUsername": TORRENT_USERNAME,
-    "torrentPassword": hashed_password,
-}
 
-conf_rendered = conf_template.render(rendering_dict)
+def main():
+    logger.info("qBitTorrent Init Job started")
+    logger.info("The Job will configure qBitTorrent credentials")
 
-logger.info("Rendered configuration file:\n\n{0}\n\n".format(conf_rendered))
+    logger.info("Checking credentials")
+    if TORRENT_USERNAME in [None, ""]:
+        logger.error("Empty username passed")
+        sys.exit(1)
+    if TORRENT_PASSWORD in [None, ""]:
+        logger.error("Empty password passed")
+        sys.exit(1)
+    if len(TORRENT_PASSWORD) < MIN_PASS_LEN:
+        logger.error("Password too short, it should be at least of 8 characters")
+        sys.exit(1)
+
+    logger.info("Username to be set: {0}".format(TORRENT_USERNAME))
+    hidden_password = (
+        TORRENT_PASSWORD[0] + "*" * (len(TORRENT_PASSWORD) - 2) + TORRENT_PASSWORD[-1]
+    )
+    logger.info("Password (hidden) to be set: {0}".format(hidden_password))
 
-logger.info("Checking if target directory exists")
+    conf_file_path = QBITTORRENT_CONF_FILEPATH + os.sep + QBITTORRENT_CONF_FILENAME
+    current_conf = read_file(conf_file_path)
+    volume_root = os.path.dirname(QBITTORRENT_CONF_FILEPATH)
+    state_file_path = os.path.join(volume_root, APPLIED_STATE)
+    applied_state = read_state(state_file_path)
 
-if not os.path.exists(QBITTORRENT_CONF_FILEPATH):
-    logger.warning("{0} does not exists, will create it".format(QBITTORRENT_CONF_FILEPATH))
+    logger.info("Generating qBitTorrent compliant hashed password")
     try:
-        os.makedirs(QBITTORRENT_CONF_FILEPATH)
+        hashed_password = stored_password_matches(TORRENT_PASSWORD, current_conf)
+        if hashed_password:
+            logger.info("The stored password hash matches the configured password; keeping it")
+        else:
+            hashed_password = qbittorrent_passwd(TORRENT_PASSWORD)
     except Exception:
-        logger.exception(
-            "Could not create directory: {0}".format(QBITTORRENT_CONF_FILEPATH)
+        logger.exception("There was an error while generating the hashed password")
+        sys.exit(1)
+    logger.info("Hashed password: {0}".format(hashed_password))
+
+    logger.info("Parsing the configuration template")
+    conf_template = string.Template(QBITTORRENT_CONF_TEMPLATE)
+
+    # In-flight torrents live on the scratch volume when there is one;
+    # qBittorrent moves them to /downloads on completion
+    if QBITTORRENT_SCRATCH_PATH:
+        temp_path = os.path.join(QBITTORRENT_SCRATCH_PATH, "incomplete") + os.sep
+    else:
+        temp_path = "/downloads/incomplete/"
+    logger.info("Incomplete downloads go to {0}".format(temp_path))
+
+    rendering_dict = {
+        "torrentUsername": TORRENT_USERNAME,
+        "torrentPassword": hashed_password,
+        "tempPath": temp_path,
+    }
+
+    conf_rendered = conf_template.substitute(rendering_dict)
+
+    logger.info("Rendered configuration file:\n\n{0}\n\n".format(conf_rendered))
+
+    managed_conf = parse_conf(conf_rendered)
+    if QBITTORRENT_PORT_SYNC and "Session\\Port" in parse_conf(current_conf or "").get("BitTorrent", {}):
+        # Keep the forwarded port pushed by the sidecar across upgrades instead of resetting it
+        managed_conf["BitTorrent"].pop("Session\\Port")
+    if QBITTORRENT_TUNING_ENABLED:
+        try:
+            overrides = json.loads(QBITTORRENT_TUNING_OVERRIDES) or {}
+            unknown = sorted(set(overrides) - set(TUNING_KEYS))
+            if unknown:
+                raise ValueError("unknown tuning settings: {0}".format(", ".join(unknown)))
+            # The job runs with qBittorrent's limits, so its own cgroup tells what qBittorrent gets
+            cpus, memory = cgroup_limits(CGROUP_ROOT)
+            cpus = cpus or os.cpu_count() or 1
+            memory = memory or host_memory()
+            tuning = {**tuned_settings(cpus, memory), **overrides}
+        except (OSError, ValueError) as exc:
+            logger.error("Unable to size the qBittorrent settings: {0}".format(exc))
+            sys.exit(1)
+        logger.info("Sizing qBittorrent for {0:g} CPUs and {1} MiB of memory: {2}".format(
+            cpus, memory // MIB, ", ".join("{0}={1}".format(name, value) for name, value in tuning.items())
+        ))
+        tuning = {name: str(value) for name, value in tuning.items()}
+        # A sized value the last run already wrote stays as qBittorrent has it, so changes made in the WebUI
+        # survive upgrades until the limits (or the overrides) give a different value
+        applied_tuning = applied_state.get("tuning")
+        current_keys = parse_conf(current_conf or "").get("BitTorrent", {})
+        if applied_tuning is None:
+            # First sized run: settings the existing file already has were chosen by hand and stay; the sized
+            # values are still recorded, so only a later change of the limits overwrites them
+            kept = [name for name in tuning if TUNING_KEYS[name] in current_keys]
+        else:
+            kept = [
+                name for name, value in tuning.items()
+                if applied_tuning.get(name) == value and TUNING_KEYS[name] in current_keys
+            ]
+        if kept:
+            logger.info("Left as set in qBittorrent: {0}".format(", ".join(kept)))
+        managed_conf.setdefault("BitTorrent", {}).update(
+            {TUNING_KEYS[name]: value for name, value in tuning.items() if name not in kept}
+        )
+
+    # Only the keys rendered above are managed; everything else in the existing file is kept
+    conf_merged = merge_conf(current_conf or "", managed_conf)
+
+    logger.info("Checking if target directory exists")
+
+    if not os.path.exists(QBITTORRENT_CONF_FILEPATH):
+        logger.warning("{0} does not exists, will create it".format(QBITTORRENT_CONF_FILEPATH))
+        try:
+            os.makedirs(QBITTORRENT_CONF_FILEPATH)
+        except Exception:
+            logger.exception(
+                "Could not create directory: {0}".format(QBITTORRENT_CONF_FILEPATH)
+            )
+            sys.exit(1)
+
+    if conf_merged == current_conf:
+        # Leaving the file untouched keeps its mtime, so qBittorrent has nothing to reload
+        logger.info("{0} is already up to date; leaving it alone".format(conf_file_path))
+    else:
+        logger.info("Saving file to PVC")
+        try:
+            conf_file_path = create_file(conf_merged)
+        except Exception:
+            logger.exception("Could not create file")
+            sys.exit(1)
+
+    new_state = dict(applied_state)
+    # Fingerprints of the password recorded by earlier versions are dropped
+    new_state.pop("password", None)
+    if QBITTORRENT_TUNING_ENABLED:
+        new_state["tuning"] = tuning
+    else:
+        # Enabling the tuning again keeps the settings the file has by then, like a first run
+        new_state.pop("tuning", None)
+    if new_state != applied_state:
+        try:
+            write_state(state_file_path, new_state)
+        except OSError as exc:
+            # The next run keeps the settings the file has by then, as a first sized run does
+            logger.warning("Unable to save {0}: {1}".format(state_file_path, exc))
+
+    logger.info("Setting permissions on files and folders")
+    try:
+        started = time.monotonic()
+        counts = fix_ownership(volume_root, QBITTORRENT_UID, QBITTORRENT_GID)
+        logger.info(
+            "Ownership of {0}: {1} entries checked, {2} changed, {3} gone during the walk ({4:.2f}s)".format(
+                volume_root, counts["checked"], counts["changed"], counts["vanished"], time.monotonic() - started
+            )
         )
+    except Exception:
+        logger.exception("Error while setting permissions")
         sys.exit(1)
 
-logger.info("Saving file to PVC")
-try:
-    conf_file_path = create_file(conf_rendered)
-except Exception:
-    logger.exception("Could not create file")
-    sys.exit(1)
+    if QBITTORRENT_SCRATCH_PATH:
+        # Only the top of the scratch volume: walking the data of in-flight torrents would cost far more than it fixes
+        logger.info("Preparing scratch directory {0}".format(temp_path))
+        try:
+            os.makedirs(temp_path, exist_ok=True)
+            for path in (QBITTORRENT_SCRATCH_PATH, temp_path):
+                st = os.stat(path)
+                if (st.st_uid, st.st_gid) != (QBITTORRENT_UID, QBITTORRENT_GID):
+                    os.chown(path, QBITTORRENT_UID, QBITTORRENT_GID)
+                if stat.S_IMODE(st.st_mode) & 0o700 != 0o700:
+                    os.chmod(path, stat.S_IMODE(st.st_mode) | 0o700)
+        except OSError:
+            logger.exception("Unable to prepare the scratch directory {0}".format(temp_path))
+            sys.exit(1)
+    logger.info("Job ended.")
 
-logger.info("Setting permissions on files and folders")
-try:
-    # Not the pythonic way, but the simplest
-    volume_root = os.path.dirname(QBITTORRENT_CONF_FILEPATH)
-    command = f"chown -R 568:568 {volume_root}"
-    logger.info(f"Running command: {command}")
-    os.system(command)
-
-    command = f"chmod 0644 {conf_file_path}"
-    logger.info(f"Running command: {command}")
-    os.system(command)
-except Exception:
-    logger.exception("Error while setting permissions")
-    sys.exit(1)
-logger.info("Job ended.")
+
+if __name__ == "__main__":
+    main()
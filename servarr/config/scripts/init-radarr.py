@@ -1,12 +1,17 @@
 #!/usr/local/bin/python3
 
-from json import JSONDecodeError, dumps
 import logging
 import os
-import requests
 import sys
 import xml.etree.ElementTree as ET
 
+from servarr_http import HTTPClient, RequestException
+from servarr_metrics import begin_phase, start_run
+from servarr_readiness import wait_for_api_key, wait_for_http
+from servarr_reconcile import Collection, SecretStore, reconcile_settings
+from servarr_resources import DownloadClient, RemotePathMapping, RootFolder
+from servarr_state import AppliedState, file_bytes, fingerprint, state_path
+
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -14,6 +19,7 @@ console_handler = logging.StreamHandler()
 log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(log_format)
 logger.addHandler(console_handler)
+start_run("radarr", logger=logger)
 
 RADARR_HOST = os.getenv("RADARR_HOST")
 CONFIG_PATH = os.getenv("RADARR_CONFIG_PATH", "/config/config.xml")
@@ -38,11 +44,22 @@ def load_api_key(path: str, label: str) -> str:
         logger.error("%s", exc)
     sys.exit(1)
 
+# Radarr writes its ApiKey on first start, wait for it rather than failing the Job
+wait_for_api_key(CONFIG_PATH, "Radarr", logger=logger)
+
 # Load API Keys
 logger.info("Loading Radarr API Key from %s", CONFIG_PATH)
 API_KEY = load_api_key(CONFIG_PATH, "Radarr")
 logger.info("Loaded Radarr API Key: %s", API_KEY)
 
+# Upgrades that change nothing this script applies stop here, before any request
+applied_state = AppliedState(
+    os.getenv("RADARR_STATE_PATH", state_path(CONFIG_PATH, "radarr-applied.json")),
+    fingerprint(file_bytes(__file__), [API_KEY, RADARR_HOST, TORRENT_SERVICE, TORRENT_USERNAME, TORRENT_PASSWORD]),
+    logger=logger,
+)
+applied_state.skip_if_unchanged()
+
 # common headers for all requests
 headers = {
     "content-type": "application/json",
@@ -50,82 +67,33 @@ headers = {
     "x-requested-with": "XMLHttpRequest"
 }
 
-def _request(method: str, url: str, headers: dict, body: dict, acceptable_response=None, skip_message=None):
-    logger.debug(" ".join([
-        method.upper(),
-        url,
-        ", ".join(f'{key}: {value}' for key,value in headers.items()),
-        str(body)
-    ]))
-    response = requests.request(
-        method=method.lower(),
-        url=url,
-        json=body,
-        headers=headers
-    )
-    logger.debug(" ".join([
-        "Status Code:",
-        str(response.status_code),
-        "Response body:",
-        response.text
-    ]))
-    try:
-        payload = response.json()
-    except JSONDecodeError:
-        payload = response.text
-
-    def normalize(value):
-        if value is None:
-            return None
-        if isinstance(value, (dict, list)):
-            value = dumps(value, sort_keys=True)
-        return "".join(str(value).split()).lower()
-
-    if response.status_code >= 300:
-        matched_expected = False
-        if acceptable_response:
-            expected_status, expected_body = acceptable_response
-            if response.status_code == expected_status:
-                normalized_expected = normalize(expected_body)
-                normalized_actual = normalize(payload)
-                if normalized_expected is None or (
-                    normalized_actual is not None
-                    and normalized_expected in normalized_actual
-                ):
-                    matched_expected = True
-                    if skip_message:
-                        logger.info(skip_message)
-                    else:
-                        logger.info(
-                            "Received expected %s response from %s; continuing initialization.",
-                            response.status_code,
-                            url,
-                        )
-        if not matched_expected:
-            response.raise_for_status()
-
-    return payload
-
-
-def configure_or_exit(description: str, url: str, body: dict, acceptable_response=None, skip_message=None, method: str = "post"):
+client = HTTPClient(logger=logger, headers=headers)
+
+wait_for_http("Radarr API", f"http://{RADARR_HOST}/api/v3/system/status", headers={"x-api-key": API_KEY}, logger=logger)
+
+
+def reconcile_or_exit(description: str, reconcile, *args, **kwargs):
     try:
-        return _request(
-            method=method,
-            url=url,
-            headers=headers,
-            body=body,
-            acceptable_response=acceptable_response,
-            skip_message=skip_message,
-        )
-    except requests.HTTPError:
-        logger.error("There was an error while %s!", description)
+        return reconcile(*args, **kwargs)
+    except RequestException as exc:
+        logger.error("There was an error while %s! %s", description, exc)
         sys.exit(1)
 
+# Current resources are read once; only missing or drifted ones are written
+secrets = SecretStore(os.getenv("RADARR_SECRETS_PATH", state_path(CONFIG_PATH, "radarr-secrets.json")), logger)
+api_url = "http://{}/api/v3".format(RADARR_HOST)
+download_clients = Collection(
+    client, api_url, DownloadClient, "qBitTorrent download client in Radarr", logger=logger, secrets=secrets
+)
+remote_path_mappings = Collection(client, api_url, RemotePathMapping, "Remote Path Mapping in Radarr", logger=logger)
+root_folders = Collection(client, api_url, RootFolder, "Root Folder in Radarr", logger=logger)
+
+begin_phase("download-client")
 logger.info("Setup qBitTorrent in Radarr")
-configure_or_exit(
+reconcile_or_exit(
     "setting qBitTorrent in Radarr",
-    url="http://{}/api/v3/downloadclient".format(RADARR_HOST),
-    body={
+    download_clients.reconcile,
+    {
         "enable": True,
         "protocol": "torrent",
         "priority": 1,
@@ -194,38 +162,36 @@ configure_or_exit(
         "infoLink": "https://wiki.servarr.com/radarr/supported#qbittorrent",
         "tags": []
     },
-    acceptable_response=(400, "Should be unique"),
-    skip_message="qBitTorrent already configured in Radarr; skipping",
 )
 
+begin_phase("remote-path-mapping")
 logger.info("Setup Remote Path Mapping")
-configure_or_exit(
+reconcile_or_exit(
     "setting the Remote Path Mapping",
-    url="http://{}/api/v3/remotepathmapping".format(RADARR_HOST),
-    body={
+    remote_path_mappings.reconcile,
+    {
         "host": TORRENT_SERVICE,
         "remotePath": "/downloads",
         "localPath": "/mnt/downloads/"
     },
-    acceptable_response=(500, "RemotePath already configured."),
-    skip_message="Remote Path Mapping already configured in Radarr; skipping",
 )
 
+begin_phase("root-folder")
 logger.info("Setup Root Folder")
-configure_or_exit(
+reconcile_or_exit(
     "setting the Root Folder",
-    url="http://{}/api/v3/rootFolder".format(RADARR_HOST),
-    body={ "path": "/mnt/media/" },
-    acceptable_response=(400, "already configured as a root folder"),
-    skip_message="Root folder already configured in Radarr; skipping",
+    root_folders.reconcile,
+    { "path": "/mnt/media/" },
 )
 
+begin_phase("media-management")
 logger.info("Configuring Radarr media management defaults")
-configure_or_exit(
+reconcile_or_exit(
     "configuring Radarr media management settings",
-    method="put",
-    url="http://{}/api/v3/config/mediamanagement".format(RADARR_HOST),
-    body={
+    reconcile_settings,
+    client,
+    f"{api_url}/config/mediamanagement",
+    {
         "autoUnmonitorPreviouslyDownloadedMovies": True,
         "recycleBin": "",
         "recycleBinCleanupDays": 7,
@@ -249,4 +215,8 @@ configure_or_exit(
         "enableMediaInfo": True,
         "id": 1,
     },
+    label="Radarr media management settings",
+    logger=logger,
 )
+
+applied_state.record()
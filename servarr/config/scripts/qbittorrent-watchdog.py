@@ -0,0 +1,123 @@
+#!/usr/local/bin/python3
+
+"""Stop qBittorrent's downloads before the volumes they write to fill up.
+
+Every `WATCHDOG_INTERVAL` seconds the usage of each path in `WATCHDOG_PATHS`
+is read with statvfs, which costs no API call. When one of them reaches the
+high watermark, the torrents still downloading are tagged `WATCHDOG_TAG` and
+stopped; once every path is back under the low watermark, the tagged torrents
+are started again and untagged. Torrents stopped by hand carry no tag and are
+left alone, and the tag lets a restarted watchdog pick up where it stopped.
+
+The watchdog keeps one WebUI session (see servarr_qbittorrent) and only talks
+to qBittorrent while a volume is above the high watermark or torrents are held.
+"""
+
+import logging
+import os
+import sys
+import time
+
+from servarr_http import HTTPClient, RequestException
+from servarr_qbittorrent import QBittorrentClient
+
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+console_handler = logging.StreamHandler()
+log_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_handler.setFormatter(log_format)
+logger.addHandler(console_handler)
+
+QBITTORRENT_HOST = os.getenv("QBITTORRENT_HOST", "localhost:10095")
+TORRENT_USERNAME = os.getenv("TORRENT_USERNAME")
+TORRENT_PASSWORD = os.getenv("TORRENT_PASSWORD")
+WATCHDOG_PATHS = [path.strip() for path in os.getenv("WATCHDOG_PATHS", "/downloads").split(",") if path.strip()]
+HIGH_WATERMARK = float(os.getenv("WATCHDOG_HIGH_WATERMARK", "95"))
+LOW_WATERMARK = float(os.getenv("WATCHDOG_LOW_WATERMARK", "90"))
+WATCHDOG_INTERVAL = float(os.getenv("WATCHDOG_INTERVAL", "30"))
+WATCHDOG_TAG = os.getenv("WATCHDOG_TAG", "servarr-low-space")
+
+# The `downloading` filter also lists stopped downloads (TorrentImpl::isDownloading());
+# those were stopped by hand or are already held, and must not be tagged.
+STOPPED_STATES = ("pausedDL", "stoppedDL")
+
+
+def used_percent(path: str) -> float:
+    """Share of `path`'s filesystem that unprivileged writers can no longer use."""
+    st = os.statvfs(path)
+    if not st.f_blocks:
+        return 0.0
+    return 100.0 * (st.f_blocks - st.f_bavail) / st.f_blocks
+
+
+def usage() -> dict:
+    return {path: used_percent(path) for path in WATCHDOG_PATHS}
+
+
+def describe(usages: dict) -> str:
+    return ", ".join("{0} {1:.1f}%".format(path, percent) for path, percent in usages.items())
+
+
+if not TORRENT_USERNAME or not TORRENT_PASSWORD:
+    logger.error("TORRENT_USERNAME and TORRENT_PASSWORD are required")
+    sys.exit(1)
+if not 0 < LOW_WATERMARK < HIGH_WATERMARK <= 100:
+    logger.error(
+        "The watermarks must satisfy 0 < low < high <= 100 (low %g%%, high %g%%)", LOW_WATERMARK, HIGH_WATERMARK
+    )
+    sys.exit(1)
+try:
+    logger.info("Watching %s (stop at %g%%, start again at %g%%)", describe(usage()), HIGH_WATERMARK, LOW_WATERMARK)
+except OSError as exc:
+    logger.error("Unable to read the usage of the watched volumes: %s", exc)
+    sys.exit(1)
+
+qbittorrent = QBittorrentClient(HTTPClient(logger=logging.getLogger("servarr_http")), f"http://{QBITTORRENT_HOST}", logger=logger)
+# Unknown until the first session is open
+holding = None
+
+while True:
+    try:
+        usages = usage()
+    except OSError as exc:
+        logger.warning("Unable to read the usage of the watched volumes: %s", exc)
+        time.sleep(WATCHDOG_INTERVAL)
+        continue
+
+    full = {path: percent for path, percent in usages.items() if percent >= HIGH_WATERMARK}
+    try:
+        if holding is None:
+            qbittorrent.login(TORRENT_USERNAME, TORRENT_PASSWORD)
+            # Torrents tagged by a previous watchdog are still held
+            holding = bool(qbittorrent.torrents(tag=WATCHDOG_TAG))
+        if full:
+            downloading = [
+                torrent["hash"]
+                for torrent in qbittorrent.torrents(filter="downloading")
+                if torrent.get("state") not in STOPPED_STATES
+            ]
+            if downloading:
+                qbittorrent.add_tags(downloading, [WATCHDOG_TAG])
+                qbittorrent.stop(downloading)
+                logger.warning(
+                    "%s above the %g%% high watermark; stopped %d downloading torrents",
+                    describe(full),
+                    HIGH_WATERMARK,
+                    len(downloading),
+                )
+            holding = True
+        elif holding and all(percent < LOW_WATERMARK for percent in usages.values()):
+            held = [torrent["hash"] for torrent in qbittorrent.torrents(tag=WATCHDOG_TAG)]
+            if held:
+                qbittorrent.start(held)
+                qbittorrent.remove_tags(held, [WATCHDOG_TAG])
+            logger.info(
+                "%s below the %g%% low watermark; started %d torrents again", describe(usages), LOW_WATERMARK, len(held)
+            )
+            holding = False
+    except (RequestException, ValueError) as exc:
+        # qBittorrent starting, restarting or unreachable: the next poll tries again with a new session
+        logger.warning("Unable to reach qBittorrent: %s", exc)
+        holding = None
+    time.sleep(WATCHDOG_INTERVAL)
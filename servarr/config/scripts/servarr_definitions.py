@@ -0,0 +1,199 @@
+"""Incremental sync of custom Prowlarr indexer definitions.
+
+Definitions are compared by content: every file is identified by its git blob
+id (`sha1("blob <size>\\0" + content)`), which is what the GitHub contents API
+reports for each file. Listing the upstream directory is therefore enough to
+know which local files are missing or stale, and only those are downloaded and
+replaced (by atomic rename, so Prowlarr never reads a partial file).
+
+The files written by the sync are recorded in a manifest on the Prowlarr
+volume; files that drop out of the source are removed only when the manifest
+says the sync put them there, so hand-made definitions are left alone.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tarfile
+
+from servarr_state import write_atomic
+
+
+DEFINITION_SUFFIXES = (".yml", ".yaml")
+
+
+def blob_id(content: bytes) -> str:
+    """Git blob id of `content`, as listed by the GitHub contents API."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def is_definition(name: str) -> bool:
+    return name.endswith(DEFINITION_SUFFIXES) and not name.startswith(".")
+
+
+class BundleSource:
+    """Definitions vendored in a local directory (e.g. a mounted ConfigMap) or a tar archive."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._files = None
+
+    def describe(self) -> str:
+        return f"bundle {self.path}"
+
+    def _load(self) -> dict:
+        if self._files is None:
+            self._files = {}
+            if os.path.isdir(self.path):
+                for name in sorted(os.listdir(self.path)):
+                    if is_definition(name) and os.path.isfile(os.path.join(self.path, name)):
+                        with open(os.path.join(self.path, name), "rb") as handle:
+                            self._files[name] = handle.read()
+            else:
+                try:
+                    with tarfile.open(self.path) as archive:
+                        for member in archive:
+                            name = os.path.basename(member.name)
+                            if member.isfile() and is_definition(name):
+                                self._files[name] = archive.extractfile(member).read()
+                except tarfile.TarError as exc:
+                    raise ValueError(f"{self.path} is neither a directory nor a tar archive: {exc}") from exc
+        return self._files
+
+    def manifest(self, etag: str = None) -> tuple:
+        """`({name: blob id}, etag)` of the definitions in the bundle."""
+        return {name: blob_id(content) for name, content in self._load().items()}, None
+
+    def read(self, name: str, _blob: str) -> bytes:
+        return self._load()[name]
+
+
+class GitHubSource:
+    """Definitions in a directory of a GitHub repository, listed through the contents API."""
+
+    def __init__(self, client, repository: str, ref: str, directory: str, api_url: str = "https://api.github.com"):
+        self.client = client
+        self.repository = repository
+        self.ref = ref
+        self.directory = directory.strip("/")
+        self.api_url = api_url.rstrip("/")
+        self._urls = {}
+
+    def describe(self) -> str:
+        return f"{self.repository}@{self.ref}:{self.directory}"
+
+    def manifest(self, etag: str = None) -> tuple:
+        """`({name: blob id}, etag)` of the upstream directory, or `(None, etag)` when unchanged since `etag`."""
+        headers = {"Accept": "application/vnd.github+json"}
+        if etag:
+            headers["If-None-Match"] = etag
+        response = self.client.get(
+            f"{self.api_url}/repos/{self.repository}/contents/{self.directory}?ref={self.ref}",
+            headers=headers,
+        )
+        if response.status_code == 304:
+            return None, etag
+        response.raise_for_status()
+        files = {}
+        for entry in response.json():
+            if entry.get("type") == "file" and is_definition(entry.get("name", "")):
+                files[entry["name"]] = entry["sha"]
+                self._urls[entry["name"]] = entry.get("download_url")
+        return files, response.headers.get("ETag")
+
+    def read(self, name: str, blob: str) -> bytes:
+        # Blobs are immutable, so a file listed in a cached manifest is fetched by id.
+        url = self._urls.get(name) or f"{self.api_url}/repos/{self.repository}/git/blobs/{blob}"
+        headers = {} if name in self._urls else {"Accept": "application/vnd.github.raw"}
+        response = self.client.get(url, headers=headers)
+        response.raise_for_status()
+        return response.content
+
+
+class DefinitionSync:
+    """Brings `target` in line with a source, touching only the files that differ.
+
+    `owner` is a `(uid, gid)` applied to the files and directories the sync
+    creates; `state_path` holds the manifest of the managed files and the ETag
+    of the last upstream listing.
+    """
+
+    def __init__(self, target: str, state_path: str, owner: tuple = None, logger: logging.Logger = None):
+        self.target = target
+        self.state_path = state_path
+        self.owner = owner
+        self.logger = logger or logging.getLogger(__name__)
+        self.state = self._load_state()
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as handle:
+                state = json.load(handle)
+        except FileNotFoundError:
+            return {"files": {}}
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Ignoring unreadable definitions manifest %s: %s", self.state_path, exc)
+            return {"files": {}}
+        return {"files": {}, **state}
+
+    def _chown(self, path: str):
+        if self.owner is not None:
+            os.chown(path, *self.owner)
+
+    def _makedirs(self, path: str):
+        if os.path.isdir(path):
+            return
+        self._makedirs(os.path.dirname(path))
+        os.mkdir(path)
+        self._chown(path)
+
+    def _local_blob(self, name: str):
+        try:
+            with open(os.path.join(self.target, name), "rb") as handle:
+                return blob_id(handle.read())
+        except FileNotFoundError:
+            return None
+
+    def sync(self, source) -> dict:
+        """Apply `source`; return the names written, removed and left unchanged.
+
+        Raises RequestException when the source cannot be read and ValueError
+        when a downloaded file does not match its listed blob id.
+        """
+        state = self.state
+        same_source = state.get("source") == source.describe()
+        wanted, etag = source.manifest(state.get("etag") if same_source else None)
+        if wanted is None:
+            self.logger.info("Definitions in %s unchanged since the last sync", source.describe())
+            wanted = state["files"]
+
+        self._makedirs(self.target)
+        changes = {"written": [], "removed": [], "unchanged": []}
+        for name, blob in sorted(wanted.items()):
+            if self._local_blob(name) == blob:
+                changes["unchanged"].append(name)
+                continue
+            content = source.read(name, blob)
+            if blob_id(content) != blob:
+                raise ValueError(f"{name} does not match its listed content id {blob}")
+            path = os.path.join(self.target, name)
+            write_atomic(path, content)
+            self._chown(path)
+            changes["written"].append(name)
+
+        for name in sorted(set(state["files"]) - set(wanted)):
+            try:
+                os.remove(os.path.join(self.target, name))
+                changes["removed"].append(name)
+            except FileNotFoundError:
+                pass
+
+        self.state = {"source": source.describe(), "etag": etag, "files": wanted}
+        write_atomic(self.state_path, json.dumps(self.state, indent=2, sort_keys=True).encode("utf-8"))
+        return changes
+
+    def keep(self) -> int:
+        """Number of managed definitions still in place when the source is unavailable."""
+        return sum(1 for name, blob in self.state["files"].items() if self._local_blob(name) == blob)
+
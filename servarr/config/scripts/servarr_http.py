@@ -0,0 +1,386 @@
+"""Pooled HTTP client shared by the Servarr init scripts.
+
+Every init Job talks to one or two in-cluster services many times in a row.
+Instead of paying a TCP handshake and a cluster DNS lookup per call, the
+client keeps idle keep-alive connections per host and caches resolved
+addresses for a short while. Only the standard library is used so the module
+can be mounted next to any init script as-is.
+"""
+
+import gzip
+import http.client
+import json
+import logging
+import os
+import socket
+import ssl
+import threading
+import time
+import zlib
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urljoin, urlsplit
+
+
+CONNECT_TIMEOUT = float(os.getenv("INIT_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("INIT_HTTP_READ_TIMEOUT", "120"))
+POOL_SIZE = int(os.getenv("INIT_HTTP_POOL_SIZE", "8"))
+DNS_TTL = float(os.getenv("INIT_HTTP_DNS_TTL", "300"))
+MAX_REDIRECTS = 5
+
+# `HTTPClient.request` takes a `json` argument like requests does, which shadows the module there.
+_dumps = json.dumps
+
+# Callables notified with a record dict after every request (see servarr_metrics).
+observers = []
+
+# Errors raised when a kept-alive connection was closed by the server while idle.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+# Methods the client sends again by itself when a kept-alive connection turns out to be stale.
+# Other requests are only sent again when writing them failed, before the server could act on them.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class RequestException(Exception):
+    """Base error for any failed request (connection, timeout or HTTP status)."""
+
+
+class HTTPError(RequestException):
+    def __init__(self, message: str, response: "Response"):
+        super().__init__(message)
+        self.response = response
+
+
+class Response:
+    """Minimal response object mirroring the parts of `requests.Response` the scripts use."""
+
+    def __init__(self, method: str, url: str, status_code: int, reason: str, headers, content: bytes):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        # Times the request was re-sent because a kept-alive connection had gone stale.
+        self.retries = 0
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            kind = "Client" if self.status_code < 500 else "Server"
+            raise HTTPError(
+                f"{self.status_code} {kind} Error: {self.reason} for url: {self.url}",
+                response=self,
+            )
+
+
+def normalize(value):
+    """Collapse a payload into a whitespace-free lowercase string for loose comparisons."""
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, sort_keys=True)
+    return "".join(str(value).split()).lower()
+
+
+class _Resolver:
+    """Caches getaddrinfo results so repeated calls skip the cluster DNS round trip."""
+
+    def __init__(self, ttl: float):
+        self._ttl = ttl
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int):
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > now:
+                return cached[1]
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        with self._lock:
+            self._cache[key] = (now + self._ttl, addresses)
+        return addresses
+
+    def forget(self, host: str, port: int):
+        with self._lock:
+            self._cache.pop((host, port), None)
+
+    def connect(self, host: str, port: int, timeout: float) -> socket.socket:
+        last_error = None
+        for family, socktype, proto, _, address in self.resolve(host, port):
+            sock = socket.socket(family, socktype, proto)
+            try:
+                sock.settimeout(timeout)
+                sock.connect(address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                return sock
+            except OSError as exc:
+                last_error = exc
+                sock.close()
+        # Every cached address failed: the service may have moved, resolve again next time.
+        self.forget(host, port)
+        raise last_error or OSError(f"Unable to resolve {host}:{port}")
+
+
+class _HTTPConnection(http.client.HTTPConnection):
+    def __init__(self, host, port, resolver, connect_timeout, read_timeout):
+        super().__init__(host, port, timeout=connect_timeout)
+        self._resolver = resolver
+        self._read_timeout = read_timeout
+
+    def connect(self):
+        self.sock = self._resolver.connect(self.host, self.port, self.timeout)
+        self.sock.settimeout(self._read_timeout)
+
+
+class _HTTPSConnection(_HTTPConnection):
+    default_port = http.client.HTTPS_PORT
+
+    def __init__(self, host, port, resolver, connect_timeout, read_timeout):
+        super().__init__(host, port, resolver, connect_timeout, read_timeout)
+        self._context = ssl.create_default_context()
+
+    def connect(self):
+        super().connect()
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host)
+
+
+class HTTPClient:
+    """Thread-safe HTTP client with per-host keep-alive pools and a DNS cache.
+
+    `headers` are sent with every request, per-call headers are merged on top.
+    Cookies set by a host are replayed to that host, like a `requests.Session`.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger = None,
+        headers: dict = None,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        read_timeout: float = READ_TIMEOUT,
+        pool_size: int = POOL_SIZE,
+        dns_ttl: float = DNS_TTL,
+    ):
+        self.logger = logger or logging.getLogger(__name__)
+        self.headers = dict(headers or {})
+        self.cookies = {}
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_size = pool_size
+        self._resolver = _Resolver(dns_ttl)
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    # Connection pool
+
+    def _acquire(self, scheme: str, host: str, port: int):
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        connection_class = _HTTPSConnection if scheme == "https" else _HTTPConnection
+        return connection_class(host, port, self._resolver, self.connect_timeout, self.read_timeout), False
+
+    def _release(self, scheme: str, host: str, port: int, connection):
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for idle in pools.values():
+            for connection in idle:
+                connection.close()
+
+    # Requests
+
+    def _send(self, method: str, url: str, body: bytes, headers: dict) -> Response:
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        host = parts.hostname
+        port = parts.port or (443 if scheme == "https" else 80)
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+
+        # The jar is shared with the other threads, like the pool
+        with self._lock:
+            cookie_jar = dict(self.cookies.get(host) or {})
+        if cookie_jar:
+            headers = {**headers, "Cookie": "; ".join(f"{k}={v}" for k, v in cookie_jar.items())}
+
+        retries = 0
+        while True:
+            connection, reused = self._acquire(scheme, host, port)
+            written = False
+            try:
+                connection.request(method, target, body=body, headers=headers)
+                written = True
+                raw = connection.getresponse()
+                content = raw.read()
+            except STALE_CONNECTION_ERRORS as exc:
+                connection.close()
+                if reused and retries == 0 and (method in IDEMPOTENT_METHODS or not written):
+                    retries += 1
+                    continue
+                raise RequestException(f"Connection to {host}:{port} failed: {exc!r}") from exc
+            except (OSError, http.client.HTTPException) as exc:
+                connection.close()
+                raise RequestException(f"Connection to {host}:{port} failed: {exc!r}") from exc
+            break
+
+        if raw.will_close:
+            connection.close()
+        else:
+            self._release(scheme, host, port, connection)
+
+        received = {}
+        for header in raw.headers.get_all("Set-Cookie") or []:
+            cookie = SimpleCookie()
+            cookie.load(header)
+            received.update({k: m.value for k, m in cookie.items()})
+        if received:
+            with self._lock:
+                self.cookies.setdefault(host, {}).update(received)
+
+        encoding = (raw.headers.get("Content-Encoding") or "").lower()
+        if encoding == "gzip":
+            content = gzip.decompress(content)
+        elif encoding == "deflate":
+            content = zlib.decompress(content)
+
+        response = Response(method, url, raw.status, raw.reason, raw.headers, content)
+        response.retries = retries
+        return response
+
+    def request(self, method: str, url: str, json=None, data=None, headers: dict = None) -> Response:
+        """Send a request; `json` is serialized as JSON, `data` is form-encoded."""
+        method = method.upper()
+        merged = {"Accept-Encoding": "gzip", **self.headers, **(headers or {})}
+        lowered = {key.lower() for key in merged}
+        body = None
+        if json is not None:
+            body = _dumps(json)
+            if "content-type" not in lowered:
+                merged["Content-Type"] = "application/json"
+        elif data is not None:
+            body = data if isinstance(data, (bytes, str)) else urlencode(data, doseq=True)
+            if "content-type" not in lowered:
+                merged["Content-Type"] = "application/x-www-form-urlencoded"
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        self.logger.debug(" ".join([
+            method,
+            url,
+            ", ".join(f"{key}: {value}" for key, value in merged.items()),
+            str(json if json is not None else data or ""),
+        ]))
+        started = time.monotonic()
+        retries = 0
+        try:
+            response = self._send(method, url, body, merged)
+            retries += response.retries
+            redirects = 0
+            while response.status_code in (301, 302, 303, 307, 308) and redirects < MAX_REDIRECTS:
+                redirects += 1
+                url = urljoin(url, response.headers.get("Location", ""))
+                if response.status_code in (301, 302, 303) and method != "HEAD":
+                    method, body = "GET", None
+                    merged = {k: v for k, v in merged.items() if k.lower() != "content-type"}
+                response = self._send(method, url, body, merged)
+                retries += response.retries
+        except RequestException:
+            self._notify(method, url, 0, started, retries, 0)
+            raise
+        self._notify(method, url, response.status_code, started, retries, len(response.content))
+        self.logger.debug(" ".join([
+            "Status Code:",
+            str(response.status_code),
+            "Response body:",
+            response.text,
+        ]))
+        return response
+
+    def _notify(self, method: str, url: str, status: int, started: float, retries: int, size: int):
+        if not observers:
+            return
+        record = {
+            "method": method,
+            "url": url,
+            "status": status,
+            "elapsed": time.monotonic() - started,
+            "retries": retries,
+            "bytes": size,
+        }
+        for observer in observers:
+            observer(record)
+
+    def get(self, url: str, **kwargs) -> Response:
+        return self.request("get", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> Response:
+        return self.request("post", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> Response:
+        return self.request("put", url, **kwargs)
+
+    def call(self, method: str, url: str, body=None, headers: dict = None, acceptable_response=None, skip_message=None):
+        """Send a JSON request and return the decoded payload.
+
+        Statuses >= 300 raise `HTTPError`, unless they match `acceptable_response`:
+        a `(status, body)` tuple where `body` must be contained in the response
+        (whitespace and case insensitive) or be `None` to accept any body. This is
+        how the init scripts stay idempotent across re-runs.
+        """
+        response = self.request(method, url, json=body, headers=headers)
+        payload = decode(response)
+        if response.status_code < 300:
+            return payload
+
+        if acceptable_response:
+            expected_status, expected_body = acceptable_response
+            if response.status_code == expected_status:
+                normalized_expected = normalize(expected_body)
+                normalized_actual = normalize(payload)
+                if normalized_expected is None or (
+                    normalized_actual is not None and normalized_expected in normalized_actual
+                ):
+                    if skip_message:
+                        self.logger.info(skip_message)
+                    else:
+                        self.logger.info(
+                            "Received expected %s response from %s; continuing initialization.",
+                            response.status_code,
+                            url,
+                        )
+                    return payload
+
+        response.raise_for_status()
+        raise HTTPError(f"{response.status_code} Unexpected status for url: {url}", response=response)
+
+
+def decode(response: Response):
+    """Return the JSON payload of a response, or its text when it is not JSON."""
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
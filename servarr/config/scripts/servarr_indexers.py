@@ -0,0 +1,316 @@
+"""Prowlarr indexer declarations.
+
+An entry of the chart's `indexers` list is either a full request body
+(`{"name": ..., "body": {...}}`) or a compact declaration naming the indexer
+definition and only what differs from its defaults:
+
+    {"name": "1337x", "definition": "1337x", "priority": 20, "fields": {"sort": 2}}
+
+Compact declarations are expanded locally from the templates Prowlarr serves
+at `/api/v1/indexer/schema`, so the bodies always match the running Prowlarr
+version. The schema is large (one template per Cardigann definition), so it is
+downloaded at most once per run and the templates in use are cached on the
+Prowlarr volume, keyed by the Prowlarr version.
+
+`validate` checks a body against the same templates, so mistakes in the
+declarations are reported together before Prowlarr tests any indexer.
+
+Long lists do not fit a single ConfigMap, so `read_declarations` accepts a
+file or a directory of files, plain or gzip-compressed, holding either a JSON
+array or one declaration per line, and yields the declarations one at a time.
+"""
+
+import copy
+import gzip
+import json
+import logging
+import os
+import threading
+
+from servarr_resources import Indexer
+from servarr_state import write_atomic
+
+
+# Field privacy levels Prowlarr uses for credentials, which private indexers cannot do without.
+CREDENTIAL_PRIVACY = ("password", "apiKey", "userName")
+
+# Keys of a compact declaration that are not top-level settings of the body.
+DECLARATION_KEYS = ("name", "definition", "fields")
+# Settings every declared indexer gets unless the declaration overrides them.
+DEFAULT_SETTINGS = {"enable": True, "appProfileId": 1, "tags": []}
+
+
+# Size of the blocks read from a declarations file.
+READ_SIZE = 1 << 16
+
+
+def is_compact(declaration: dict) -> bool:
+    return "body" not in declaration and "definition" in declaration
+
+
+def _send_once(description: str, send):
+    return send()
+
+
+class IndexerSchema:
+    """Indexer templates by definition name, from the cache or `/api/v1/indexer/schema`.
+
+    `retry(description, send)` returns the response of `send()`, sent again
+    while Prowlarr is overloaded; by default every request is sent once.
+    """
+
+    def __init__(self, client, api_url: str, headers: dict, cache_path: str, logger: logging.Logger = None,
+                 retry=_send_once):
+        self.client = client
+        self.retry = retry
+        self.api_url = api_url
+        self.headers = headers
+        self.cache_path = cache_path
+        self.logger = logger or logging.getLogger(__name__)
+        self._version = None
+        self._cached = None
+        self._schema = None
+        self._used = set()
+        self._lock = threading.Lock()
+
+    def _get(self, path: str):
+        url = f"{self.api_url}{path}"
+        response = self.retry(f"GET {url}", lambda: self.client.get(url, headers=self.headers))
+        response.raise_for_status()
+        return response.json()
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = str(self._get("/system/status").get("version", ""))
+        return self._version
+
+    def _load_cache(self) -> dict:
+        if self._cached is None:
+            self._cached = {}
+            try:
+                with open(self.cache_path, encoding="utf-8") as handle:
+                    cache = json.load(handle)
+            except FileNotFoundError:
+                cache = {}
+            except (OSError, ValueError) as exc:
+                self.logger.warning("Ignoring unreadable indexer schema cache %s: %s", self.cache_path, exc)
+                cache = {}
+            if cache.get("version") == self.version:
+                self._cached = cache.get("templates", {})
+            elif cache:
+                self.logger.info("Indexer schema cache is for Prowlarr %s, running %s", cache.get("version"), self.version)
+        return self._cached
+
+    def _fetch(self) -> dict:
+        if self._schema is None:
+            self.logger.info("Downloading the indexer schema of Prowlarr %s", self.version)
+            self._schema = {
+                (template.get("definitionName") or template.get("implementation") or "").lower(): template
+                for template in self._get("/indexer/schema")
+            }
+        return self._schema
+
+    def template(self, definition: str):
+        """Copy of the template for `definition`, or None when Prowlarr does not know it."""
+        key = definition.lower()
+        with self._lock:
+            template = self._load_cache().get(key)
+            if template is None:
+                template = self._fetch().get(key)
+            if template is None:
+                return None
+            self._used.add(key)
+            return copy.deepcopy(template)
+
+    def save(self):
+        """Cache the templates used by this run (plus the ones cached before) for the next one."""
+        with self._lock:
+            if self._schema is None or not self.cache_path:
+                return
+            templates = {key: self._cached.get(key) or self._schema[key] for key in self._used | set(self._cached)}
+            templates = {key: template for key, template in templates.items() if template is not None}
+        try:
+            write_atomic(
+                self.cache_path,
+                json.dumps({"version": self.version, "templates": templates}, separators=(",", ":")).encode("utf-8"),
+            )
+        except OSError as exc:
+            self.logger.warning("Unable to cache the indexer schema in %s: %s", self.cache_path, exc)
+
+
+def expand(declaration: dict, schema: IndexerSchema) -> dict:
+    """Full indexer body for a compact declaration; raises ValueError when it cannot be built."""
+    definition = declaration["definition"]
+    template = schema.template(definition)
+    if template is None:
+        raise ValueError(f"Prowlarr {schema.version} has no indexer definition {definition!r}")
+    template.pop("id", None)
+    current = Indexer.from_api(template)
+
+    fields = declaration.get("fields") or {}
+    unknown = sorted(name for name in fields if name not in current.fields)
+    if unknown:
+        raise ValueError(f"definition {definition!r} has no field {', '.join(unknown)}")
+
+    settings = {
+        **DEFAULT_SETTINGS,
+        **{key: value for key, value in declaration.items() if key not in DECLARATION_KEYS},
+        "name": declaration["name"],
+    }
+    desired = Indexer(settings, fields)
+    return desired.to_api(current)
+
+
+def check_value(spec: dict, value) -> str:
+    """Why `value` does not fit the schema field `spec`, or an empty string."""
+    kind = spec.get("type")
+    if value is None:
+        return ""
+    if kind == "checkbox" and not isinstance(value, bool):
+        return f"expects true or false, got {value!r}"
+    if kind == "number":
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            float(value)
+        except (TypeError, ValueError):
+            return f"expects a number, got {value!r}"
+    options = spec.get("selectOptions")
+    if kind == "select" and options:
+        allowed = [option.get("value") for option in options]
+        if value not in allowed and str(value) not in {str(option) for option in allowed}:
+            return f"expects one of {', '.join(map(str, allowed))}, got {value!r}"
+    return ""
+
+
+def validate(body: dict, schema: IndexerSchema, tags: dict, app_profiles: set) -> list:
+    """Problems that would make Prowlarr reject `body`, found without contacting the indexer.
+
+    `tags` maps tag ids and lowercased labels to ids; `app_profiles` holds the
+    existing app profile ids.
+    """
+    problems = [f"missing {key}" for key in ("name", "implementation", "configContract") if not body.get(key)]
+
+    definition = body.get("definitionName") or body.get("implementation")
+    template = schema.template(definition) if definition else None
+    if definition and template is None:
+        problems.append(f"Prowlarr {schema.version} has no indexer definition {definition!r}")
+    if template is not None:
+        expected = (template.get("implementation"), template.get("configContract"))
+        actual = (body.get("implementation"), body.get("configContract"))
+        if all(actual) and actual != expected:
+            problems.append(
+                "implementation {}/{} does not match definition {!r} ({}/{})".format(*actual, definition, *expected)
+            )
+        specs = {field.get("name"): field for field in template.get("fields") or []}
+        values = {}
+        for field in body.get("fields") or []:
+            name = field.get("name")
+            if name not in specs:
+                problems.append(f"definition {definition!r} has no field {name!r}")
+                continue
+            values[name] = field.get("value")
+            reason = check_value(specs[name], values[name])
+            if reason:
+                problems.append(f"field {name!r} {reason}")
+        if template.get("privacy") in ("private", "semiPrivate"):
+            missing = [
+                name for name, spec in specs.items()
+                if spec.get("privacy") in CREDENTIAL_PRIVACY and values.get(name) in (None, "")
+            ]
+            if missing:
+                problems.append(f"private indexer requires {', '.join(missing)}")
+
+    profile = body.get("appProfileId")
+    if profile not in app_profiles:
+        problems.append(f"appProfileId {profile!r} does not exist")
+    for tag in body.get("tags") or []:
+        if (tag.lower() if isinstance(tag, str) else tag) not in tags:
+            problems.append(f"tag {tag!r} does not exist")
+    return problems
+
+
+def resolve_tags(body: dict, tags: dict) -> dict:
+    """`body` with tag labels replaced by their ids."""
+    if not any(isinstance(tag, str) for tag in body.get("tags") or []):
+        return body
+    return {**body, "tags": [tags[tag.lower()] if isinstance(tag, str) else tag for tag in body["tags"]]}
+
+
+def _decode_stream(handle):
+    """JSON values of a text stream holding a JSON array or a sequence of values (JSON lines)."""
+    decoder = json.JSONDecoder()
+    buffer, position, eof = "", 0, False
+    in_array = None
+    # Inside an array: "first" (a value or "]"), "value", "separator" ("," or "]") or "done".
+    expected = "first"
+
+    def more() -> bool:
+        nonlocal buffer, position, eof
+        block = "" if eof else handle.read(READ_SIZE)
+        if not block:
+            eof = True
+            return False
+        buffer, position = buffer[position:] + block, 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if more():
+                continue
+            if in_array and expected != "done":
+                raise ValueError("unterminated JSON array")
+            return
+        char = buffer[position]
+        if in_array is None:
+            in_array = char == "["
+            position += in_array
+            continue
+        if expected == "done":
+            raise ValueError(f"unexpected data after the JSON array at {char!r}")
+        if in_array and (char == "]" and expected in ("first", "separator") or char == "," and expected == "separator"):
+            expected = "done" if char == "]" else "value"
+            position += 1
+            continue
+        if in_array and expected == "separator":
+            raise ValueError(f"expected ',' or ']' in the JSON array, got {char!r}")
+        try:
+            value, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if more():
+                # The value continues in the next block.
+                continue
+            raise
+        if end == len(buffer) and more():
+            # A number at the end of the block may continue in the next one.
+            continue
+        yield value
+        position = end
+        expected = "separator"
+
+
+def read_declarations(path: str):
+    """Yield the indexer declarations stored at `path`, one at a time; nothing when it does not exist.
+
+    A directory is read file by file in name order; `.gz` files are decompressed
+    on the fly. Raises ValueError when a file is not valid JSON.
+    """
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(path, name) for name in os.listdir(path) if not name.startswith("."))
+    elif os.path.isfile(path):
+        paths = [path]
+    else:
+        return
+    for file_path in paths:
+        opener = gzip.open if file_path.endswith(".gz") else open
+        try:
+            with opener(file_path, "rt", encoding="utf-8") as handle:
+                for declaration in _decode_stream(handle):
+                    if not isinstance(declaration, dict):
+                        raise ValueError(f"expected an indexer object, got {declaration!r}")
+                    yield declaration
+        except (OSError, ValueError) as exc:
+            raise ValueError(f"{file_path}: {exc}") from exc
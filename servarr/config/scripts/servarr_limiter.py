@@ -0,0 +1,50 @@
+"""Adaptive concurrency limit for bursts of requests to one app.
+
+Adding an indexer makes Prowlarr test it against the tracker, so how many of
+those requests it copes with at once depends on the trackers and the node. The
+limiter finds out while the requests run instead of relying on a fixed number.
+"""
+
+import logging
+import threading
+
+
+# Answers that mean the app is overloaded rather than the request being wrong (0: connection error), besides 5xx
+OVERLOAD_STATUSES = (0, 429)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to how the app copes with the load (AIMD).
+
+    The limit grows by about one slot per round of fast successful calls, shrinks
+    by a quarter when a call is slower than `latency_target` seconds and is halved
+    on 429/5xx responses. It always stays between 1 and `maximum`.
+    """
+
+    def __init__(self, maximum: int, latency_target: float, logger: logging.Logger = None):
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.logger = logger or logging.getLogger(__name__)
+        self.limit = 1.0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, status: int, latency: float):
+        with self._condition:
+            self._in_flight -= 1
+            previous = int(self.limit)
+            if status in OVERLOAD_STATUSES or status >= 500:
+                self.limit = max(1.0, self.limit / 2)
+            elif latency > self.latency_target:
+                self.limit = max(1.0, self.limit * 0.75)
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+            if int(self.limit) != previous:
+                self.logger.debug("Concurrency changed from %d to %d", previous, int(self.limit))
+            self._condition.notify_all()
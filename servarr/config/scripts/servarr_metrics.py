@@ -0,0 +1,252 @@
+"""Request and phase metrics for the init scripts.
+
+`start_run(app)` records every request made through `servarr_http` (method,
+endpoint template, status, latency, transport retries, response size) and
+prints a JSON summary line prefixed with `SERVARR_INIT_SUMMARY` when the
+script exits. Optional outputs, all driven by the environment:
+
+- `INIT_METRICS_DIR`: also write the summary to `<dir>/<app>-summary.json`
+- `INIT_METRICS_TEXTFILE`: write the metrics in the Prometheus text format,
+  for the node-exporter textfile collector (a directory gets `<app>.prom`)
+- `INIT_PROFILE`: `cpu`, `memory` or `cpu,memory` to run the script under
+  cProfile (main thread) and/or tracemalloc; the profiles are written next to
+  the summary (`INIT_METRICS_DIR`, or the temp directory)
+"""
+
+import atexit
+import json
+import logging
+import math
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+import servarr_http
+from servarr_state import write_atomic
+
+
+METRICS_DIR = os.getenv("INIT_METRICS_DIR", "")
+TEXTFILE = os.getenv("INIT_METRICS_TEXTFILE", "")
+PROFILE = {item.strip() for item in os.getenv("INIT_PROFILE", "").lower().split(",") if item.strip()}
+SUMMARY_PREFIX = "SERVARR_INIT_SUMMARY"
+
+_run = None
+
+
+def endpoint_template(url: str) -> str:
+    """Path of `url` with ids replaced by `{id}`, so calls to the same endpoint group together."""
+    path = urlsplit(url).path or "/"
+    return re.sub(r"/(\d+|[0-9a-f]{32})(?=/|$)", "/{id}", path)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    # Rounded first so float noise (0.1 * 30 = 3.0000000000000004) does not push the rank up
+    rank = max(1, math.ceil(round(fraction * len(values), 9)))
+    return values[min(rank, len(values)) - 1]
+
+
+class Run:
+    """Metrics of one init script run."""
+
+    def __init__(self, app: str, logger: logging.Logger = None):
+        self.app = app
+        self.logger = logger or logging.getLogger(__name__)
+        self.started = time.monotonic()
+        self.phases = {}
+        self._current = None
+        self._current_started = 0.0
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._profiler = None
+
+    def observe(self, record: dict):
+        key = (record["method"], endpoint_template(record["url"]))
+        with self._lock:
+            endpoint = self._endpoints.setdefault(key, {"latencies": [], "statuses": {}, "bytes": 0, "retries": 0})
+            endpoint["latencies"].append(record["elapsed"])
+            status = str(record["status"])
+            endpoint["statuses"][status] = endpoint["statuses"].get(status, 0) + 1
+            endpoint["bytes"] += record["bytes"]
+            endpoint["retries"] += record["retries"]
+
+    def add_phase(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def begin_phase(self, name):
+        """End the current sequential phase, if any, and start `name` (None to just end it)."""
+        now = time.monotonic()
+        with self._lock:
+            if self._current is not None:
+                self.phases[self._current] = self.phases.get(self._current, 0.0) + now - self._current_started
+            self._current, self._current_started = name, now
+
+    def summary(self) -> dict:
+        with self._lock:
+            endpoints = {}
+            for (method, template), endpoint in sorted(self._endpoints.items(), key=lambda item: (item[0][1], item[0][0])):
+                latencies = sorted(endpoint["latencies"])
+                endpoints[f"{method} {template}"] = {
+                    "count": len(latencies),
+                    "statuses": dict(endpoint["statuses"]),
+                    "p50": round(percentile(latencies, 0.50), 4),
+                    "p95": round(percentile(latencies, 0.95), 4),
+                    "max": round(latencies[-1], 4),
+                    "sum": round(sum(latencies), 4),
+                    "bytes": endpoint["bytes"],
+                    "retries": endpoint["retries"],
+                }
+            phases = {name: round(seconds, 4) for name, seconds in self.phases.items()}
+        return {
+            "app": self.app,
+            "duration": round(time.monotonic() - self.started, 4),
+            "phases": phases,
+            "requests": {
+                "total": sum(endpoint["count"] for endpoint in endpoints.values()),
+                "failed": sum(
+                    count
+                    for endpoint in endpoints.values()
+                    for status, count in endpoint["statuses"].items()
+                    if status == "0" or int(status) >= 400
+                ),
+                "retries": sum(endpoint["retries"] for endpoint in endpoints.values()),
+                "bytes": sum(endpoint["bytes"] for endpoint in endpoints.values()),
+            },
+            "endpoints": endpoints,
+        }
+
+    # Profiling
+
+    def start_profiling(self):
+        if "cpu" in PROFILE:
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        if "memory" in PROFILE:
+            import tracemalloc
+
+            tracemalloc.start()
+
+    def stop_profiling(self, summary: dict):
+        directory = METRICS_DIR or tempfile.gettempdir()
+        if self._profiler is not None:
+            self._profiler.disable()
+            path = os.path.join(directory, f"{self.app}.pstats")
+            os.makedirs(directory, exist_ok=True)
+            self._profiler.dump_stats(path)
+            self.logger.info("CPU profile written to %s", path)
+        if "memory" in PROFILE:
+            import tracemalloc
+
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                summary["memory"] = {"current": current, "peak": peak}
+                top = tracemalloc.take_snapshot().statistics("lineno")[:30]
+                tracemalloc.stop()
+                path = os.path.join(directory, f"{self.app}-tracemalloc.txt")
+                write_atomic(path, "\n".join(str(stat) for stat in top).encode("utf-8"))
+                self.logger.info("Memory profile written to %s", path)
+
+    # Output
+
+    def finish(self):
+        if self.observe in servarr_http.observers:
+            servarr_http.observers.remove(self.observe)
+        self.begin_phase(None)
+        summary = self.summary()
+        try:
+            self.stop_profiling(summary)
+        except OSError as exc:
+            self.logger.warning("Unable to write the profile: %s", exc)
+        line = json.dumps(summary, separators=(",", ":"), sort_keys=True)
+        sys.stdout.write(f"{SUMMARY_PREFIX} {line}\n")
+        sys.stdout.flush()
+        if METRICS_DIR:
+            path = os.path.join(METRICS_DIR, f"{self.app}-summary.json")
+            try:
+                write_atomic(path, json.dumps(summary, indent=2, sort_keys=True).encode("utf-8"))
+            except OSError as exc:
+                self.logger.warning("Unable to write the run summary to %s: %s", path, exc)
+        if TEXTFILE:
+            path = os.path.join(TEXTFILE, f"{self.app}.prom") if os.path.isdir(TEXTFILE) else TEXTFILE
+            try:
+                write_atomic(path, prometheus_text(summary).encode("utf-8"))
+            except OSError as exc:
+                self.logger.warning("Unable to write the metrics textfile %s: %s", path, exc)
+
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(summary: dict) -> str:
+    """Render a run summary in the Prometheus text exposition format."""
+    app = _label(summary["app"])
+    lines = [
+        "# HELP servarr_init_duration_seconds Wall time of the last init run.",
+        "# TYPE servarr_init_duration_seconds gauge",
+        f'servarr_init_duration_seconds{{app="{app}"}} {summary["duration"]}',
+        "# HELP servarr_init_last_run_timestamp_seconds When the last init run finished.",
+        "# TYPE servarr_init_last_run_timestamp_seconds gauge",
+        f'servarr_init_last_run_timestamp_seconds{{app="{app}"}} {time.time():.0f}',
+        "# HELP servarr_init_phase_duration_seconds Time spent in each phase of the last init run.",
+        "# TYPE servarr_init_phase_duration_seconds gauge",
+    ]
+    for phase, seconds in summary["phases"].items():
+        lines.append(f'servarr_init_phase_duration_seconds{{app="{app}",phase="{_label(phase)}"}} {seconds}')
+    series = {
+        "requests": ("servarr_init_requests", "gauge", "Requests made by the last init run.", []),
+        "latency": ("servarr_init_request_duration_seconds", "summary", "Request latency of the last init run.", []),
+        "bytes": ("servarr_init_response_bytes", "gauge", "Response bytes received by the last init run.", []),
+        "retries": (
+            "servarr_init_request_retries", "gauge", "Requests re-sent on a stale connection by the last init run.", []
+        ),
+    }
+    for endpoint, stats in summary["endpoints"].items():
+        method, _, template = endpoint.partition(" ")
+        labels = f'app="{app}",method="{method}",endpoint="{_label(template)}"'
+        for status, count in stats["statuses"].items():
+            series["requests"][3].append(f'servarr_init_requests{{{labels},status="{status}"}} {count}')
+        for quantile in ("p50", "p95"):
+            value = f"{int(quantile[1:]) / 100:g}"
+            series["latency"][3].append(f'servarr_init_request_duration_seconds{{{labels},quantile="{value}"}} {stats[quantile]}')
+        series["latency"][3].append(f"servarr_init_request_duration_seconds_sum{{{labels}}} {stats['sum']}")
+        series["latency"][3].append(f"servarr_init_request_duration_seconds_count{{{labels}}} {stats['count']}")
+        series["bytes"][3].append(f"servarr_init_response_bytes{{{labels}}} {stats['bytes']}")
+        series["retries"][3].append(f"servarr_init_request_retries{{{labels}}} {stats['retries']}")
+    for name, metric_type, help_text, samples in series.values():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+def start_run(app: str, logger: logging.Logger = None) -> Run:
+    """Start collecting metrics for this process; the summary is emitted at exit."""
+    global _run
+    if _run is None:
+        _run = Run(app, logger)
+        servarr_http.observers.append(_run.observe)
+        _run.start_profiling()
+        atexit.register(_run.finish)
+    return _run
+
+
+def begin_phase(name: str):
+    """Mark the start of the next step of a script; the previous one ends here."""
+    if _run is not None:
+        _run.begin_phase(name)
+
+
+def add_phase(name: str, seconds: float):
+    """Record a phase timed elsewhere, e.g. a step run by the orchestrator."""
+    if _run is not None:
+        _run.add_phase(name, seconds)
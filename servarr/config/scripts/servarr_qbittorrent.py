@@ -0,0 +1,172 @@
+"""qBittorrent WebUI API client and the preferences the chart manages through it.
+
+Preferences set through `/api/v2/app/setPreferences` take effect immediately
+and qBittorrent saves them to its own qBittorrent.conf, so what is pushed here
+needs no restart and survives one. Only the preferences that differ from what
+qBittorrent reports are sent.
+
+The client also lists, tags, stops and starts torrents, which is all the
+free-space watchdog needs.
+"""
+
+import json
+import logging
+import re
+from urllib.parse import urlencode
+
+from servarr_http import RequestException
+
+
+KIB = 1024
+
+# Values of the `scheduler_days` preference.
+SCHEDULER_DAYS = {
+    "every_day": 0,
+    "weekdays": 1,
+    "weekends": 2,
+    "monday": 3,
+    "tuesday": 4,
+    "wednesday": 5,
+    "thursday": 6,
+    "friday": 7,
+    "saturday": 8,
+    "sunday": 9,
+}
+
+TIME_PATTERN = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+
+
+def parse_time(value) -> tuple:
+    """`(hour, minute)` of a `HH:MM` time of day."""
+    match = TIME_PATTERN.match(str(value).strip())
+    if not match:
+        raise ValueError(f"{value!r} is not a time of day (HH:MM)")
+    return int(match.group(1)), int(match.group(2))
+
+
+def speed_limit(value, name: str) -> int:
+    """A limit in KiB/s from the values, as the bytes/s the API expects (0: unlimited)."""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number of KiB/s, not {value!r}") from None
+    if limit < 0:
+        raise ValueError(f"{name} must be 0 (unlimited) or more, not {limit}")
+    return limit * KIB
+
+
+def bandwidth_preferences(config: dict) -> dict:
+    """WebUI preferences for the `qbittorrent.bandwidth` values; ValueError when they are invalid.
+
+    The alternative limits apply when the schedule window is open (or when
+    they are switched on by hand). qBittorrent has a single window, which
+    wraps past midnight when `to` is earlier than `from`.
+    """
+    preferences = {
+        "alt_dl_limit": speed_limit(config.get("altDownloadLimit", 0), "altDownloadLimit"),
+        "alt_up_limit": speed_limit(config.get("altUploadLimit", 0), "altUploadLimit"),
+    }
+    schedule = config.get("schedule") or {}
+    preferences["scheduler_enabled"] = bool(schedule.get("enabled"))
+    if not preferences["scheduler_enabled"]:
+        return preferences
+
+    start = parse_time(schedule.get("from", "08:00"))
+    end = parse_time(schedule.get("to", "20:00"))
+    if start == end:
+        raise ValueError(f"schedule.from and schedule.to are both {schedule.get('from')}; the window would be empty")
+    days = str(schedule.get("days", "every_day")).lower()
+    if days not in SCHEDULER_DAYS:
+        raise ValueError(f"schedule.days must be one of {', '.join(SCHEDULER_DAYS)}, not {days!r}")
+    preferences.update(
+        {
+            "schedule_from_hour": start[0],
+            "schedule_from_min": start[1],
+            "schedule_to_hour": end[0],
+            "schedule_to_min": end[1],
+            "scheduler_days": SCHEDULER_DAYS[days],
+        }
+    )
+    return preferences
+
+
+class QBittorrentClient:
+    """Session on the qBittorrent WebUI API at `url` (e.g. `http://qbittorrent:10095`).
+
+    qBittorrent drops sessions that stay idle longer than its session timeout;
+    after `login`, a call answered with 403 logs in again once and is retried,
+    so a long-running caller can keep a single client.
+    """
+
+    def __init__(self, client, url: str, logger: logging.Logger = None):
+        self.client = client
+        self.url = url.rstrip("/")
+        self.logger = logger or logging.getLogger(__name__)
+        # With CSRF protection on, qBittorrent rejects calls whose Referer is not its own address.
+        self.headers = {"Referer": self.url}
+        self._credentials = None
+        self._webapi_version = None
+
+    def login(self, username: str, password: str):
+        """Open a session; the SID cookie is replayed by the HTTP client."""
+        response = self.client.post(
+            f"{self.url}/api/v2/auth/login",
+            data={"username": username, "password": password},
+            headers=self.headers,
+        )
+        response.raise_for_status()
+        if response.text.strip() != "Ok.":
+            raise RequestException(f"qBittorrent at {self.url} rejected the credentials of {username}")
+        self._credentials = (username, password)
+
+    def _request(self, method: str, endpoint: str, query: dict = None, data: dict = None):
+        url = f"{self.url}/api/v2/{endpoint}"
+        if query:
+            url = f"{url}?{urlencode(query)}"
+        response = self.client.request(method, url, data=data, headers=self.headers)
+        if response.status_code == 403 and self._credentials:
+            self.logger.info("qBittorrent session expired; logging in again")
+            self.login(*self._credentials)
+            response = self.client.request(method, url, data=data, headers=self.headers)
+        response.raise_for_status()
+        return response
+
+    def webapi_version(self) -> tuple:
+        if self._webapi_version is None:
+            text = self._request("get", "app/webapiVersion").text.strip()
+            self._webapi_version = tuple(int(part) for part in text.split(".") if part.isdigit())
+        return self._webapi_version
+
+    def preferences(self) -> dict:
+        return self._request("get", "app/preferences").json()
+
+    def set_preferences(self, changes: dict):
+        self._request("post", "app/setPreferences", data={"json": json.dumps(changes)})
+
+    def apply_preferences(self, desired: dict) -> list:
+        """Send the preferences of `desired` that differ from the running ones; return their names."""
+        current = self.preferences()
+        changes = {name: value for name, value in desired.items() if current.get(name) != value}
+        if changes:
+            self.set_preferences(changes)
+        return sorted(changes)
+
+    def torrents(self, **filters) -> list:
+        """Torrents matching `filters` (`filter`, `category`, `tag`, ...), as listed by `torrents/info`."""
+        return self._request("get", "torrents/info", query=filters).json()
+
+    def _torrents_action(self, action: str, hashes: list, **data):
+        self._request("post", f"torrents/{action}", data={"hashes": "|".join(hashes), **data})
+
+    def stop(self, hashes: list):
+        # WebUI API 2.11 (qBittorrent 5) renamed pause/resume to stop/start.
+        self._torrents_action("stop" if self.webapi_version() >= (2, 11) else "pause", hashes)
+
+    def start(self, hashes: list):
+        self._torrents_action("start" if self.webapi_version() >= (2, 11) else "resume", hashes)
+
+    def add_tags(self, hashes: list, tags: list):
+        self._torrents_action("addTags", hashes, tags=",".join(tags))
+
+    def remove_tags(self, hashes: list, tags: list):
+        self._torrents_action("removeTags", hashes, tags=",".join(tags))
@@ -0,0 +1,101 @@
+"""Readiness gates for the init scripts.
+
+The apps are often still starting when their init Job runs: the service may
+refuse connections, answer before its API is usable, or not have written its
+`config.xml` yet. These helpers poll the real signal with jittered exponential
+backoff until it is there, bounded by one deadline for the whole process
+(`READINESS_TIMEOUT` seconds from import). When the deadline passes the Job
+exits with an error, like the other fatal checks in the scripts.
+"""
+
+import logging
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+from servarr_http import HTTPClient, RequestException
+from servarr_metrics import add_phase
+
+
+READINESS_TIMEOUT = float(os.getenv("READINESS_TIMEOUT", "900"))
+INITIAL_DELAY = float(os.getenv("READINESS_INITIAL_DELAY", "0.25"))
+MAX_DELAY = float(os.getenv("READINESS_MAX_DELAY", "8"))
+PROBE_TIMEOUT = 5
+
+_DEADLINE = time.monotonic() + READINESS_TIMEOUT
+_client = None
+
+
+def _probe_client() -> HTTPClient:
+    global _client
+    if _client is None:
+        # Probes get their own client: a quiet logger and short timeouts so a hung
+        # server costs one attempt, not the whole deadline.
+        _client = HTTPClient(
+            logger=logging.getLogger(__name__),
+            connect_timeout=PROBE_TIMEOUT,
+            read_timeout=PROBE_TIMEOUT,
+        )
+    return _client
+
+
+def wait_until(description: str, probe, logger: logging.Logger = None):
+    """Call `probe` until it returns a truthy value and return that value.
+
+    `probe` may also raise `RequestException`/`OSError`, which counts as not ready.
+    """
+    logger = logger or logging.getLogger(__name__)
+    started = time.monotonic()
+    delay = INITIAL_DELAY
+    attempts = 0
+    last_error = None
+    while True:
+        attempts += 1
+        try:
+            result = probe()
+        except (RequestException, OSError) as exc:
+            result, last_error = None, exc
+        if result:
+            add_phase("readiness", time.monotonic() - started)
+            if attempts > 1:
+                logger.info("%s ready after %.1fs", description, time.monotonic() - started)
+            return result
+        remaining = _DEADLINE - time.monotonic()
+        if remaining <= 0:
+            logger.error(
+                "Gave up waiting for %s after %d attempts%s",
+                description,
+                attempts,
+                f" (last error: {last_error})" if last_error else "",
+            )
+            sys.exit(1)
+        if attempts == 1:
+            logger.info("Waiting for %s", description)
+        time.sleep(min(remaining, random.uniform(delay / 2, delay)))
+        delay = min(delay * 2, MAX_DELAY)
+
+
+def read_xml_api_key(path: str):
+    """ApiKey of a Servarr config.xml, or None while the file is missing, partial or empty."""
+    try:
+        api_key = ET.parse(path).getroot().findtext("ApiKey")
+    except (FileNotFoundError, ET.ParseError):
+        return None
+    return api_key.strip() if api_key and api_key.strip() else None
+
+
+def wait_for_api_key(path: str, label: str, logger: logging.Logger = None) -> str:
+    """Wait until `path` is a config.xml with a non-empty ApiKey."""
+    return wait_until(f"{label} ApiKey in {path}", lambda: read_xml_api_key(path), logger=logger)
+
+
+def wait_for_http(label: str, url: str, headers: dict = None, logger: logging.Logger = None):
+    """Wait until a GET on `url` answers with a 2xx status and return the response."""
+
+    def probe():
+        response = _probe_client().get(url, headers=headers)
+        return response if 200 <= response.status_code < 300 else None
+
+    return wait_until(f"{label} at {url}", probe, logger=logger)
@@ -0,0 +1,155 @@
+"""Diff-based reconciliation of Servarr API resources.
+
+Instead of POSTing every resource and recognising "already configured" errors,
+a `Collection` downloads the current resources once, compares each desired
+resource with the matching one and only writes when something is missing
+(POST) or has drifted (PUT `/{id}`). Adding or updating a download client makes
+Sonarr/Radarr test the connection, so an unchanged upgrade must not write
+anything.
+
+Only what the desired body sets is compared (see `servarr_resources`): server
+defaults and read-only metadata are ignored. Secrets come back masked as
+`********`; their desired values are compared with the salted fingerprints a
+`SecretStore` saved after the last successful write instead.
+"""
+
+import json
+import logging
+import threading
+
+from servarr_resources import Resource
+from servarr_state import fingerprint, new_salt, salted, write_atomic
+
+
+class SecretStore:
+    """Fingerprints of the secrets last written for each resource, kept beside the app config.
+
+    They are saved `salted` with a salt of the file, never as plain digests of
+    the passwords.
+    """
+
+    def __init__(self, path: str, logger: logging.Logger):
+        self.path = path
+        self.logger = logger
+        self._salt = new_salt()
+        self._saved = {}
+        self._lock = threading.Lock()
+        if not path:
+            return
+        try:
+            with open(path, encoding="utf-8") as handle:
+                saved = json.load(handle)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Ignoring unreadable secrets state %s: %s", path, exc)
+            return
+        # Files without a salt hold plain digests: forgotten, so the secrets are written once more
+        if isinstance(saved, dict) and salted(saved.get("salt"), "") and isinstance(saved.get("secrets"), dict):
+            self._salt = saved["salt"]
+            self._saved = saved["secrets"]
+
+    def _fingerprint(self, key: str, values: dict) -> str:
+        return salted(self._salt, fingerprint(key, values))
+
+    def matches(self, key: str, values: dict) -> bool:
+        with self._lock:
+            return self._saved.get(key) == self._fingerprint(key, values)
+
+    def remember(self, key: str, values: dict):
+        with self._lock:
+            if not values or self._saved.get(key) == self._fingerprint(key, values):
+                return
+            self._saved[key] = self._fingerprint(key, values)
+            if not self.path:
+                return
+            content = {"salt": self._salt, "secrets": self._saved}
+            try:
+                write_atomic(self.path, json.dumps(content, sort_keys=True).encode("utf-8"))
+            except OSError as exc:
+                self.logger.warning("Unable to save secrets state %s: %s", self.path, exc)
+                self.path = None
+
+
+class Collection:
+    """One Servarr collection of `resource_class` items, read once and reconciled by key.
+
+    `api_url` is the API root of the app (e.g. `http://sonarr:8989/api/v3`); the
+    collection name comes from the resource class.
+    """
+
+    def __init__(
+        self,
+        client,
+        api_url: str,
+        resource_class,
+        label: str,
+        logger: logging.Logger = None,
+        secrets: SecretStore = None,
+    ):
+        self.client = client
+        self.resource_class = resource_class
+        self.endpoint = f"{api_url}/{resource_class.collection}"
+        self.label = label
+        self.logger = logger or logging.getLogger(__name__)
+        self.secrets = secrets
+        self._items = None
+        self._lock = threading.Lock()
+
+    def items(self) -> dict:
+        with self._lock:
+            if self._items is None:
+                resources = (self.resource_class.from_api(item) for item in self.client.call("get", self.endpoint) or [])
+                self._items = {resource.key(): resource for resource in resources}
+            return self._items
+
+    def find(self, desired: Resource):
+        return self.items().get(desired.key())
+
+    def reconcile(self, desired) -> Resource:
+        """Create or update the resource matching `desired` (a body or a resource); return it as served."""
+        if not isinstance(desired, Resource):
+            desired = self.resource_class.from_body(desired)
+        current = self.find(desired)
+        if current is None:
+            self.logger.info("Creating %s", self.label)
+            created = self.client.call("post", self.endpoint, body=desired.to_api())
+            return self._store(desired, created, None)
+
+        drift = desired.differences(current) if self.resource_class.updatable else []
+        secrets = desired.secrets_for(current)
+        if secrets and self.secrets is not None and not self.secrets.matches(self._secret_key(desired), secrets):
+            drift.extend(f"fields.{name}" for name in sorted(secrets) if f"fields.{name}" not in drift)
+        if not drift:
+            self.logger.info("%s already up to date; skipping", self.label)
+            return current
+
+        self.logger.info("Updating %s (changed: %s)", self.label, ", ".join(drift))
+        body = desired.to_api(current)
+        updated = self.client.call("put", f"{self.endpoint}/{current.id}", body=body)
+        return self._store(desired, updated if isinstance(updated, dict) else body, current)
+
+    def _secret_key(self, desired: Resource) -> str:
+        return f"{self.resource_class.collection}:{desired.key()}"
+
+    def _store(self, desired: Resource, payload: dict, previous) -> Resource:
+        resource = self.resource_class.from_api(payload if isinstance(payload, dict) else {})
+        with self._lock:
+            if self._items is not None:
+                self._items[resource.key()] = resource
+        if self.secrets is not None:
+            self.secrets.remember(self._secret_key(desired), desired.secrets_for(resource, previous))
+        return resource
+
+
+def reconcile_settings(client, url: str, desired: dict, label: str, logger: logging.Logger = None) -> Resource:
+    """PUT a settings resource (e.g. `config/mediamanagement`) only when it differs from `desired`."""
+    logger = logger or logging.getLogger(__name__)
+    wanted = Resource.from_body(desired)
+    current = Resource.from_api(client.call("get", url))
+    drift = wanted.differences(current)
+    if not drift:
+        logger.info("%s already up to date; skipping", label)
+        return current
+    logger.info("Updating %s (changed: %s)", label, ", ".join(drift))
+    return Resource.from_api(client.call("put", url, body=wanted.to_api(current)))
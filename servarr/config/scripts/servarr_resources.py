@@ -0,0 +1,217 @@
+"""Compact model of the Servarr API resources managed by the init scripts.
+
+Servarr describes provider settings as `"fields": [{"name": ..., "value": ...}]`
+lists padded with labels, help texts and select options. A `Resource` keeps
+the top-level settings and a `{name: value}` map of the fields instead, so a
+field is looked up in O(1) and two resources are compared through a stable
+content hash of the values only.
+
+Resources built from a desired body (`from_body`) only hold what the chart
+sets; resources read from the API (`from_api`) also keep the raw payload, which
+is what gets written back, so server defaults are never lost on update.
+"""
+
+from servarr_state import fingerprint
+
+
+MASKED = "********"
+
+# Keys that only describe the resource and are never written back by the API.
+READ_ONLY_KEYS = frozenset(("id", "infoLink", "implementationName", "message", "presets"))
+
+
+def canonical(value):
+    """Value normalized for hashing: numbers compare equal to their string form ("10095" == 10095)."""
+    if isinstance(value, dict):
+        return {key: canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    return value
+
+
+class Resource:
+    """A Servarr API resource: top-level settings plus its `fields`, indexed by name."""
+
+    __slots__ = ("settings", "fields", "raw", "_hash")
+
+    # Collection the resource lives in, below /api/v<n>/.
+    collection = ""
+    # False for resources the API cannot update (root folders): existing ones are left alone.
+    updatable = True
+    # Settings holding a directory, which the server stores with a trailing "/".
+    path_settings = frozenset()
+
+    def __init__(self, settings: dict = None, fields: dict = None, raw: dict = None):
+        self.settings = {key: value for key, value in (settings or {}).items() if key not in READ_ONLY_KEYS}
+        self.fields = dict(fields or {})
+        self.raw = raw
+        self._hash = None
+
+    @classmethod
+    def from_body(cls, body: dict) -> "Resource":
+        """Desired resource; fields declared without a value are left to the server."""
+        return cls(
+            {key: value for key, value in body.items() if key != "fields"},
+            {field["name"]: field["value"] for field in body.get("fields") or [] if "value" in field},
+        )
+
+    @classmethod
+    def from_api(cls, payload: dict) -> "Resource":
+        """Resource as served by the API; fields without a value are null."""
+        return cls(
+            {key: value for key, value in payload.items() if key != "fields"},
+            {field.get("name"): field.get("value") for field in payload.get("fields") or [] if isinstance(field, dict)},
+            raw=payload,
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.key()!r})"
+
+    @property
+    def id(self):
+        return (self.raw or {}).get("id")
+
+    def key(self):
+        """Identity the server keeps unique within the collection."""
+        return self.content_hash()
+
+    def get(self, name: str, default=None):
+        return self.settings.get(name, default)
+
+    def field(self, name: str, default=None):
+        return self.fields.get(name, default)
+
+    def canonical(self) -> dict:
+        return {
+            "settings": {key: self.canonical_setting(key, value) for key, value in self.settings.items()},
+            "fields": canonical(self.fields),
+        }
+
+    def canonical_setting(self, key: str, value):
+        """`value` of the `key` setting normalized for comparison; see `path_settings`."""
+        if key in self.path_settings and isinstance(value, str):
+            return value.rstrip("/")
+        return canonical(value)
+
+    def content_hash(self) -> str:
+        if self._hash is None:
+            self._hash = fingerprint(self.canonical())
+        return self._hash
+
+    def secret_names(self) -> set:
+        return {name for name, value in self.fields.items() if value == MASKED}
+
+    def projection(self, desired: "Resource") -> "Resource":
+        """This resource restricted to what `desired` sets, with masked secrets taken from `desired`.
+
+        Settings and fields the server does not report are not in its schema
+        and are dropped from the comparison as well.
+        """
+        settings = {key: self.settings[key] for key in desired.settings if key in self.settings}
+        fields = {
+            name: desired.fields[name] if self.fields[name] == MASKED else self.fields[name]
+            for name in desired.fields
+            if name in self.fields
+        }
+        return type(self)(settings, fields)
+
+    def comparable(self, current: "Resource") -> "Resource":
+        """This desired resource without the settings and fields `current` does not know about."""
+        return type(self)(
+            {key: value for key, value in self.settings.items() if key in current.settings},
+            {name: value for name, value in self.fields.items() if name in current.fields},
+        )
+
+    def differences(self, current: "Resource") -> list:
+        """Names of the settings and fields this desired resource changes on `current`."""
+        wanted = self.comparable(current)
+        actual = current.projection(self)
+        if wanted.content_hash() == actual.content_hash():
+            return []
+        changed = [
+            key
+            for key in wanted.settings
+            if wanted.canonical_setting(key, wanted.settings[key]) != actual.canonical_setting(key, actual.settings[key])
+        ]
+        changed.extend(
+            f"fields.{name}" for name in wanted.fields if canonical(wanted.fields[name]) != canonical(actual.fields[name])
+        )
+        return changed
+
+    def secrets_for(self, *served: "Resource") -> dict:
+        """Desired values of the fields the server masks in any of the `served` resources."""
+        masked = set().union(*(resource.secret_names() for resource in served if resource is not None))
+        return {name: value for name, value in self.fields.items() if name in masked}
+
+    def to_api(self, current: "Resource" = None) -> dict:
+        """API body: `current`'s payload (if any) with every desired setting and field applied."""
+        base = dict(current.raw) if current is not None and current.raw else {}
+        body = {**base, **self.settings}
+        if self.fields or "fields" in base:
+            pending = dict(self.fields)
+            fields = [
+                {**field, "value": pending.pop(field.get("name"))} if field.get("name") in pending else field
+                for field in base.get("fields") or []
+            ]
+            fields.extend({"name": name, "value": value} for name, value in pending.items())
+            body["fields"] = fields
+        return body
+
+
+class NamedResource(Resource):
+    """Provider resource identified by its (case-insensitive) name."""
+
+    __slots__ = ()
+
+    @property
+    def name(self) -> str:
+        return self.settings.get("name") or ""
+
+    def key(self):
+        return self.name.lower()
+
+
+class DownloadClient(NamedResource):
+    __slots__ = ()
+    collection = "downloadclient"
+
+
+class Indexer(NamedResource):
+    __slots__ = ()
+    collection = "indexer"
+
+    @property
+    def name(self) -> str:
+        # Prowlarr names an indexer after its definition when the body has no name.
+        return self.settings.get("name") or self.settings.get("definitionName") or ""
+
+
+class Application(NamedResource):
+    __slots__ = ()
+    collection = "applications"
+
+
+class IndexerProxy(NamedResource):
+    __slots__ = ()
+    collection = "indexerProxy"
+
+
+class RootFolder(Resource):
+    __slots__ = ()
+    collection = "rootFolder"
+    updatable = False
+    path_settings = frozenset(("path",))
+
+    def key(self):
+        return (self.settings.get("path") or "").rstrip("/")
+
+
+class RemotePathMapping(Resource):
+    __slots__ = ()
+    collection = "remotepathmapping"
+    path_settings = frozenset(("remotePath", "localPath"))
+
+    def key(self):
+        return (self.settings.get("host"), (self.settings.get("remotePath") or "").rstrip("/"))
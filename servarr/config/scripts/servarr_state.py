@@ -0,0 +1,216 @@
+"""Progress and state markers persisted by the init scripts on the app volumes.
+
+Markers live next to the application configuration (usually under
+`<config>/.servarr-init/`), so they share the lifecycle of the data they
+describe: wiping an app's volume also forgets what the init Job did to it.
+"""
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+
+STATE_DIR_NAME = ".servarr-init"
+
+
+def state_path(config_path: str, filename: str) -> str:
+    """Path of a marker file stored beside the given application config file."""
+    return os.path.join(os.path.dirname(config_path), STATE_DIR_NAME, filename)
+
+
+def fingerprint(*parts) -> str:
+    """Stable sha256 of the given strings, bytes or JSON-serializable values."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, bytes):
+            part = json.dumps(part, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def new_salt() -> str:
+    """Random salt for `salted`, hex encoded so it can be saved in a JSON marker."""
+    return os.urandom(16).hex()
+
+
+def salted(salt: str, digest: str) -> str:
+    """HMAC-SHA256 of `digest` keyed with `salt`, or an empty string when the salt is unusable.
+
+    Markers that cover API keys or passwords save this instead of the plain
+    fingerprint, with a salt of their own, so what lands on the volume cannot be
+    matched against precomputed digests or the markers of another install.
+    """
+    try:
+        key = bytes.fromhex(salt)
+    except (TypeError, ValueError):
+        return ""
+    return hmac.new(key, digest.encode("utf-8"), hashlib.sha256).hexdigest() if key else ""
+
+
+def file_bytes(path: str) -> bytes:
+    """Content of `path`, or an empty value when it does not exist."""
+    try:
+        with open(path, "rb") as handle:
+            return handle.read()
+    except FileNotFoundError:
+        return b""
+
+
+def files_digest(path: str) -> str:
+    """sha256 of the file at `path`, or of every file below it when it is a directory, read in chunks."""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        paths = [path]
+    for file_path in paths:
+        try:
+            with open(file_path, "rb") as handle:
+                digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+                for block in iter(lambda: handle.read(1 << 16), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            continue
+    return digest.hexdigest()
+
+
+def write_atomic(path: str, content: bytes):
+    """Replace `path` with `content` so readers never observe a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(content)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """Set of completed step names, saved after each step so a retried Job can resume.
+
+    A checkpoint only applies to the inputs it was recorded for: when the
+    `run_fingerprint` differs (new values, new script) it starts from scratch.
+    With no `path` (or an unwritable one) the checkpoint is kept in memory only.
+    """
+
+    def __init__(self, path: str, run_fingerprint: str, logger: logging.Logger = None):
+        self.path = path
+        self.run_fingerprint = run_fingerprint
+        self.logger = logger or logging.getLogger(__name__)
+        self._steps = set()
+        self._lock = threading.Lock()
+        if not path:
+            return
+        try:
+            with open(path, encoding="utf-8") as handle:
+                saved = json.load(handle)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Ignoring unreadable checkpoint %s: %s", path, exc)
+            return
+        if saved.get("fingerprint") != run_fingerprint:
+            self.logger.info("Checkpoint %s belongs to different inputs; starting from scratch", path)
+            return
+        self._steps = set(saved.get("steps", []))
+        if self._steps:
+            self.logger.info("Resuming from checkpoint %s (%d completed steps)", path, len(self._steps))
+
+    def done(self, step: str) -> bool:
+        with self._lock:
+            return step in self._steps
+
+    def mark(self, step: str):
+        with self._lock:
+            if step in self._steps:
+                return
+            self._steps.add(step)
+            self._save()
+
+    def discard(self, step: str):
+        with self._lock:
+            if step not in self._steps:
+                return
+            self._steps.discard(step)
+            self._save()
+
+    def clear(self):
+        """Forget all progress once the run completed."""
+        with self._lock:
+            self._steps = set()
+            if self.path:
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+                except OSError as exc:
+                    self.logger.warning("Unable to remove checkpoint %s: %s", self.path, exc)
+
+    def _save(self):
+        if not self.path:
+            return
+        content = json.dumps({"fingerprint": self.run_fingerprint, "steps": sorted(self._steps)})
+        try:
+            write_atomic(self.path, content.encode("utf-8"))
+        except OSError as exc:
+            self.logger.warning("Unable to save checkpoint %s, continuing without it: %s", self.path, exc)
+            self.path = None
+
+
+class AppliedState:
+    """Fingerprint of the desired state applied by the last successful run.
+
+    On upgrades that change nothing the script applies (image bumps, unrelated
+    values), `skip_if_unchanged()` ends the run before any request is made.
+    Setting `INIT_SKIP_UNCHANGED=false` always re-applies everything. The
+    fingerprint usually covers credentials, so the marker only keeps it
+    `salted`.
+    """
+
+    def __init__(self, path: str, desired_fingerprint: str, logger: logging.Logger = None):
+        self.path = path
+        self.desired_fingerprint = desired_fingerprint
+        self.logger = logger or logging.getLogger(__name__)
+
+    def unchanged(self) -> bool:
+        if not self.path:
+            return False
+        try:
+            with open(self.path, encoding="utf-8") as handle:
+                saved = json.load(handle)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Ignoring unreadable state marker %s: %s", self.path, exc)
+            return False
+        expected = salted(saved.get("salt"), self.desired_fingerprint)
+        return bool(expected) and hmac.compare_digest(expected, str(saved.get("fingerprint", "")))
+
+    def skip_if_unchanged(self):
+        """Exit successfully when the last run already applied this exact desired state."""
+        if os.getenv("INIT_SKIP_UNCHANGED", "true").lower() in ("0", "false", "no", "off"):
+            return
+        if self.unchanged():
+            self.logger.info("Desired state unchanged since the last successful run (%s); nothing to do", self.path)
+            sys.exit(0)
+
+    def record(self):
+        """Remember the desired state once it has been applied completely."""
+        if not self.path:
+            return
+        salt = new_salt()
+        content = json.dumps(
+            {"salt": salt, "fingerprint": salted(salt, self.desired_fingerprint), "applied": int(time.time())}
+        )
+        try:
+            write_atomic(self.path, content.encode("utf-8"))
+        except OSError as exc:
+            self.logger.warning("Unable to save state marker %s, the next run will re-apply everything: %s", self.path, exc)
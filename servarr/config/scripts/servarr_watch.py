@@ -0,0 +1,135 @@
+"""Wait for a file to change, with inotify where the kernel offers it.
+
+The watch is set on the file's directory rather than on the file itself, so
+files that are replaced by rename, deleted or only created later are seen too.
+inotify is reached through ctypes (the init image has no third-party packages);
+when it is unavailable, or the directory does not exist yet, the watcher falls
+back to checking the file every `poll_interval` seconds. The poll interval also
+bounds every wait under inotify, which covers overflowed event queues.
+"""
+
+import ctypes
+import errno
+import logging
+import os
+import select
+import struct
+import time
+
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+# struct inotify_event: wd, mask, cookie, len, then `len` bytes of NUL padded name
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FileWatcher:
+    """Reports the content of `path` whenever it may have changed.
+
+    `read()` returns the current content (None while the file is missing) and
+    `wait()` blocks until an inotify event concerns the file or `poll_interval`
+    seconds have passed.
+    """
+
+    def __init__(self, path: str, poll_interval: float = 15.0, logger: logging.Logger = None):
+        self.path = os.path.abspath(path)
+        self.directory, self.name = os.path.split(self.path)
+        self.poll_interval = poll_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self._libc = _libc()
+        self._fd = None
+        self._wd = None
+        if self._libc is None:
+            self.logger.info("inotify is not available; checking %s every %gs", self.path, poll_interval)
+            return
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            self.logger.info(
+                "inotify is not available (%s); checking %s every %gs",
+                os.strerror(ctypes.get_errno()),
+                self.path,
+                poll_interval,
+            )
+            return
+        self._fd = fd
+        self._add_watch()
+
+    def _add_watch(self):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(self.directory), WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code != errno.ENOENT:
+                self.logger.warning("Unable to watch %s: %s", self.directory, os.strerror(code))
+            return
+        self._wd = wd
+        self.logger.info("Watching %s with inotify", self.path)
+
+    def read(self):
+        try:
+            with open(self.path, "rb") as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return None
+
+    def _drain(self) -> bool:
+        """Consume the queued events; True when one concerns the file or the watch is gone."""
+        relevant = False
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return relevant
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                _wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if mask & (IN_IGNORED | IN_DELETE_SELF):
+                    # The directory itself went away; watch it again once it is back
+                    self._wd = None
+                    relevant = True
+                elif name == os.fsencode(self.name):
+                    relevant = True
+
+    def wait(self):
+        if self._fd is not None and self._wd is None:
+            self._add_watch()
+        if self._wd is None:
+            time.sleep(self.poll_interval)
+            return
+        # Events about other files of the directory keep the wait going until the same deadline
+        deadline = time.monotonic() + self.poll_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            ready, _, _ = select.select([self._fd], [], [], remaining)
+            if not ready or self._drain():
+                return
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = self._wd = None
@@ -0,0 +1,72 @@
+"""Reader for the block-mapping subset of YAML that Bazarr writes to config.yaml.
+
+The init image has no YAML library. Bazarr's config.yaml is produced by
+PyYAML's `safe_dump`, and the scripts only need a few scalar settings out of
+it (such as `auth.apikey`), so nested `key: value` mappings with plain or
+quoted scalars are read and everything else is skipped: sequences and what is
+nested below their items, block and flow collections, and the indented
+continuation lines PyYAML uses for long scalars.
+"""
+
+import json
+
+
+def parse_yaml_scalar(value: str):
+    if len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        try:
+            return json.loads(value)
+        except ValueError:
+            # YAML escapes JSON does not know (\x41, \e, ...); the raw text is close enough
+            return value[1:-1]
+    if value[0] in "'\"":
+        # Quoted scalar continued on the next lines
+        return None
+    lowered = value.lower()
+    if lowered in ("null", "~"):
+        return None
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    return value
+
+
+def parse_yaml_mappings(text: str) -> dict:
+    """Nested mappings of `text`; values that are not understood are None.
+
+    Lines deeper than a scalar or a sequence item continue it and are skipped,
+    as are lines that are not `key: value`.
+    """
+    root = {}
+    # (indent, mapping the lines deeper than `indent` belong to, or None to skip them)
+    stack = [(-1, root)]
+    for raw_line in text.splitlines():
+        stripped = raw_line.strip()
+        if not stripped or stripped.startswith("#") or stripped in ("---", "..."):
+            continue
+        indent = len(raw_line) - len(raw_line.lstrip(" "))
+        while indent <= stack[-1][0]:
+            stack.pop()
+        parent = stack[-1][1]
+        if parent is None:
+            continue
+        if stripped.startswith("- ") or stripped == "-":
+            stack.append((indent, None))
+            continue
+        key, separator, value = stripped.partition(":")
+        if not separator or (value and not value[0].isspace()):
+            continue
+        key = key.strip().strip("'\"")
+        value = value.strip()
+        if value and value[0] not in "'\"" and " #" in value:
+            value = value.split(" #", 1)[0].rstrip()
+        if not value:
+            parent[key] = {}
+            stack.append((indent, parent[key]))
+        elif value[0] in "|>[{&*!":
+            parent[key] = None
+            stack.append((indent, None))
+        else:
+            parent[key] = parse_yaml_scalar(value)
+            stack.append((indent, None))
+    return root
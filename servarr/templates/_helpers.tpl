@@ -0,0 +1,76 @@
+{{/*
+Projected volume sources with the Prowlarr indexer declarations, mounted under
+indexers/ next to the init scripts. Matches the ConfigMaps of configmaps.yaml.
+*/}}
+{{- define "servarr.prowlarrIndexerSources" -}}
+{{- if .Values.prowlarr.init.indexersGzip }}
+- configMap:
+    name: init-prowlarr-indexers-gz
+    items:
+      - key: indexers.jsonl.gz
+        path: indexers/indexers.jsonl.gz
+{{- else if .Values.indexers }}
+{{- $perConfigMap := int .Values.prowlarr.init.indexersPerConfigMap }}
+{{- range $index, $chunk := chunk (ternary $perConfigMap (len .Values.indexers) (gt $perConfigMap 0)) .Values.indexers }}
+- configMap:
+    name: {{ printf "init-prowlarr-indexers-%d" $index }}
+    items:
+      - key: {{ printf "indexers-%04d.jsonl" $index }}
+        path: {{ printf "indexers/indexers-%04d.jsonl" $index }}
+{{- end }}
+{{- end }}
+{{- end }}
+
+{{/*
+Init container syncing the custom Prowlarr indexer definitions (init-prowlarr-definitions.py).
+Takes the root context as "root" and the names of the scripts and Prowlarr config volumes.
+*/}}
+{{- define "servarr.prowlarrDefinitionsSync" -}}
+{{- $definitions := .root.Values.prowlarr.init.definitions -}}
+- name: sync-prowlarr-definitions
+  image: "python:3.11-alpine"
+  imagePullPolicy: IfNotPresent
+  command:
+    - "python3"
+    - "-u"
+    - "/mnt/init-prowlarr-definitions.py"
+  env:
+    - name: PYTHONUNBUFFERED
+      value: "1"
+{{- range $name, $value := .root.Values.global.initEnv }}
+    - name: {{ $name }}
+      value: {{ $value | quote }}
+{{- end }}
+    - name: PROWLARR_DATA_PATH
+      value: "/config"
+    - name: DEFINITIONS_REPOSITORY
+      value: {{ $definitions.repository | quote }}
+    - name: DEFINITIONS_REF
+      value: {{ $definitions.ref | quote }}
+    - name: DEFINITIONS_DIRECTORY
+      value: {{ $definitions.directory | quote }}
+{{- if $definitions.bundleConfigMap }}
+    - name: DEFINITIONS_BUNDLE
+      value: "/definitions-bundle"
+{{- end }}
+  volumeMounts:
+    - name: {{ .scripts }}
+      mountPath: /mnt
+    - name: {{ .config }}
+      mountPath: /config
+{{- if $definitions.bundleConfigMap }}
+    - name: definitions-bundle
+      mountPath: /definitions-bundle
+      readOnly: true
+{{- end }}
+{{- end }}
+
+{{/*
+Value of a resource quantity in base units (cores or bytes), e.g. 500m -> 0.5, 64Mi -> 67108864.
+*/}}
+{{- define "servarr.quantity" -}}
+{{- $quantity := toString . -}}
+{{- $units := dict "m" 0.001 "k" 1e3 "M" 1e6 "G" 1e9 "T" 1e12 "Ki" 1024 "Mi" 1048576 "Gi" 1073741824 "Ti" 1099511627776 -}}
+{{- $unit := regexFind "[A-Za-z]+$" $quantity -}}
+{{- mulf (trimSuffix $unit $quantity | float64) (get $units $unit | default 1) -}}
+{{- end }}
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+
+"""Benchmark the chart's init scripts against local stand-in servers.
+
+Starts the fakes from `fakearr.py` on loopback ports, prepares the config
+files the scripts expect (API keys, indexers, Bazarr and Homarr payloads) in a
+scratch directory, then runs every `init-*.py` like the init Job would and
+reports, per script: exit status, wall time, request count, bytes exchanged
+and the endpoints that were read more than once.
+
+    python3 tools/init-bench/bench.py --indexers 50 --latency 0.02 --runs 2
+
+The second and later runs hit the state left by the previous one, which is
+what a `helm upgrade` looks like to the scripts.
+"""
+
+import argparse
+import gzip
+import json
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+
+import fakearr
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SCRIPTS_DIR = os.path.join(REPO_ROOT, "servarr", "config", "scripts")
+
+# Same order and dependencies as the orchestrator plan rendered by the chart.
+STEPS = [
+    ("sonarr", []),
+    ("radarr", []),
+    ("jellyfin", []),
+    ("homarr", []),
+    ("qbittorrent-bandwidth", []),
+    ("prowlarr", ["radarr", "sonarr"]),
+    ("bazarr", ["radarr", "sonarr"]),
+    ("jellyseerr", ["jellyfin", "radarr", "sonarr"]),
+]
+
+# Sample `qbittorrent.bandwidth` values.
+BANDWIDTH = {
+    "enabled": True,
+    "altDownloadLimit": 2048,
+    "altUploadLimit": 512,
+    "schedule": {"enabled": True, "from": "18:30", "to": "01:00", "days": "weekdays"},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scripts", default=",".join(name for name, _ in STEPS), help="comma separated apps to run")
+    parser.add_argument("--runs", type=int, default=1, help="consecutive runs against the same server state")
+    parser.add_argument("--orchestrated", action="store_true", help="run through init-orchestrator.py instead of one by one")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra uniform random latency, in seconds")
+    parser.add_argument("--index-latency", type=float, default=0.0, help="seconds Prowlarr spends testing a new indexer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument(
+        "--lost-rate", type=float, default=0.0,
+        help="fraction of POST/PUT requests processed but answered by closing the connection",
+    )
+    parser.add_argument("--idempotency", choices=("strict", "lenient"), default="strict")
+    parser.add_argument("--indexers", type=int, default=20, help="number of synthetic indexers to add")
+    parser.add_argument("--compact", action="store_true", help="declare the synthetic indexers compactly (expanded from the schema)")
+    parser.add_argument("--indexers-file", help="indexers JSON (the chart's `indexers` value) instead of synthetic ones")
+    parser.add_argument(
+        "--indexers-per-file", type=int, default=0,
+        help="split the indexers over files of this many, like prowlarr.init.indexersPerConfigMap (0: one file)",
+    )
+    parser.add_argument("--gzip", action="store_true", help="gzip the indexers, like prowlarr.init.indexersGzip")
+    parser.add_argument("--no-skip-unchanged", action="store_true", help="re-apply everything on later runs (INIT_SKIP_UNCHANGED=false)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workdir", help="keep config files and logs here instead of a temporary directory")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    return parser.parse_args()
+
+
+def indexer_template(definition: str, implementation: str = "Cardigann", extra_fields: tuple = ()) -> dict:
+    """Entry of Prowlarr's /indexer/schema, trimmed to what the scripts read."""
+    return {
+        "id": 0,
+        "name": definition,
+        "definitionName": definition,
+        "implementation": implementation,
+        "implementationName": implementation,
+        "configContract": "CardigannSettings" if implementation == "Cardigann" else "NoAuthTorrentBaseSettings",
+        "protocol": "torrent",
+        "privacy": "public",
+        "enable": False,
+        "priority": 25,
+        "appProfileId": 0,
+        "indexerUrls": [f"https://{definition.lower()}.example/"],
+        "fields": [
+            *([{"name": "definitionFile", "value": definition}] if implementation == "Cardigann" else []),
+            {"name": "baseUrl", "label": "Base Url", "type": "select"},
+            {
+                "name": "baseSettings.limitsUnit",
+                "label": "Limits Unit",
+                "type": "select",
+                "value": 0,
+                "selectOptions": [{"value": 0, "name": "Day"}, {"value": 1, "name": "Hour"}],
+            },
+            {"name": "torrentBaseSettings.preferMagnetUrl", "label": "Prefer Magnet URL", "type": "checkbox", "value": False},
+            *({"name": name, "value": 0} for name in extra_fields),
+        ],
+        "tags": [],
+    }
+
+
+INDEXER_SCHEMA = [
+    indexer_template("bench"),
+    indexer_template("1337x", extra_fields=("downloadlink", "downloadlink2", "sort", "type")),
+    indexer_template("Knaben", implementation="Knaben"),
+    indexer_template("thepiratebay"),
+]
+
+
+def synthetic_indexers(count: int, compact: bool = False) -> list:
+    if compact:
+        return [
+            {"name": f"Bench {number:03d}", "definition": "bench", "fields": {"baseUrl": f"https://bench-{number}.example/"}}
+            for number in range(count)
+        ]
+    return [
+        {
+            "name": f"Bench {number:03d}",
+            "body": {
+                "name": f"Bench {number:03d}",
+                "definitionName": "bench",
+                "implementation": "Cardigann",
+                "configContract": "CardigannSettings",
+                "protocol": "torrent",
+                "privacy": "public",
+                "enable": True,
+                "appProfileId": 1,
+                "priority": 25,
+                "fields": [
+                    {"name": "definitionFile", "value": "bench"},
+                    {"name": "baseUrl", "value": f"https://bench-{number}.example/"},
+                ],
+                "tags": [],
+            },
+        }
+        for number in range(count)
+    ]
+
+
+def write(path: str, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(content if isinstance(content, str) else json.dumps(content))
+
+
+def write_indexers(directory: str, indexers: list, per_file: int = 0, compress: bool = False):
+    """Lay the indexers out as the chart projects them: JSON lines files below `directory`."""
+    per_file = per_file or max(1, len(indexers))
+    for number, start in enumerate(range(0, len(indexers), per_file)):
+        lines = "".join(json.dumps(index) + "\n" for index in indexers[start:start + per_file])
+        path = os.path.join(directory, f"indexers-{number:04d}.jsonl")
+        if compress:
+            os.makedirs(directory, exist_ok=True)
+            with gzip.open(path + ".gz", "wt", encoding="utf-8") as handle:
+                handle.write(lines)
+        else:
+            write(path, lines)
+
+
+def prepare(args, workdir: str) -> tuple:
+    """Start the fakes and write the files the scripts read; return (apps, env, step_env)."""
+    knobs = {
+        "latency": args.latency,
+        "jitter": args.jitter,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "lost_rate": args.lost_rate,
+        "idempotency": args.idempotency,
+        "seed": args.seed,
+    }
+    keys = {name: secrets.token_hex(16) for name in ("sonarr", "radarr", "prowlarr", "bazarr", "jellyseerr")}
+    apps = {
+        "sonarr": fakearr.FakeServarr("sonarr", "v3", keys["sonarr"], **knobs),
+        "radarr": fakearr.FakeServarr("radarr", "v3", keys["radarr"], **knobs),
+        "prowlarr": fakearr.FakeServarr(
+            "prowlarr", "v1", keys["prowlarr"], index_latency=args.index_latency, schemas={"indexer": INDEXER_SCHEMA},
+            collections={"appprofile": [{"id": 1, "name": "Standard"}]}, **knobs
+        ),
+        "bazarr": fakearr.FakeBazarr(keys["bazarr"], **knobs),
+        "jellyfin": fakearr.FakeJellyfin(**knobs),
+        "jellyseerr": fakearr.FakeJellyseerr(keys["jellyseerr"], **knobs),
+        "homarr": fakearr.FakeHomarr(**knobs),
+        "qbittorrent": fakearr.FakeQBittorrent("bench", "bench-password", **knobs),
+    }
+    hosts = {}
+    for name, app in apps.items():
+        server = fakearr.serve(app)
+        hosts[name] = "127.0.0.1:{}".format(server.server_address[1])
+
+    for name in ("sonarr", "radarr", "prowlarr"):
+        write(os.path.join(workdir, name, "config.xml"), f"<Config><ApiKey>{keys[name]}</ApiKey></Config>")
+    write(os.path.join(workdir, "bazarr", "config", "config.yaml"), f"auth:\n  apikey: {keys['bazarr']}\n")
+    write(os.path.join(workdir, "jellyseerr", "settings.json"), {"main": {"apiKey": keys["jellyseerr"]}})
+
+    if args.indexers_file:
+        with open(args.indexers_file, encoding="utf-8") as handle:
+            indexers = json.load(handle)
+    else:
+        indexers = synthetic_indexers(args.indexers, compact=args.compact)
+    mnt = os.path.join(workdir, "mnt")
+    write_indexers(os.path.join(mnt, "indexers"), indexers, args.indexers_per_file, args.gzip)
+    write(os.path.join(mnt, "bazarr-settings.json"), [["languages-enabled", "en"]])
+    write(os.path.join(mnt, "homarr-config.json"), {"0": {"json": {"name": "default"}}})
+    write(os.path.join(mnt, "jellyfin-transcoder-body.json"), {"HardwareAccelerationType": "none"})
+
+    env = {
+        **os.environ,
+        "PYTHONUNBUFFERED": "1",
+        "READINESS_TIMEOUT": "30",
+        "INIT_SKIP_UNCHANGED": "false" if args.no_skip_unchanged else "true",
+        "SONARR_HOST": hosts["sonarr"],
+        "SONARR_CONFIG_PATH": os.path.join(workdir, "sonarr", "config.xml"),
+        "RADARR_HOST": hosts["radarr"],
+        "RADARR_CONFIG_PATH": os.path.join(workdir, "radarr", "config.xml"),
+        "PROWLARR_HOST": hosts["prowlarr"],
+        "PROWLARR_CONFIG_PATH": os.path.join(workdir, "prowlarr", "config.xml"),
+        "PROWLARR_INDEXERS_PATH": os.path.join(mnt, "indexers"),
+        "BAZARR_HOST": hosts["bazarr"],
+        "BAZARR_CONFIG_PATH": os.path.join(workdir, "bazarr", "config", "config.yaml"),
+        "BAZARR_SETTINGS_PATH": os.path.join(mnt, "bazarr-settings.json"),
+        "JELLYFIN_HOST": hosts["jellyfin"],
+        "JELLYFIN_USERNAME": "bench",
+        "JELLYFIN_PASSWORD": "bench-password",
+        "JELLYFIN_EMAIL": "bench@example.com",
+        "JELLYFIN_TRANSCODER_ENABLED": "true",
+        "JELLYFIN_TRANSCODER_BODY_FILE": os.path.join(mnt, "jellyfin-transcoder-body.json"),
+        "JELLYFIN_STATE_PATH": os.path.join(workdir, "jellyfin", ".servarr-init", "jellyfin-applied.json"),
+        "JELLYSEERR_HOST": hosts["jellyseerr"],
+        "JELLYSEERR_SETTINGS_PATH": os.path.join(workdir, "jellyseerr", "settings.json"),
+        "HOMARR_HOST": hosts["homarr"],
+        "HOMARR_USERNAME": "bench",
+        "HOMARR_PASSWORD": "bench-password",
+        "HOMARR_CONFIG_PATH": os.path.join(mnt, "homarr-config.json"),
+        "HOMARR_STATE_PATH": os.path.join(workdir, "homarr", ".servarr-init", "homarr-applied.json"),
+        "TORRENT_SERVICE": "qbittorrent",
+        "TORRENT_ADMIN": "bench",
+        "TORRENT_PASSWORD": "bench-password",
+    }
+    step_env = {
+        "prowlarr": {
+            "PROWLARR_SERVICE": hosts["prowlarr"],
+            "RADARR_SERVICE": hosts["radarr"],
+            "SONARR_SERVICE": hosts["sonarr"],
+            "FLARESOLVERR_SERVICE": "flaresolverr:8191",
+        },
+        "bazarr": {"RADARR_SERVICE": "radarr", "SONARR_SERVICE": "sonarr"},
+        "qbittorrent-bandwidth": {
+            "QBITTORRENT_HOST": hosts["qbittorrent"],
+            "QBITTORRENT_BANDWIDTH": json.dumps(BANDWIDTH),
+        },
+    }
+    return apps, env, step_env
+
+
+def snapshot(apps: dict) -> dict:
+    return {name: app.stats.snapshot() for name, app in apps.items()}
+
+
+def usage(after: dict, before: dict) -> dict:
+    """Traffic between two snapshots, summed over every fake app."""
+    total = {"requests": 0, "bytes_in": 0, "bytes_out": 0, "errors_injected": 0, "endpoints": {}}
+    for name in after:
+        delta = fakearr.diff(after[name], before[name])
+        for key in ("requests", "bytes_in", "bytes_out", "errors_injected"):
+            total[key] += delta[key]
+        for endpoint, count in delta["endpoints"].items():
+            total["endpoints"][f"{name} {endpoint}"] = count
+    return total
+
+
+def run_script(command: list, env: dict, log_path: str) -> tuple:
+    started = time.monotonic()
+    with open(log_path, "w", encoding="utf-8") as log:
+        returncode = subprocess.call(command, env=env, cwd=SCRIPTS_DIR, stdout=log, stderr=subprocess.STDOUT)
+    return returncode, time.monotonic() - started
+
+
+def run_once(number: int, selected: list, args, apps: dict, env: dict, step_env: dict, workdir: str) -> list:
+    results = []
+    if args.orchestrated:
+        plan = {
+            "steps": [
+                {
+                    "name": name,
+                    "script": f"init-{name}.py",
+                    "needs": [need for need in needs if need in selected],
+                    "env": step_env.get(name, {}),
+                }
+                for name, needs in STEPS
+                if name in selected
+            ]
+        }
+        plan_path = os.path.join(workdir, "init-plan.json")
+        write(plan_path, plan)
+        before = snapshot(apps)
+        returncode, wall = run_script(
+            [sys.executable, "-u", os.path.join(SCRIPTS_DIR, "init-orchestrator.py")],
+            {**env, "INIT_PLAN_PATH": plan_path, "INIT_SCRIPTS_DIR": SCRIPTS_DIR},
+            os.path.join(workdir, "logs", f"run{number}-orchestrator.log"),
+        )
+        results.append({"run": number, "script": "orchestrator", "returncode": returncode, "wall": wall,
+                        **usage(snapshot(apps), before)})
+        return results
+
+    for name in selected:
+        before = snapshot(apps)
+        returncode, wall = run_script(
+            [sys.executable, "-u", os.path.join(SCRIPTS_DIR, f"init-{name}.py")],
+            {**env, **step_env.get(name, {})},
+            os.path.join(workdir, "logs", f"run{number}-{name}.log"),
+        )
+        results.append({"run": number, "script": name, "returncode": returncode, "wall": wall,
+                        **usage(snapshot(apps), before)})
+    return results
+
+
+def report(results: list, workdir: str):
+    print(f"{'run':>3}  {'script':<21} {'status':<6} {'wall s':>8} {'requests':>8} {'KiB in':>8} {'KiB out':>8}")
+    for result in results:
+        print("{run:>3}  {script:<21} {status:<6} {wall:>8.2f} {requests:>8} {kin:>8.1f} {kout:>8.1f}".format(
+            run=result["run"],
+            script=result["script"],
+            status="ok" if result["returncode"] == 0 else f"rc={result['returncode']}",
+            wall=result["wall"],
+            requests=result["requests"],
+            kin=result["bytes_in"] / 1024,
+            kout=result["bytes_out"] / 1024,
+        ))
+    print()
+    for result in results:
+        repeated = {
+            endpoint: count
+            for endpoint, count in result["endpoints"].items()
+            if " GET " in endpoint and count > 1
+        }
+        if repeated:
+            print(f"run {result['run']} {result['script']}: repeated reads")
+            for endpoint, count in sorted(repeated.items(), key=lambda item: -item[1]):
+                print(f"    {count:>5}x {endpoint}")
+        if result["returncode"] != 0:
+            print(f"run {result['run']} {result['script']}: failed, see logs in {os.path.join(workdir, 'logs')}")
+
+
+def main():
+    args = parse_args()
+    selected = [name for name in args.scripts.split(",") if name]
+    unknown = set(selected) - {name for name, _ in STEPS}
+    if unknown:
+        sys.exit("Unknown scripts: {}".format(", ".join(sorted(unknown))))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="init-bench-")
+    os.makedirs(os.path.join(workdir, "logs"), exist_ok=True)
+
+    apps, env, step_env = prepare(args, workdir)
+    results = []
+    for number in range(1, args.runs + 1):
+        results.extend(run_once(number, selected, args, apps, env, step_env, workdir))
+
+    report(results, workdir)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as handle:
+            json.dump({"args": vars(args), "results": results}, handle, indent=2)
+    sys.exit(1 if any(result["returncode"] for result in results) else 0)
+
+
+if __name__ == "__main__":
+    main()
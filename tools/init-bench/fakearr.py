@@ -0,0 +1,706 @@
+"""In-memory stand-ins for the APIs the chart's init scripts talk to.
+
+Each fake app keeps its state in memory, answers the endpoints the matching
+`init-*.py` script calls, and counts requests and bytes per endpoint so the
+benchmark can show what a script costs. Behavior knobs, shared by all apps:
+
+- `latency` / `jitter`: seconds added to every response (base + uniform jitter)
+- `error_rate` / `error_status`: fraction of requests answered with an error
+- `lost_rate`: fraction of POST/PUT requests that are processed but whose
+  connection is closed before the answer, like a reset or a gateway timeout
+- `idempotency`: `strict` rejects duplicates with the same status and message
+  as the real app (what the scripts rely on to be re-runnable), `lenient`
+  accepts them and stores a duplicate record
+"""
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+MASK = "********"
+SECRET_FIELDS = ("password", "apiKey", "passkey", "cookie")
+
+
+class Stats:
+    """Request and byte counters, per endpoint template."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.errors_injected = 0
+        self.endpoints = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def start(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def record(self, method: str, template: str, bytes_in: int, bytes_out: int, injected: bool):
+        with self._lock:
+            self.in_flight -= 1
+            self.requests += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.errors_injected += int(injected)
+            key = f"{method} {template}"
+            self.endpoints[key] = self.endpoints.get(key, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "errors_injected": self.errors_injected,
+                "max_in_flight": self.max_in_flight,
+                "endpoints": dict(self.endpoints),
+            }
+
+
+def diff(after: dict, before: dict) -> dict:
+    """Counters accumulated between two snapshots."""
+    endpoints = {
+        key: count - before["endpoints"].get(key, 0)
+        for key, count in after["endpoints"].items()
+        if count - before["endpoints"].get(key, 0)
+    }
+    result = {key: after[key] - before[key] for key in ("requests", "bytes_in", "bytes_out", "errors_injected")}
+    result["max_in_flight"] = after["max_in_flight"]
+    result["endpoints"] = endpoints
+    return result
+
+
+def template_of(path: str) -> str:
+    """Endpoint template of a path: numeric segments become `{id}`."""
+    return re.sub(r"/\d+(?=/|$)", "/{id}", path)
+
+
+class FakeApp:
+    """Base class: routing, latency/error injection and accounting."""
+
+    name = "app"
+
+    def __init__(
+        self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, lost_rate=0.0, idempotency="strict", seed=None
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.lost_rate = lost_rate
+        self.strict = idempotency == "strict"
+        self.stats = Stats()
+        self.lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._routes = []
+        self.routes()
+
+    def routes(self):
+        """Register the app endpoints with `self.route`."""
+
+    def route(self, method: str, pattern: str, handler):
+        self._routes.append((method, re.compile(f"^{pattern}$"), handler))
+
+    def dispatch(self, method: str, path: str, query: dict, headers, body):
+        """Return `(status, payload, extra_headers)` for a request."""
+        for route_method, pattern, handler in self._routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                result = handler(body=body, query=query, headers=headers, **match.groupdict())
+                if len(result) == 2:
+                    return result + ({},)
+                return result
+        return 404, {"message": f"NotFound: {method} {path}"}, {}
+
+    @staticmethod
+    def cookies(headers) -> dict:
+        cookies = {}
+        for part in (headers.get("Cookie") or "").split(";"):
+            key, _, value = part.strip().partition("=")
+            if key:
+                cookies[key] = value
+        return cookies
+
+    def pause(self):
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+    def inject_error(self) -> bool:
+        with self.lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def lose_response(self, method: str) -> bool:
+        with self.lock:
+            return method in ("POST", "PUT") and self.lost_rate > 0 and self._random.random() < self.lost_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The scripts disable Nagle on their side; without it here every small response waits for the delayed ACK.
+    disable_nagle_algorithm = True
+    app = None
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        app = self.app
+        app.stats.start()
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        content_type = (self.headers.get("Content-Type") or "").lower()
+        if "application/x-www-form-urlencoded" in content_type:
+            body = parse_qsl(raw.decode("utf-8"), keep_blank_values=True)
+        else:
+            try:
+                body = json.loads(raw) if raw else None
+            except ValueError:
+                body = raw.decode("utf-8", errors="replace")
+
+        app.pause()
+        injected = app.inject_error()
+        if injected:
+            status, payload, extra = app.error_status, {"message": "injected error"}, {}
+        else:
+            with app.lock:
+                status, payload, extra = app.dispatch(
+                    self.command, parts.path, dict(parse_qsl(parts.query)), self.headers, body
+                )
+            if app.lose_response(self.command):
+                # Processed, but the client only sees the connection go away
+                request_size = len(self.requestline) + len(str(self.headers)) + len(raw)
+                app.stats.record(self.command, template_of(parts.path), request_size, 0, True)
+                self.close_connection = True
+                return
+
+        content = b"" if payload is None else (
+            payload.encode("utf-8") if isinstance(payload, str) else json.dumps(payload).encode("utf-8")
+        )
+        self.send_response(status)
+        if payload is not None:
+            self.send_header("Content-Type", "text/plain" if isinstance(payload, str) else "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in extra.items():
+            for item in value if isinstance(value, list) else [value]:
+                self.send_header(key, item)
+        # Counted before the response goes out, so a client that got its answer sees the request in the stats
+        request_size = len(self.requestline) + len(str(self.headers)) + len(raw)
+        app.stats.record(self.command, template_of(parts.path), request_size, len(content), injected)
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+
+def serve(app: FakeApp, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve `app` from a daemon thread; `server.server_address` holds the bound port."""
+    handler = type(f"{app.name.capitalize()}Handler", (_Handler,), {"app": app})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=f"fake-{app.name}", daemon=True).start()
+    return server
+
+
+# Servarr (Sonarr, Radarr, Prowlarr)
+
+
+def _mask(item):
+    """Mimic Servarr hiding secrets in GET responses."""
+    if not isinstance(item, dict) or "fields" not in item:
+        return item
+    fields = []
+    for field in item["fields"]:
+        if field.get("name") in SECRET_FIELDS and field.get("value"):
+            field = {**field, "value": MASK}
+        fields.append(field)
+    return {**item, "fields": fields}
+
+
+class FakeServarr(FakeApp):
+    """Sonarr/Radarr (API v3) or Prowlarr (API v1) with generic REST collections."""
+
+    # collection -> (key function identifying duplicates, status and body returned for a duplicate)
+    UNIQUE = {
+        "downloadclient": (lambda item: item.get("name", "").lower(), 400, [{"errorMessage": "Should be unique"}]),
+        "indexer": (lambda item: item.get("name", "").lower(), 400, [{"errorMessage": "Should be unique"}]),
+        "applications": (lambda item: item.get("name", "").lower(), 400, [{"errorMessage": "Should be unique"}]),
+        "indexerProxy": (lambda item: item.get("name", "").lower(), 400, [{"errorMessage": "Should be unique"}]),
+        "notification": (lambda item: item.get("name", "").lower(), 400, [{"errorMessage": "Should be unique"}]),
+        "remotepathmapping": (
+            lambda item: (item.get("host"), item.get("remotePath", "").rstrip("/")),
+            500,
+            {"message": "RemotePath already configured."},
+        ),
+        "rootFolder": (
+            lambda item: item.get("path", "").rstrip("/"),
+            400,
+            [{"errorMessage": "Path is already configured as a root folder"}],
+        ),
+    }
+
+    # collection -> settings holding a directory, which Servarr stores with a trailing "/"
+    DIRECTORIES = {
+        "remotepathmapping": ("remotePath", "localPath"),
+        "rootFolder": ("path",),
+    }
+
+    def __init__(self, name: str, api_version: str, api_key: str, version: str = "5.0.0", index_latency=0.0,
+                 schemas=None, collections=None, **kwargs):
+        self.name = name
+        self.schemas = schemas or {}
+        self.api = f"/api/{api_version}"
+        self.api_key = api_key
+        self.version = version
+        self.index_latency = index_latency
+        self.collections = {collection: list(items) for collection, items in (collections or {}).items()}
+        self.config = {}
+        self.commands = {}
+        self._ids = itertools.count(1 + max((item["id"] for items in self.collections.values() for item in items), default=0))
+        super().__init__(**kwargs)
+
+    def routes(self):
+        api = re.escape(self.api)
+        self.route("GET", f"{api}/system/status", self.status)
+        self.route("GET", "/ping", lambda **_: (200, {"status": "OK"}))
+        self.route("POST", f"{api}/command", self.create_command)
+        self.route("GET", f"{api}/command/(?P<item_id>\\d+)", self.get_command)
+        self.route("GET", f"{api}/config/(?P<section>[A-Za-z]+)", self.get_config)
+        self.route("PUT", f"{api}/config/(?P<section>[A-Za-z]+)(?:/\\d+)?", self.put_config)
+        self.route("GET", f"{api}/(?P<collection>[A-Za-z]+)/schema", self.schema)
+        self.route("GET", f"{api}/(?P<collection>[A-Za-z]+)", self.list)
+        self.route("POST", f"{api}/(?P<collection>[A-Za-z]+)", self.create)
+        self.route("GET", f"{api}/(?P<collection>[A-Za-z]+)/(?P<item_id>\\d+)", self.get)
+        self.route("PUT", f"{api}/(?P<collection>[A-Za-z]+)/(?P<item_id>\\d+)", self.update)
+        self.route("DELETE", f"{api}/(?P<collection>[A-Za-z]+)/(?P<item_id>\\d+)", self.delete)
+
+    def authorized(self, headers) -> bool:
+        return (headers.get("X-Api-Key") or "") == self.api_key
+
+    def dispatch(self, method, path, query, headers, body):
+        if path.startswith(self.api) and not self.authorized(headers):
+            return 401, {"message": "Unauthorized"}, {}
+        return super().dispatch(method, path, query, headers, body)
+
+    def status(self, **_):
+        return 200, {"appName": self.name.capitalize(), "version": self.version}
+
+    def schema(self, collection, **_):
+        return 200, self.schemas.get(collection, [])
+
+    def list(self, collection, **_):
+        return 200, [_mask(item) for item in self.collections.get(collection, [])]
+
+    def get(self, collection, item_id, **_):
+        for item in self.collections.get(collection, []):
+            if item["id"] == int(item_id):
+                return 200, _mask(item)
+        return 404, {"message": "NotFound"}
+
+    def with_directories(self, collection: str, item: dict) -> dict:
+        for key in self.DIRECTORIES.get(collection, ()):
+            if isinstance(item.get(key), str) and not item[key].endswith("/"):
+                item[key] += "/"
+        return item
+
+    def create(self, collection, body, **_):
+        if not isinstance(body, dict):
+            return 400, [{"errorMessage": "Invalid body"}]
+        items = self.collections.setdefault(collection, [])
+        if collection == "tag":
+            # Servarr hands back the existing tag when the label is already taken.
+            for item in items:
+                if item.get("label", "").lower() == body.get("label", "").lower():
+                    return 201, item
+        unique = self.UNIQUE.get(collection)
+        if unique and self.strict:
+            key, status, message = unique
+            if any(key(item) == key(body) for item in items):
+                return status, message
+        if collection == "indexer" and self.index_latency:
+            # Adding an indexer makes Prowlarr test it against the tracker.
+            self.lock.release()
+            try:
+                time.sleep(self.index_latency)
+            finally:
+                self.lock.acquire()
+        item = self.with_directories(collection, {**body, "id": next(self._ids)})
+        if collection == "indexer" and not item.get("name"):
+            item["name"] = item.get("definitionName")
+        items.append(item)
+        return 201, _mask(item)
+
+    def update(self, collection, item_id, body, **_):
+        items = self.collections.get(collection, [])
+        for position, item in enumerate(items):
+            if item["id"] == int(item_id):
+                updated = self.with_directories(collection, {**item, **(body or {}), "id": item["id"]})
+                if "fields" in (body or {}):
+                    # A masked secret sent back means "keep the stored value".
+                    stored = {field.get("name"): field.get("value") for field in item.get("fields", [])}
+                    updated["fields"] = [
+                        {**field, "value": stored.get(field.get("name"))} if field.get("value") == MASK else field
+                        for field in body["fields"]
+                    ]
+                items[position] = updated
+                return 202, _mask(updated)
+        return 404, {"message": "NotFound"}
+
+    def delete(self, collection, item_id, **_):
+        items = self.collections.get(collection, [])
+        self.collections[collection] = [item for item in items if item["id"] != int(item_id)]
+        return 200, {}
+
+    def get_config(self, section, **_):
+        return 200, {"id": 1, **self.config.get(section, {})}
+
+    def put_config(self, section, body, **_):
+        self.config[section] = {**self.config.get(section, {}), **(body or {})}
+        return 202, {"id": 1, **self.config[section]}
+
+    def create_command(self, body, **_):
+        command_id = next(self._ids)
+        self.commands[command_id] = {"id": command_id, "name": (body or {}).get("name"), "status": "completed"}
+        return 201, {**self.commands[command_id], "status": "queued"}
+
+    def get_command(self, item_id, **_):
+        command = self.commands.get(int(item_id))
+        return (200, command) if command else (404, {"message": "NotFound"})
+
+
+# Bazarr
+
+
+class FakeBazarr(FakeApp):
+    name = "bazarr"
+
+    def __init__(self, api_key: str, **kwargs):
+        self.api_key = api_key
+        self.settings = {}
+        super().__init__(**kwargs)
+
+    def routes(self):
+        self.route("GET", "/api/system/status", self.status)
+        self.route("POST", "/api/system/settings", self.save_settings)
+
+    def dispatch(self, method, path, query, headers, body):
+        if (headers.get("X-Api-Key") or "") != self.api_key:
+            return 401, {"message": "Unauthorized"}, {}
+        return super().dispatch(method, path, query, headers, body)
+
+    def status(self, **_):
+        return 200, {"data": {"bazarr_version": "1.4.0"}}
+
+    def save_settings(self, body, **_):
+        for key, value in body or []:
+            self.settings.setdefault(key, []).append(value)
+        return 204, None
+
+
+# Jellyfin
+
+
+class FakeJellyfin(FakeApp):
+    name = "jellyfin"
+
+    def __init__(self, **kwargs):
+        self.completed = False
+        self.user = None
+        self.libraries = []
+        self.encoding = {}
+        self.tokens = set()
+        super().__init__(**kwargs)
+
+    def routes(self):
+        self.route("GET", "/System/Info/Public", self.info)
+        self.route("GET", "/health", lambda **_: (200, "Healthy"))
+        self.route("POST", "/Startup/Configuration", self.startup)
+        self.route("GET", "/Startup/User", self.get_user)
+        self.route("POST", "/Startup/User", self.set_user)
+        self.route("POST", "/Startup/RemoteAccess", self.startup)
+        self.route("POST", "/Startup/Complete", self.complete)
+        self.route("POST", "/Library/VirtualFolders", self.add_library)
+        self.route("POST", "/Users/AuthenticateByName", self.authenticate)
+        self.route("POST", "/System/Configuration/encoding", self.set_encoding)
+
+    def info(self, **_):
+        return 200, {"ServerName": "fake", "Version": "10.9.0", "StartupWizardCompleted": self.completed}
+
+    def startup(self, **_):
+        # Once the wizard completed the startup endpoints require authentication.
+        return (401, "Unauthorized") if self.completed else (204, None)
+
+    def get_user(self, **_):
+        if self.completed:
+            return 401, "Unauthorized"
+        return 200, {"Name": (self.user or {}).get("Name", "root")}
+
+    def set_user(self, body, **_):
+        if self.completed:
+            return 401, "Unauthorized"
+        self.user = body
+        return 204, None
+
+    def complete(self, **_):
+        if self.completed:
+            return 401, "Unauthorized"
+        self.completed = True
+        return 204, None
+
+    def add_library(self, query, body, **_):
+        if self.completed:
+            return 401, "Unauthorized"
+        if self.strict and any(library["name"] == query.get("name") for library in self.libraries):
+            return 400, f"A media library with the name {query.get('name')} already exists."
+        self.libraries.append({"name": query.get("name"), "options": body})
+        return 204, None
+
+    def authenticate(self, body, **_):
+        body = body or {}
+        if not self.user or body.get("Username") != self.user.get("Name") or body.get("Pw") != self.user.get("Password"):
+            return 401, "Invalid username or password"
+        token = uuid.uuid4().hex
+        self.tokens.add(token)
+        return 200, {"AccessToken": token, "User": {"Name": self.user["Name"]}}
+
+    def set_encoding(self, headers, body, **_):
+        token = (headers.get("Authorization") or "").rpartition("Token=")[2]
+        if token not in self.tokens:
+            return 401, "Unauthorized"
+        self.encoding = body
+        return 204, None
+
+
+# Jellyseerr
+
+
+class FakeJellyseerr(FakeApp):
+    name = "jellyseerr"
+
+    def __init__(self, api_key: str, **kwargs):
+        self.api_key = api_key
+        self.jellyfin = None
+        self.services = {"radarr": [], "sonarr": []}
+        self.settings = {}
+        super().__init__(**kwargs)
+
+    def routes(self):
+        self.route("GET", "/api/v1/status", lambda **_: (200, {"version": "1.9.0"}))
+        self.route("POST", "/api/v1/auth/jellyfin", self.auth_jellyfin)
+        self.route("GET", "/api/v1/settings/(?P<service>radarr|sonarr)", self.list_services)
+        self.route("POST", "/api/v1/settings/(?P<service>radarr|sonarr)", self.add_service)
+        self.route("POST", "/api/v1/settings/initialize", self.save("initialized"))
+        self.route("POST", "/api/v1/settings/main", self.save("main"))
+        self.route("POST", "/api/v1/settings/notifications/telegram", self.save("telegram"))
+
+    def dispatch(self, method, path, query, headers, body):
+        public = path in ("/api/v1/status", "/api/v1/auth/jellyfin")
+        if not public and (headers.get("X-Api-Key") or "") != self.api_key:
+            return 403, {"message": "You do not have permission to access this endpoint"}, {}
+        return super().dispatch(method, path, query, headers, body)
+
+    def auth_jellyfin(self, body, **_):
+        if self.jellyfin and self.strict:
+            return 500, {"error": "Jellyfin hostname already configured"}
+        self.jellyfin = body
+        return 200, {"id": 1, "username": (body or {}).get("username")}
+
+    def list_services(self, service, **_):
+        return 200, self.services[service]
+
+    def add_service(self, service, body, **_):
+        item = {**(body or {}), "id": len(self.services[service])}
+        self.services[service].append(item)
+        return 201, item
+
+    def save(self, key):
+        def handler(body, **_):
+            self.settings[key] = body
+            return 200, body or {}
+        return handler
+
+
+# Homarr
+
+
+class FakeHomarr(FakeApp):
+    name = "homarr"
+
+    def __init__(self, **kwargs):
+        self.owner = None
+        self.csrf_tokens = set()
+        self.sessions = set()
+        self.boards = []
+        super().__init__(**kwargs)
+
+    def routes(self):
+        self.route("POST", "/api/trpc/user.createOwnerAccount", self.create_owner)
+        self.route("GET", "/api/auth/csrf", self.csrf)
+        self.route("POST", "/api/auth/callback/credentials", self.login)
+        self.route("POST", "/api/trpc/config.save", self.save_config)
+
+    def create_owner(self, body, **_):
+        if self.owner:
+            return 403, [{"error": {"json": {"message": "Owner account already exists"}}}]
+        self.owner = ((body or {}).get("0") or {}).get("json") or {}
+        return 200, [{"result": {"data": {"json": None}}}]
+
+    def csrf(self, **_):
+        token = uuid.uuid4().hex
+        self.csrf_tokens.add(token)
+        return 200, {"csrfToken": token}, {"Set-Cookie": f"next-auth.csrf-token={token}; Path=/; HttpOnly"}
+
+    def login(self, body, **_):
+        form = dict(body or [])
+        if form.get("csrfToken") not in self.csrf_tokens:
+            return 403, {"message": "Invalid CSRF token"}
+        owner = self.owner or {}
+        if form.get("name") != owner.get("username") or form.get("password") != owner.get("password"):
+            return 401, {"url": "/api/auth/error?error=CredentialsSignin"}
+        session = uuid.uuid4().hex
+        self.sessions.add(session)
+        return 200, {"url": "/"}, {"Set-Cookie": f"next-auth.session-token={session}; Path=/; HttpOnly"}
+
+    def save_config(self, headers, body, **_):
+        if self.cookies(headers).get("next-auth.session-token") not in self.sessions:
+            return 401, [{"error": {"json": {"message": "UNAUTHORIZED"}}}]
+        self.boards.append(body)
+        return 200, [{"result": {"data": {"json": None}}}]
+
+
+# qBittorrent
+
+
+class FakeQBittorrent(FakeApp):
+    name = "qbittorrent"
+
+    # Defaults of a fresh qBittorrent for the preferences the chart manages.
+    DEFAULT_PREFERENCES = {
+        "dl_limit": 0,
+        "up_limit": 0,
+        "alt_dl_limit": 10240,
+        "alt_up_limit": 10240,
+        "scheduler_enabled": False,
+        "schedule_from_hour": 8,
+        "schedule_from_min": 0,
+        "schedule_to_hour": 20,
+        "schedule_to_min": 0,
+        "scheduler_days": 0,
+    }
+
+    # States listed by the `downloading` filter of `torrents/info` (TorrentImpl::isDownloading()),
+    # stopped downloads included.
+    DOWNLOADING_STATES = (
+        "downloading", "metaDL", "forcedMetaDL", "forcedDL", "stalledDL", "queuedDL", "checkingDL", "pausedDL",
+        "stoppedDL",
+    )
+
+    def __init__(
+        self, username: str, password: str, csrf_protection: bool = False, webapi_version: str = "2.11.2", **kwargs
+    ):
+        self.username = username
+        self.password = password
+        self.csrf_protection = csrf_protection
+        self.webapi_version = webapi_version
+        self.sessions = set()
+        self.preferences = dict(self.DEFAULT_PREFERENCES)
+        # hash -> {"hash", "name", "state", "tags"}, tags being a comma separated string like the API's
+        self.torrents = {}
+        super().__init__(**kwargs)
+
+    def add_torrent(self, name: str, state: str = "downloading") -> str:
+        torrent_hash = uuid.uuid4().hex + uuid.uuid4().hex[:8]
+        self.torrents[torrent_hash] = {"hash": torrent_hash, "name": name, "state": state, "tags": ""}
+        return torrent_hash
+
+    def routes(self):
+        self.route("GET", "/", lambda **_: (200, "<html>qBittorrent login</html>"))
+        self.route("POST", "/api/v2/auth/login", self.login)
+        self.route("GET", "/api/v2/app/version", lambda **_: (200, "v4.6.7"))
+        self.route("GET", "/api/v2/app/preferences", lambda **_: (200, dict(self.preferences)))
+        self.route("POST", "/api/v2/app/setPreferences", self.set_preferences)
+        self.route("GET", "/api/v2/app/webapiVersion", lambda **_: (200, self.webapi_version))
+        self.route("GET", "/api/v2/torrents/info", self.list_torrents)
+        # WebUI API 2.11 (qBittorrent 5) renamed pause/resume to stop/start.
+        if tuple(int(part) for part in self.webapi_version.split(".")) >= (2, 11):
+            actions = {"stop": "stoppedDL", "start": "downloading"}
+        else:
+            actions = {"pause": "pausedDL", "resume": "downloading"}
+        for action, state in actions.items():
+            self.route("POST", f"/api/v2/torrents/{action}", self.set_state(state))
+        self.route("POST", "/api/v2/torrents/addTags", self.tag(add=True))
+        self.route("POST", "/api/v2/torrents/removeTags", self.tag(add=False))
+
+    def dispatch(self, method, path, query, headers, body):
+        if self.csrf_protection and path.startswith("/api/"):
+            referer = urlsplit(headers.get("Origin") or headers.get("Referer") or "").netloc
+            if referer != headers.get("Host"):
+                return 401, "Unauthorized", {}
+        public = path in ("/", "/api/v2/auth/login")
+        if not public and self.cookies(headers).get("SID") not in self.sessions:
+            return 403, "Forbidden", {}
+        return super().dispatch(method, path, query, headers, body)
+
+    def login(self, body, **_):
+        form = dict(body or [])
+        if form.get("username") != self.username or form.get("password") != self.password:
+            return 200, "Fails."
+        session = uuid.uuid4().hex
+        self.sessions.add(session)
+        return 200, "Ok.", {"Set-Cookie": f"SID={session}; HttpOnly; path=/; SameSite=Strict"}
+
+    def set_preferences(self, body, **_):
+        changes = json.loads(dict(body or []).get("json") or "{}")
+        # Like qBittorrent, unknown preferences are ignored.
+        self.preferences.update({key: value for key, value in changes.items() if key in self.preferences})
+        return 200, ""
+
+    @staticmethod
+    def tags_of(torrent: dict) -> list:
+        return [tag.strip() for tag in torrent["tags"].split(",") if tag.strip()]
+
+    def selected(self, body) -> list:
+        hashes = dict(body or []).get("hashes") or ""
+        if hashes == "all":
+            return list(self.torrents.values())
+        return [self.torrents[item] for item in hashes.split("|") if item in self.torrents]
+
+    def list_torrents(self, query, **_):
+        torrents = list(self.torrents.values())
+        if query.get("filter") == "downloading":
+            torrents = [torrent for torrent in torrents if torrent["state"] in self.DOWNLOADING_STATES]
+        if "tag" in query:
+            torrents = [torrent for torrent in torrents if query["tag"] in self.tags_of(torrent)]
+        return 200, [dict(torrent) for torrent in torrents]
+
+    def set_state(self, state: str):
+        def handler(body, **_):
+            for torrent in self.selected(body):
+                torrent["state"] = state
+            return 200, ""
+        return handler
+
+    def tag(self, add: bool):
+        def handler(body, **_):
+            tags = [tag.strip() for tag in dict(body or []).get("tags", "").split(",") if tag.strip()]
+            for torrent in self.selected(body):
+                current = self.tags_of(torrent)
+                if add:
+                    current.extend(tag for tag in tags if tag not in current)
+                else:
+                    current = [tag for tag in current if tag not in tags]
+                torrent["tags"] = ", ".join(current)
+            return 200, ""
+        return handler
@@ -0,0 +1,163 @@
+"""Incremental sync of the custom Prowlarr definitions from GitHub or a bundle."""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+
+import fakearr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_definitions import BundleSource, DefinitionSync, GitHubSource, blob_id  # noqa: E402
+from servarr_http import HTTPClient  # noqa: E402
+
+
+DEFINITIONS = {
+    "knaben.yml": "id: knaben\nname: Knaben\n",
+    "torrentgalaxy.yml": "id: torrentgalaxy\nname: TorrentGalaxy\n",
+}
+
+
+class FakeGitHub(fakearr.FakeApp):
+    """Contents API of one repository directory, answering 304 to a listing with the current ETag."""
+
+    name = "github"
+
+    def __init__(self, files: dict, **kwargs):
+        self.files = dict(files)
+        # Names whose download does not match the listed blob id
+        self.tampered = set()
+        self.url = None
+        super().__init__(**kwargs)
+
+    def routes(self):
+        self.route("GET", "/repos/owner/definitions/contents/custom", self.contents)
+        self.route("GET", "/repos/owner/definitions/git/blobs/(?P<sha>[0-9a-f]+)", self.blob)
+        self.route("GET", "/raw/(?P<name>[^/]+)", self.raw)
+
+    def etag(self) -> str:
+        return '"{}"'.format(blob_id(json.dumps(self.files, sort_keys=True).encode("utf-8")))
+
+    def contents(self, headers, **_):
+        if headers.get("If-None-Match") == self.etag():
+            return 304, None, {"ETag": self.etag()}
+        listing = [
+            {"type": "file", "name": name, "sha": blob_id(content.encode("utf-8")), "download_url": f"{self.url}/raw/{name}"}
+            for name, content in sorted(self.files.items())
+        ]
+        listing.append({"type": "dir", "name": "drafts", "sha": "0" * 40, "download_url": None})
+        return 200, listing, {"ETag": self.etag()}
+
+    def blob(self, sha, **_):
+        for content in self.files.values():
+            if blob_id(content.encode("utf-8")) == sha:
+                return 200, content
+        return 404, {"message": "Not Found"}
+
+    def raw(self, name, **_):
+        if name not in self.files:
+            return 404, {"message": "Not Found"}
+        return 200, "tampered\n" if name in self.tampered else self.files[name]
+
+
+class DefinitionSyncTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.target = os.path.join(self.directory, "Definitions", "Custom")
+        self.state_path = os.path.join(self.directory, ".servarr-init", "prowlarr-definitions.json")
+        self.logger = logging.getLogger("test_definitions")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+
+        self.app = FakeGitHub(DEFINITIONS)
+        self.server = fakearr.serve(self.app)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.app.url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.client = HTTPClient(logger=self.logger)
+        self.addCleanup(self.client.close)
+
+    def github(self) -> GitHubSource:
+        return GitHubSource(self.client, "owner/definitions", "main", "/custom/", api_url=self.app.url)
+
+    def sync(self, source) -> dict:
+        return DefinitionSync(self.target, self.state_path, logger=self.logger).sync(source)
+
+    def read(self, name: str) -> str:
+        with open(os.path.join(self.target, name), encoding="utf-8") as handle:
+            return handle.read()
+
+    def requests(self, endpoint: str) -> int:
+        return self.app.stats.snapshot()["endpoints"].get(endpoint, 0)
+
+    def test_only_changed_files_are_written(self):
+        self.assertEqual(self.sync(self.github())["written"], ["knaben.yml", "torrentgalaxy.yml"])
+        self.assertEqual(self.read("knaben.yml"), DEFINITIONS["knaben.yml"])
+
+        self.app.files["knaben.yml"] = "id: knaben\nname: Knaben (mirror)\n"
+        changes = self.sync(self.github())
+        self.assertEqual(changes["written"], ["knaben.yml"])
+        self.assertEqual(changes["unchanged"], ["torrentgalaxy.yml"])
+        self.assertEqual(self.requests("GET /raw/torrentgalaxy.yml"), 1)
+        self.assertEqual(self.read("knaben.yml"), self.app.files["knaben.yml"])
+
+    def test_only_managed_files_are_removed(self):
+        self.sync(self.github())
+        with open(os.path.join(self.target, "hand-made.yml"), "w") as handle:
+            handle.write("id: hand-made\n")
+
+        del self.app.files["torrentgalaxy.yml"]
+        changes = self.sync(self.github())
+        self.assertEqual(changes["removed"], ["torrentgalaxy.yml"])
+        self.assertEqual(sorted(os.listdir(self.target)), ["hand-made.yml", "knaben.yml"])
+
+    def test_not_modified_listing_reuses_the_saved_manifest(self):
+        self.sync(self.github())
+        os.remove(os.path.join(self.target, "knaben.yml"))
+
+        changes = self.sync(self.github())
+        self.assertEqual(self.requests("GET /repos/owner/definitions/contents/custom"), 2)
+        self.assertEqual(changes["written"], ["knaben.yml"])
+        self.assertEqual(changes["unchanged"], ["torrentgalaxy.yml"])
+        self.assertEqual(self.read("knaben.yml"), DEFINITIONS["knaben.yml"])
+        # Without a fresh listing the file is fetched by its blob id
+        blob = blob_id(DEFINITIONS["knaben.yml"].encode("utf-8"))
+        self.assertEqual(self.requests("GET /raw/knaben.yml"), 1)
+        self.assertEqual(self.requests(f"GET /repos/owner/definitions/git/blobs/{blob}"), 1)
+
+    def test_content_not_matching_its_blob_id_is_rejected(self):
+        self.app.tampered.add("knaben.yml")
+        with self.assertRaisesRegex(ValueError, "knaben.yml does not match"):
+            self.sync(self.github())
+        self.assertFalse(os.path.exists(os.path.join(self.target, "knaben.yml")))
+
+    def test_directory_and_tar_bundles(self):
+        bundle = os.path.join(self.directory, "bundle")
+        os.mkdir(bundle)
+        for name, content in {**DEFINITIONS, "README.md": "not a definition\n", ".hidden.yml": "id: hidden\n"}.items():
+            with open(os.path.join(bundle, name), "w") as handle:
+                handle.write(content)
+        archive = os.path.join(self.directory, "definitions.tar.gz")
+        with tarfile.open(archive, "w:gz") as tar:
+            tar.add(bundle, arcname="definitions")
+
+        for source in (BundleSource(bundle), BundleSource(archive)):
+            with self.subTest(source=source.describe()):
+                shutil.rmtree(self.target, True)
+                self.assertEqual(self.sync(source)["written"], ["knaben.yml", "torrentgalaxy.yml"])
+                self.assertEqual(sorted(os.listdir(self.target)), ["knaben.yml", "torrentgalaxy.yml"])
+                self.assertEqual(self.read("torrentgalaxy.yml"), DEFINITIONS["torrentgalaxy.yml"])
+
+        with self.assertRaisesRegex(ValueError, "neither a directory nor a tar archive"):
+            BundleSource(os.path.join(bundle, "README.md")).manifest()
+
+
+if __name__ == "__main__":
+    unittest.main()
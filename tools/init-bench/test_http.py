@@ -0,0 +1,81 @@
+"""The pooled client only replays requests the server cannot have acted on."""
+
+import os
+import socket
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_http import HTTPClient, RequestException  # noqa: E402
+
+
+ANSWER = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: keep-alive\r\n\r\nok"
+
+
+class OneAnswerServer:
+    """Answers the first request of every connection, then reads the next one and hangs up without answering."""
+
+    def __init__(self):
+        self.requests = []
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen()
+        self.url = "http://127.0.0.1:{}/".format(self.socket.getsockname()[1])
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self.socket.accept()
+            except OSError:
+                return
+            with connection:
+                for answer in (ANSWER, None):
+                    request = self._read(connection)
+                    if not request:
+                        break
+                    self.requests.append(request.split(b" ", 1)[0].decode())
+                    if answer:
+                        connection.sendall(answer)
+
+    @staticmethod
+    def _read(connection) -> bytes:
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = connection.recv(65536)
+            if not chunk:
+                return data
+            data += chunk
+        return data
+
+    def close(self):
+        self.socket.close()
+
+
+class StaleConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = OneAnswerServer()
+        self.addCleanup(self.server.close)
+        self.client = HTTPClient()
+        self.addCleanup(self.client.close)
+
+    def test_get_is_sent_again_on_a_new_connection(self):
+        self.client.get(self.server.url)
+        response = self.client.get(self.server.url)
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(response.retries, 1)
+        self.assertEqual(self.server.requests, ["GET", "GET", "GET"])
+
+    def test_post_is_not_replayed(self):
+        self.client.get(self.server.url)
+        with self.assertRaises(RequestException):
+            self.client.post(self.server.url, json={"name": "indexer"})
+        # The server got the POST once and may have acted on it
+        self.assertEqual(self.server.requests, ["GET", "POST"])
+
+
+if __name__ == "__main__":
+    unittest.main()
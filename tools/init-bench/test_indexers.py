@@ -0,0 +1,139 @@
+"""Streamed reading of the indexer declarations (JSON arrays, JSON lines, gzip files) and the schema download."""
+
+import gzip
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import fakearr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+import servarr_indexers  # noqa: E402
+from servarr_http import HTTPClient, HTTPError  # noqa: E402
+from servarr_indexers import IndexerSchema, _decode_stream, read_declarations  # noqa: E402
+
+
+API_KEY = "test-api-key"
+
+
+INDEXERS = [
+    {"name": "1337x", "body": {"priority": 25, "tags": ["flare"]}},
+    {"name": "Knaben", "body": {"priority": 12345, "fields": [{"name": "baseUrl", "value": "https://knaben.eu/"}]}},
+    {"name": "The \"Pirate\" Bay", "body": {"appProfileId": 1, "enable": True}},
+]
+
+
+class DecodeStreamTest(unittest.TestCase):
+    def setUp(self):
+        # Blocks of a few characters split values, strings and numbers across reads
+        patcher = mock.patch.object(servarr_indexers, "READ_SIZE", 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def decode(self, text: str) -> list:
+        return list(_decode_stream(io.StringIO(text)))
+
+    def test_json_array(self):
+        self.assertEqual(self.decode(json.dumps(INDEXERS, indent=2)), INDEXERS)
+        self.assertEqual(self.decode(" [ ] "), [])
+
+    def test_json_lines(self):
+        text = "\n".join(json.dumps(indexer) for indexer in INDEXERS) + "\n"
+        self.assertEqual(self.decode(text), INDEXERS)
+        # A number ending exactly at the end of a block continues in the next one
+        self.assertEqual(self.decode("1234567890 42"), [1234567890, 42])
+
+    def test_malformed_arrays(self):
+        for text in ('[{"name": "a"}', '[{"name": "a"} {"name": "b"}]', '[1] 2', '[1,, 2]', '{"name": '):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                self.decode(text)
+
+
+class ReadDeclarationsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+
+    def test_directory_of_plain_and_gzip_files(self):
+        with open(os.path.join(self.directory, "indexers-000.json"), "w") as handle:
+            json.dump(INDEXERS[:2], handle)
+        with gzip.open(os.path.join(self.directory, "indexers-001.json.gz"), "wt") as handle:
+            handle.write(json.dumps(INDEXERS[2]) + "\n")
+        self.assertEqual(list(read_declarations(self.directory)), INDEXERS)
+        self.assertEqual(list(read_declarations(os.path.join(self.directory, "missing"))), [])
+
+    def test_errors_name_the_file(self):
+        path = os.path.join(self.directory, "indexers.json")
+        with open(path, "w") as handle:
+            handle.write('["not an indexer"]')
+        with self.assertRaisesRegex(ValueError, "indexers.json: expected an indexer object"):
+            list(read_declarations(path))
+
+
+class OverloadedProwlarr(fakearr.FakeServarr):
+    """Prowlarr answering 503 to the first indexer schema download."""
+
+    def __init__(self, **kwargs):
+        self.schema_errors = 1
+        super().__init__("prowlarr", "v1", API_KEY, schemas={"indexer": [{"definitionName": "1337x", "fields": []}]},
+                         **kwargs)
+
+    def schema(self, collection, **kwargs):
+        if collection == "indexer" and self.schema_errors:
+            self.schema_errors -= 1
+            return 503, {"message": "Service Unavailable"}
+        return super().schema(collection, **kwargs)
+
+
+def retry(description: str, send):
+    """Like init-prowlarr's send_with_retries, without the backoff."""
+    for _ in range(3):
+        response = send()
+        if response.status_code != 503:
+            return response
+    return response
+
+
+class IndexerSchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.app = OverloadedProwlarr()
+        self.server = fakearr.serve(self.app)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.logger = logging.getLogger("test_indexers")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.client = HTTPClient(logger=self.logger)
+        self.addCleanup(self.client.close)
+
+    def schema(self, **kwargs) -> IndexerSchema:
+        return IndexerSchema(
+            self.client,
+            "http://127.0.0.1:{}/api/v1".format(self.server.server_address[1]),
+            {"X-Api-Key": API_KEY},
+            os.path.join(self.directory, "prowlarr-indexer-schema.json"),
+            logger=self.logger,
+            **kwargs,
+        )
+
+    def test_overloaded_schema_download_is_sent_again(self):
+        self.assertEqual(self.schema(retry=retry).template("1337x")["definitionName"], "1337x")
+        self.assertEqual(self.app.stats.snapshot()["endpoints"]["GET /api/v1/indexer/schema"], 2)
+
+    def test_without_retry_the_error_is_raised(self):
+        with self.assertRaises(HTTPError):
+            self.schema().template("1337x")
+
+
+if __name__ == "__main__":
+    unittest.main()
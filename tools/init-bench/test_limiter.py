@@ -0,0 +1,68 @@
+"""The adaptive concurrency limit used to add Prowlarr indexers."""
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_limiter import AdaptiveLimiter  # noqa: E402
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def complete(self, limiter: AdaptiveLimiter, status: int = 201, latency: float = 0.1):
+        limiter.acquire()
+        limiter.release(status, latency)
+
+    def test_grows_by_about_one_slot_per_round_up_to_the_maximum(self):
+        limiter = AdaptiveLimiter(maximum=4, latency_target=10)
+        self.assertEqual(int(limiter.limit), 1)
+        self.complete(limiter)
+        self.assertEqual(int(limiter.limit), 2)
+        for _ in range(3):
+            self.complete(limiter)
+        self.assertEqual(int(limiter.limit), 3)
+        for _ in range(20):
+            self.complete(limiter)
+        self.assertEqual(limiter.limit, 4.0)
+
+    def test_backs_off_on_overload_and_slow_calls(self):
+        limiter = AdaptiveLimiter(maximum=8, latency_target=10)
+        limiter.limit = 8.0
+        self.complete(limiter, status=503)
+        self.assertEqual(limiter.limit, 4.0)
+        self.complete(limiter, status=429)
+        self.assertEqual(limiter.limit, 2.0)
+        self.complete(limiter, latency=30)
+        self.assertEqual(limiter.limit, 1.5)
+        # Connection errors count as overload; the limit never drops below one call
+        self.complete(limiter, status=0)
+        self.complete(limiter, status=0)
+        self.assertEqual(limiter.limit, 1.0)
+
+    def test_invalid_request_is_not_overload(self):
+        limiter = AdaptiveLimiter(maximum=4, latency_target=10)
+        self.complete(limiter, status=400)
+        self.assertEqual(int(limiter.limit), 2)
+
+    def test_acquire_waits_for_a_free_slot(self):
+        limiter = AdaptiveLimiter(maximum=4, latency_target=10)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def second():
+            limiter.acquire()
+            acquired.set()
+
+        worker = threading.Thread(target=second, daemon=True)
+        worker.start()
+        self.assertFalse(acquired.wait(0.2))
+        limiter.release(201, 0.1)
+        self.assertTrue(acquired.wait(5))
+        worker.join(5)
+
+
+if __name__ == "__main__":
+    unittest.main()
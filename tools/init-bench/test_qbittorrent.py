@@ -0,0 +1,98 @@
+"""Bandwidth preferences pushed through the qBittorrent WebUI API, against the fake qBittorrent."""
+
+import logging
+import os
+import sys
+import unittest
+
+import fakearr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_http import HTTPClient  # noqa: E402
+from servarr_qbittorrent import QBittorrentClient, bandwidth_preferences  # noqa: E402
+
+
+USERNAME = "admin"
+PASSWORD = "bench-password"
+
+BANDWIDTH = {
+    "altDownloadLimit": 2048,
+    "altUploadLimit": 512,
+    "schedule": {"enabled": True, "from": "22:30", "to": "7:00", "days": "weekdays"},
+}
+
+
+class BandwidthPreferencesTest(unittest.TestCase):
+    def test_schedule_window_and_limits(self):
+        preferences = bandwidth_preferences(BANDWIDTH)
+        self.assertEqual(preferences["alt_dl_limit"], 2048 * 1024)
+        self.assertEqual(preferences["alt_up_limit"], 512 * 1024)
+        self.assertEqual(
+            (preferences["schedule_from_hour"], preferences["schedule_from_min"],
+             preferences["schedule_to_hour"], preferences["schedule_to_min"]),
+            (22, 30, 7, 0),
+        )
+        self.assertEqual(preferences["scheduler_days"], 1)
+        # Without a schedule the window is left as qBittorrent has it
+        self.assertEqual(
+            sorted(bandwidth_preferences({"altDownloadLimit": 1})),
+            ["alt_dl_limit", "alt_up_limit", "scheduler_enabled"],
+        )
+
+    def test_invalid_settings_are_rejected(self):
+        invalid = [
+            {"schedule": {"enabled": True, "from": "08:00", "to": "08:00"}},
+            {"schedule": {"enabled": True, "from": "24:00", "to": "08:00"}},
+            {"schedule": {"enabled": True, "from": "8h", "to": "20:00"}},
+            {"schedule": {"enabled": True, "from": "08:60", "to": "20:00"}},
+            {"schedule": {"enabled": True, "days": "holidays"}},
+            {"altDownloadLimit": -1},
+            {"altUploadLimit": "fast"},
+        ]
+        for config in invalid:
+            with self.subTest(config=config), self.assertRaises(ValueError):
+                bandwidth_preferences(config)
+
+
+class ApplyPreferencesTest(unittest.TestCase):
+    def setUp(self):
+        self.app = fakearr.FakeQBittorrent(USERNAME, PASSWORD)
+        self.server = fakearr.serve(self.app)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        logger = logging.getLogger("test_qbittorrent")
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        self.client = HTTPClient(logger=logger)
+        self.addCleanup(self.client.close)
+        url = "http://127.0.0.1:{}".format(self.server.server_address[1])
+        self.qbittorrent = QBittorrentClient(self.client, url, logger=logger)
+        self.qbittorrent.login(USERNAME, PASSWORD)
+
+    def set_preferences_calls(self) -> int:
+        return self.app.stats.snapshot()["endpoints"].get("POST /api/v2/app/setPreferences", 0)
+
+    def test_second_run_sends_nothing(self):
+        desired = bandwidth_preferences(BANDWIDTH)
+        changed = self.qbittorrent.apply_preferences(desired)
+        self.assertIn("scheduler_enabled", changed)
+        self.assertNotIn("schedule_to_min", changed)
+        self.assertEqual(self.set_preferences_calls(), 1)
+        self.assertEqual(self.app.preferences["alt_dl_limit"], 2048 * 1024)
+
+        self.assertEqual(self.qbittorrent.apply_preferences(desired), [])
+        self.assertEqual(self.set_preferences_calls(), 1)
+
+    def test_only_changed_preferences_are_sent(self):
+        desired = bandwidth_preferences(BANDWIDTH)
+        self.qbittorrent.apply_preferences(desired)
+        # Changed by hand in the WebUI: put back to the chart's value
+        self.app.preferences["alt_up_limit"] = 0
+        self.assertEqual(self.qbittorrent.apply_preferences(desired), ["alt_up_limit"])
+        self.assertEqual(self.set_preferences_calls(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+"""The pre-install qBittorrent job: qBittorrent.conf merge and ownership walk of the config volume."""
+
+import importlib.util
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+SCRIPTS = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                       "servarr", "config", "scripts")
+
+# The job is a standalone script (the hook mounts only this file); main() only runs when it is executed
+spec = importlib.util.spec_from_file_location("init_qbittorrent", os.path.join(SCRIPTS, "init-qbittorrent.py"))
+init_qbittorrent = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(init_qbittorrent)
+
+
+CURRENT_CONF = r"""[Application]
+FileLogger\Enabled=true
+
+[BitTorrent]
+Session\DefaultSavePath=/downloads
+Session\MaxActiveDownloads=9
+Session\GlobalDLSpeedLimit=5000
+
+[Preferences]
+WebUI\Username=old-admin
+; comment=kept
+WebUI\Locale=fr
+"""
+
+
+class MergeConfTest(unittest.TestCase):
+    def test_parse_conf_reads_sections_in_order(self):
+        conf = init_qbittorrent.parse_conf(CURRENT_CONF)
+        self.assertEqual(list(conf), ["Application", "BitTorrent", "Preferences"])
+        self.assertEqual(conf["BitTorrent"]["Session\\MaxActiveDownloads"], "9")
+        self.assertNotIn("; comment", conf["Preferences"])
+
+    def test_keeps_user_edited_keys(self):
+        merged = init_qbittorrent.merge_conf(CURRENT_CONF, {
+            "BitTorrent": {"Session\\DefaultSavePath": "/downloads", "Session\\TempPathEnabled": "true"},
+            "Preferences": {"WebUI\\Username": "admin"},
+            "LegalNotice": {"Accepted": "true"},
+        })
+        conf = init_qbittorrent.parse_conf(merged)
+
+        # Keys the chart does not manage stay as qBittorrent or its users left them
+        self.assertEqual(conf["BitTorrent"]["Session\\MaxActiveDownloads"], "9")
+        self.assertEqual(conf["BitTorrent"]["Session\\GlobalDLSpeedLimit"], "5000")
+        self.assertEqual(conf["Preferences"]["WebUI\\Locale"], "fr")
+        self.assertIn("; comment=kept", merged)
+        # Managed keys are set in place, missing ones appended to their section, missing sections to the file
+        self.assertEqual(conf["Preferences"]["WebUI\\Username"], "admin")
+        self.assertEqual(conf["BitTorrent"]["Session\\TempPathEnabled"], "true")
+        self.assertEqual(list(conf), ["Application", "BitTorrent", "Preferences", "LegalNotice"])
+        self.assertIn("Session\\TempPathEnabled=true\n\n[Preferences]", merged)
+
+    def test_merging_again_changes_nothing(self):
+        managed = {"BitTorrent": {"Session\\TempPathEnabled": "true"}, "Meta": {"MigrationVersion": "6"}}
+        merged = init_qbittorrent.merge_conf(CURRENT_CONF, managed)
+        self.assertEqual(init_qbittorrent.merge_conf(merged, managed), merged)
+
+
+class FixOwnershipTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.uid, self.gid = os.getuid(), os.getgid()
+        os.makedirs(os.path.join(self.root, "qBittorrent", "BT_backup"))
+        for name in ("qBittorrent.conf", os.path.join("BT_backup", "a.fastresume"),
+                     os.path.join("BT_backup", "b.fastresume")):
+            with open(os.path.join(self.root, "qBittorrent", name), "w") as handle:
+                handle.write("x")
+
+    def mode(self, *parts) -> int:
+        return stat.S_IMODE(os.lstat(os.path.join(self.root, *parts)).st_mode)
+
+    def test_fixes_entries_in_unchanged_listings(self):
+        counts = init_qbittorrent.fix_ownership(self.root, self.uid, self.gid)
+        self.assertEqual(counts["checked"], 6)
+
+        # A manual chmod changes neither the file's directory listing nor its mtime
+        conf = os.path.join(self.root, "qBittorrent", "qBittorrent.conf")
+        os.chmod(conf, 0o044)
+        counts = init_qbittorrent.fix_ownership(self.root, self.uid, self.gid)
+        self.assertEqual((counts["checked"], counts["changed"]), (6, 1))
+        self.assertEqual(self.mode("qBittorrent", "qBittorrent.conf"), 0o644)
+
+    def test_skips_entries_that_vanish_during_the_walk(self):
+        directory = os.path.join(self.root, "qBittorrent")
+        conf = os.path.join(directory, "qBittorrent.conf")
+        os.chmod(conf, 0o400)
+        chmod = os.chmod
+
+        def replaced(path, mode):
+            if path == conf:
+                # qBittorrent renames its files over the old ones and drops finished directories meanwhile
+                os.remove(conf)
+                shutil.rmtree(os.path.join(directory, "BT_backup"))
+            chmod(path, mode)
+
+        with mock.patch("os.chmod", side_effect=replaced):
+            counts = init_qbittorrent.fix_ownership(self.root, self.uid, self.gid)
+        # The configuration file, then BT_backup whether it was listed before or after it
+        self.assertEqual(counts["vanished"], 2)
+
+        with mock.patch("os.scandir", side_effect=FileNotFoundError):
+            counts = init_qbittorrent.fix_ownership(self.root, self.uid, self.gid)
+        self.assertEqual((counts["checked"], counts["vanished"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
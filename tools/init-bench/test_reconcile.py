@@ -0,0 +1,106 @@
+"""Reconciling against the fake Servarr API writes nothing once the resources match."""
+
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import fakearr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_http import HTTPClient  # noqa: E402
+from servarr_reconcile import Collection, SecretStore  # noqa: E402
+from servarr_resources import DownloadClient, RemotePathMapping, RootFolder  # noqa: E402
+from servarr_state import fingerprint  # noqa: E402
+
+
+API_KEY = "test-api-key"
+
+DOWNLOAD_CLIENT = {
+    "enable": True,
+    "protocol": "torrent",
+    "priority": 1,
+    "removeCompletedDownloads": True,
+    "name": "qBittorrent",
+    "fields": [
+        {"name": "host", "value": "qbittorrent"},
+        {"name": "port", "value": "10095"},
+        {"name": "urlBase"},
+        {"name": "username", "value": "admin"},
+        {"name": "password", "value": "secret"},
+    ],
+}
+
+
+class SecondReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.app = fakearr.FakeServarr("sonarr", "v3", API_KEY)
+        self.server = fakearr.serve(self.app)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.api_url = "http://127.0.0.1:{}/api/v3".format(self.server.server_address[1])
+        self.logger = logging.getLogger("test_reconcile")
+        self.logger.addHandler(logging.NullHandler())
+        self.logger.propagate = False
+        self.client = HTTPClient(logger=self.logger, headers={"x-api-key": API_KEY})
+        self.addCleanup(self.client.close)
+        self.secrets = SecretStore(None, self.logger)
+
+    def reconcile(self, resource_class, body, secrets=None):
+        collection = Collection(self.client, self.api_url, resource_class, resource_class.__name__,
+                                logger=self.logger, secrets=secrets)
+        return collection.reconcile(body)
+
+    def reconcile_all(self):
+        self.reconcile(DownloadClient, DOWNLOAD_CLIENT, self.secrets)
+        self.reconcile(RemotePathMapping, {"host": "qbittorrent", "remotePath": "/downloads", "localPath": "/mnt/downloads"})
+        self.reconcile(RootFolder, {"path": "/mnt/media/tv"})
+
+    def writes(self) -> dict:
+        endpoints = self.app.stats.snapshot()["endpoints"]
+        return {endpoint: count for endpoint, count in endpoints.items() if not endpoint.startswith("GET ")}
+
+    def test_second_reconcile_makes_no_put(self):
+        self.reconcile_all()
+        first = self.writes()
+        self.assertEqual(first.get("POST /api/v3/remotepathmapping"), 1)
+        self.assertEqual(self.app.collections["remotepathmapping"][0]["remotePath"], "/downloads/")
+
+        self.reconcile_all()
+        self.assertEqual(self.writes(), first)
+
+    def test_unreported_setting_is_not_drift(self):
+        self.reconcile(DownloadClient, DOWNLOAD_CLIENT, self.secrets)
+        # Versions that do not know a setting leave it out of their responses
+        del self.app.collections["downloadclient"][0]["removeCompletedDownloads"]
+        first = self.writes()
+
+        self.reconcile(DownloadClient, DOWNLOAD_CLIENT, self.secrets)
+        self.assertEqual(self.writes(), first)
+
+    def test_changed_path_is_updated(self):
+        self.reconcile(RemotePathMapping, {"host": "qbittorrent", "remotePath": "/downloads", "localPath": "/mnt/downloads"})
+        self.reconcile(RemotePathMapping, {"host": "qbittorrent", "remotePath": "/downloads/", "localPath": "/mnt/other"})
+        self.assertEqual(self.writes().get("PUT /api/v3/remotepathmapping/{id}"), 1)
+        self.assertEqual(self.app.collections["remotepathmapping"][0]["localPath"], "/mnt/other/")
+
+
+    def test_saved_secrets_are_salted(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        path = os.path.join(directory, "sonarr-secrets.json")
+        values = {"password": "secret"}
+        SecretStore(path, self.logger).remember("downloadclient qBittorrent", values)
+
+        with open(path) as handle:
+            self.assertNotIn(fingerprint("downloadclient qBittorrent", values), handle.read())
+        self.assertTrue(SecretStore(path, self.logger).matches("downloadclient qBittorrent", values))
+        self.assertFalse(SecretStore(path, self.logger).matches("downloadclient qBittorrent", {"password": "other"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+"""Markers and checkpoints the init scripts keep under `.servarr-init/`."""
+
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_state import AppliedState, Checkpoint, fingerprint  # noqa: E402
+
+
+logger = logging.getLogger("test_state")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+
+class AppliedStateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, ".servarr-init", "app-applied.json")
+
+    def test_recorded_state_is_salted(self):
+        desired = fingerprint(b"script", ["api-key", "password"])
+        AppliedState(self.path, desired).record()
+        with open(self.path) as handle:
+            saved = json.load(handle)
+
+        self.assertNotIn(desired, json.dumps(saved))
+        self.assertTrue(AppliedState(self.path, desired).unchanged())
+        self.assertFalse(AppliedState(self.path, fingerprint(b"script", ["api-key", "other"])).unchanged())
+
+        # Every record draws a new salt
+        AppliedState(self.path, desired).record()
+        with open(self.path) as handle:
+            self.assertNotEqual(json.load(handle)["fingerprint"], saved["fingerprint"])
+
+    def test_unsalted_marker_is_applied_again(self):
+        desired = fingerprint(b"script")
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as handle:
+            json.dump({"fingerprint": desired, "applied": 0}, handle)
+        self.assertFalse(AppliedState(self.path, desired).unchanged())
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.path = os.path.join(self.directory, ".servarr-init", "prowlarr-checkpoint.json")
+
+    def test_retried_run_resumes_after_the_completed_steps(self):
+        checkpoint = Checkpoint(self.path, "inputs", logger)
+        checkpoint.mark("tag:flare")
+        checkpoint.mark("indexer:1337x")
+        checkpoint.mark("sync:pending")
+        checkpoint.discard("sync:pending")
+
+        resumed = Checkpoint(self.path, "inputs", logger)
+        self.assertTrue(resumed.done("tag:flare"))
+        self.assertTrue(resumed.done("indexer:1337x"))
+        self.assertFalse(resumed.done("sync:pending"))
+
+    def test_other_inputs_start_from_scratch(self):
+        Checkpoint(self.path, "inputs", logger).mark("indexer:1337x")
+        self.assertFalse(Checkpoint(self.path, "new inputs", logger).done("indexer:1337x"))
+
+    def test_clear_forgets_the_progress(self):
+        checkpoint = Checkpoint(self.path, "inputs", logger)
+        checkpoint.mark("indexer:1337x")
+        checkpoint.clear()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(Checkpoint(self.path, "inputs", logger).done("indexer:1337x"))
+
+    def test_unusable_file_keeps_the_progress_in_memory(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as handle:
+            handle.write("{not json")
+        checkpoint = Checkpoint(self.path, "inputs", logger)
+        self.assertFalse(checkpoint.done("indexer:1337x"))
+
+        # A path that cannot be written (its directory is a file) only loses the persistence
+        blocked = Checkpoint(os.path.join(self.path, "checkpoint.json"), "inputs", logger)
+        blocked.mark("indexer:1337x")
+        self.assertTrue(blocked.done("indexer:1337x"))
+        self.assertIsNone(blocked.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
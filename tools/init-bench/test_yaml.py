@@ -0,0 +1,82 @@
+"""The config.yaml reader copes with what PyYAML actually writes."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                "servarr", "config", "scripts"))
+
+from servarr_yaml import parse_yaml_mappings  # noqa: E402
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+# Shaped like Bazarr's config.yaml: long strings, lists, nested lists
+CONFIG = {
+    "analytics": {"enabled": False},
+    "auth": {"apikey": "0123456789abcdef0123456789abcdef", "password": "", "type": None, "username": ""},
+    "general": {
+        "base_url": "",
+        "enabled_providers": ["opensubtitlescom", "podnapisi", "yifysubtitles"],
+        "ignore_pgs_subs": False,
+        "path_mappings": [["/mnt/media/tv", "/tv"], ["/mnt/media/movies", "/movies"]],
+        "postprocessing_cmd": "python3 /config/scripts/notify.py --title \"{{episode_name}}\" --subtitles "
+                              "{{subtitles}} --language {{subtitles_language}} --score {{score}} " * 2,
+        "serie_default_profile": "",
+    },
+    "opensubtitlescom": {"password": "p: a # ss", "use_hash": True, "username": "bench"},
+    "proxy": {"exclude": ["localhost", "127.0.0.1"], "port": "", "type": None},
+    "radarr": {"apikey": "fedcba9876543210fedcba9876543210", "ip": "radarr", "port": 7878},
+    "sonarr": {"apikey": "00112233445566778899aabbccddeeff", "ip": "sonarr", "port": 8989},
+}
+
+
+@unittest.skipIf(yaml is None, "PyYAML is needed to produce the sample")
+class SafeDumpTest(unittest.TestCase):
+    def test_reads_safe_dump_output(self):
+        text = yaml.safe_dump(CONFIG, width=80)
+        # The sample is only useful if it makes PyYAML wrap a scalar
+        self.assertIn("\n    ", text)
+        config = parse_yaml_mappings(text)
+
+        self.assertEqual(config["auth"]["apikey"], CONFIG["auth"]["apikey"])
+        self.assertIsNone(config["auth"]["type"])
+        self.assertEqual(config["sonarr"]["apikey"], CONFIG["sonarr"]["apikey"])
+        self.assertEqual(config["radarr"]["ip"], "radarr")
+        self.assertEqual(config["opensubtitlescom"]["password"], "p: a # ss")
+        self.assertIs(config["opensubtitlescom"]["use_hash"], True)
+        self.assertEqual(config["general"]["serie_default_profile"], "")
+        self.assertEqual(sorted(config["general"]), sorted(CONFIG["general"]))
+        self.assertEqual(sorted(config), sorted(CONFIG))
+
+
+class LenientTest(unittest.TestCase):
+    def test_skips_lines_it_does_not_understand(self):
+        config = parse_yaml_mappings(
+            "auth:\n"
+            "  apikey: abc\n"
+            "  note: a plain scalar\n"
+            "    continued on the next line\n"
+            "  quoted: \"first half\n"
+            "    second half\"\n"
+            "  not a mapping line\n"
+            "  url: http://example.com:8080\n"
+            "general:\n"
+            "- item\n"
+            "- key: value\n"
+            "  nested: value\n"
+        )
+        self.assertEqual(config["auth"]["apikey"], "abc")
+        self.assertEqual(config["auth"]["note"], "a plain scalar")
+        self.assertIsNone(config["auth"]["quoted"])
+        self.assertEqual(config["auth"]["url"], "http://example.com:8080")
+        self.assertNotIn("nested", config)
+        self.assertNotIn("key", config)
+
+
+if __name__ == "__main__":
+    unittest.main()